@@ -33,7 +33,7 @@ from qubesadmin.utils import parse_size
 
 from ..widgets.gtk_widgets import VMListModeler, \
     TextModeler, TraitSelector, NONE_CATEGORY
-from .page_handler import PageHandler
+from .page_handler import PageHandler, UnsavedChangesTracker
 from ..widgets.utils import get_feature, get_boolean_feature, \
     apply_feature_change
 
@@ -68,8 +68,9 @@ class KernelVersion:  # pylint: disable=too-few-public-methods
             return self_content < other_content
 
 
-class AbstractTraitHolder(abc.ABC):
-    """Handler for all sorts of widgets reflecting system traits."""
+class AbstractTraitHolder(UnsavedChangesTracker):
+    """Handler for all sorts of widgets reflecting system traits. Subclasses
+    should watch their widget for changes (see UnsavedChangesTracker)."""
     @abc.abstractmethod
     def get_model(self) -> TraitSelector:
         """Get the TraitSelector for current Trait."""
@@ -94,14 +95,13 @@ class AbstractTraitHolder(abc.ABC):
         """Save changes: update system value and mark it as new initial value"""
         self.update_current_value()
         self.get_model().update_initial()
+        self._mark_changed()
 
     def reset(self):
         """Reset selection to the initial value."""
         self.get_model().reset()
 
-    def get_unsaved(self):
-        """Get human-readable description of unsaved changes, or
-        empty string if none were found."""
+    def _find_unsaved(self) -> str:
         if self.is_changed():
             return self.get_readable_description()
         return ""
@@ -128,6 +128,7 @@ class PropertyHandler(AbstractTraitHolder):
             style_changes=True,
             additional_options=additional_options
         )
+        self._watch_for_changes(self.widget, 'changed')
 
     def get_readable_description(self) -> str:
         return self.readable_name
@@ -159,6 +160,7 @@ class FeatureHandler(AbstractTraitHolder):
             combobox=self.widget,
             values=options, selected_value=self.get_current_value(),
             style_changes=True)
+        self._watch_for_changes(self.widget, 'changed')
 
     def get_readable_description(self) -> str:
         return self.readable_name
@@ -257,7 +259,7 @@ class QMemManHelper:
                 qmemman_config_file.writelines(config_lines)
 
 
-class MemoryHandler:
+class MemoryHandler(UnsavedChangesTracker):
     """Handler for memory / QMemMan settings. Requires SpinButton widgets:
     'basics_min_memory' and 'basics_dom0_memory'"""
     def __init__(self, gtk_builder):
@@ -288,6 +290,9 @@ class MemoryHandler:
         self.dom0_memory_spin.set_value(
             self.initial_values.get(self.mem_helper.DOM0_NAME, 0))
 
+        self._watch_for_changes(self.min_memory_spin, 'value-changed')
+        self._watch_for_changes(self.dom0_memory_spin, 'value-changed')
+
     @staticmethod
     def get_readable_description() -> str:
         """Get human-readable description of the widget"""
@@ -304,6 +309,7 @@ class MemoryHandler:
         }
 
         self.mem_helper.save_values(values)
+        self._mark_changed()
 
     def reset(self):
         """Reset selection to the initial value."""
@@ -328,9 +334,7 @@ class MemoryHandler:
             return True
         return False
 
-    def get_unsaved(self):
-        """Get human-readable description of unsaved changes, or
-        empty string if none were found."""
+    def _find_unsaved(self) -> str:
         if self.is_changed():
             return self.get_readable_description()
         return ""
@@ -348,6 +352,7 @@ class KernelHolder(AbstractTraitHolder):
             selected_value=self.get_current_value(),
             style_changes=True
         )
+        self._watch_for_changes(self.widget, 'changed')
 
     def _get_kernel_options(self) -> Dict[str, str]:
         kernels = [kernel.vid for kernel in
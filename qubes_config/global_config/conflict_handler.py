@@ -18,7 +18,11 @@
 # You should have received a copy of the GNU Lesser General Public License along
 # with this program; if not, see <http://www.gnu.org/licenses/>.
 """Handle detecting and showing policy file conflicts."""
-from typing import List
+from concurrent.futures import Future
+from typing import List, Optional, Dict, Tuple, Set, NamedTuple
+
+from qrexec.policy.parser import Rule
+from qrexec.exc import PolicySyntaxError
 
 from .policy_manager import PolicyManager
 from ..widgets.gtk_utils import load_icon
@@ -26,7 +30,7 @@ from ..widgets.gtk_utils import load_icon
 import gi
 
 gi.require_version('Gtk', '3.0')
-from gi.repository import Gtk
+from gi.repository import Gtk, GLib
 
 
 class ConflictFileListRow(Gtk.ListBoxRow):
@@ -57,11 +61,199 @@ class ConflictFileListRow(Gtk.ListBoxRow):
         return self.label.get_text()
 
 
+class ConflictRuleListRow(Gtk.ListBoxRow):
+    """A ListBox row representing a rule from another policy file that
+    overrides (or may override) one of our rules."""
+    def __init__(self, conflict: 'RuleConflict'):
+        super().__init__()
+        self.conflict = conflict
+        self.box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
+        self.add(self.box)
+
+        self.get_style_context().add_class('problem_row')
+
+        self.label = Gtk.Label()
+        self.label.set_text(f'{conflict.file_name}:{conflict.lineno}')
+        self.label.get_style_context().add_class('red_code')
+        self.box.pack_start(self.label, False, False, 0)
+
+        self.rule_label = Gtk.Label()
+        if conflict.partial:
+            self.rule_label.set_text(f'may override: {conflict.rule}')
+        else:
+            self.rule_label.set_text(f'overrides: {conflict.rule}')
+        self.box.pack_start(self.rule_label, False, False, 10)
+
+        tooltip = f'The following rule, at line {conflict.lineno} of file ' \
+                  f'{conflict.file_name}, is evaluated first:\n' \
+                  f'{conflict.shadowing_rule}'
+        if conflict.partial:
+            tooltip += '\nIt matches some of the calls matched by our rule.'
+        self.set_tooltip_text(tooltip)
+
+    def __str__(self):
+        # pylint: disable=arguments-differ
+        return self.label.get_text()
+
+
+# service, argument, source, target
+RuleKey = Tuple[str, str, str, str]
+
+
+class RuleConflict(NamedTuple):
+    """One of our rules that is shadowed by a rule from another file.
+    If partial is True, the other rule matches only some of the calls
+    our rule matches (or it cannot be determined whether it matches all
+    of them)."""
+    rule: Rule
+    file_name: str
+    lineno: int
+    shadowing_rule: Rule
+    partial: bool = False
+
+
+class ConflictAnalyzer:
+    """
+    Index of rules from policy files loaded before ours, keyed by
+    (service, argument, source, target), used to find which of our rules
+    are shadowed, that is, will never be reached because an earlier rule
+    matches every call they match. Only matches that can be determined from
+    the tokens alone are found: same token, or @anyvm / * wildcards.
+
+    Rules that are not shadowed are also checked for earlier rules that
+    match some of their calls (such as a rule for a single qube, a tag or
+    a type, when ours is for @anyvm); those are reported as partial.
+    """
+    # tokens not matched by @anyvm
+    _NOT_ANYVM = {'@adminvm', 'dom0', '@default'}
+    _ADMINVM = {'@adminvm', 'dom0'}
+
+    def __init__(self):
+        # key -> (file number, line number, file name, rule), only the first
+        # rule (in load order) for each key is kept
+        self._index: Dict[RuleKey, Tuple[int, int, str, Rule]] = {}
+        # service -> all rules for that service, in load order
+        self._service_rules: Dict[str, List[Tuple[int, int, str, Rule]]] = {}
+        self._file_count = 0
+
+    @staticmethod
+    def rule_key(rule: Rule) -> RuleKey:
+        """Get index key of a rule; wildcards are represented as '*'."""
+        return (str(rule.service or '*'), str(rule.argument or '*'),
+                str(rule.source), str(rule.target))
+
+    def add_rules(self, file_name: str, rules: List[Rule]):
+        """Add rules of a file; files must be added in load order."""
+        for rule in rules:
+            key = self.rule_key(rule)
+            entry = (self._file_count, rule.lineno, file_name, rule)
+            self._index.setdefault(key, entry)
+            self._service_rules.setdefault(key[0], []).append(entry)
+        self._file_count += 1
+
+    @classmethod
+    def _matching_tokens(cls, token: str) -> Set[str]:
+        if token in ('@adminvm', 'dom0'):
+            return {'@adminvm', 'dom0'}
+        if token in cls._NOT_ANYVM:
+            return {token}
+        return {token, '@anyvm'}
+
+    @classmethod
+    def _tokens_overlap(cls, first: str, second: str) -> bool:
+        """Check if a call can match both tokens. Tokens that depend on
+        qube properties (@tag:, @type:, @dispvm...) are assumed to match
+        anything they could possibly match."""
+        if first == second:
+            return True
+        if first in cls._ADMINVM and second in cls._ADMINVM:
+            return True
+        if '@default' in (first, second):
+            return False
+        if '@anyvm' in (first, second):
+            other = second if first == '@anyvm' else first
+            return other not in cls._NOT_ANYVM
+        if first in cls._ADMINVM or second in cls._ADMINVM:
+            other = second if first in cls._ADMINVM else first
+            return other.startswith(('@tag:', '@type:'))
+        if not first.startswith('@') and not second.startswith('@'):
+            # two different qube names
+            return False
+        return True
+
+    def find_overlapping_rule(self, rule: Rule) -> Optional[RuleConflict]:
+        """Find the first indexed rule that matches at least some of
+        the calls a given rule matches."""
+        service, argument, source, target = self.rule_key(rule)
+        found = None
+        for key_service in {service, '*'}:
+            for entry in self._service_rules.get(key_service, []):
+                if found and entry[:2] >= found[:2]:
+                    break
+                _, other_argument, other_source, other_target = \
+                    self.rule_key(entry[3])
+                if '*' not in (argument, other_argument) and \
+                        argument != other_argument:
+                    continue
+                if self._tokens_overlap(source, other_source) and \
+                        self._tokens_overlap(target, other_target):
+                    found = entry
+                    break
+        if not found:
+            return None
+        return RuleConflict(rule=rule, file_name=found[2], lineno=found[1],
+                            shadowing_rule=found[3], partial=True)
+
+    def find_shadowing_rule(self, rule: Rule) -> Optional[RuleConflict]:
+        """Find the first indexed rule that shadows a given rule."""
+        service, argument, source, target = self.rule_key(rule)
+        found = None
+        for key_service in {service, '*'}:
+            for key_argument in {argument, '*'}:
+                for key_source in self._matching_tokens(source):
+                    for key_target in self._matching_tokens(target):
+                        entry = self._index.get((key_service, key_argument,
+                                                 key_source, key_target))
+                        if entry and (not found or entry[:2] < found[:2]):
+                            found = entry
+        if not found:
+            return None
+        return RuleConflict(rule=rule, file_name=found[2], lineno=found[1],
+                            shadowing_rule=found[3])
+
+    def analyze(self, rules: List[Rule]) -> List[RuleConflict]:
+        """Get conflicts for all shadowed rules from provided list; rules
+        that are not shadowed are reported if an earlier rule may override
+        them."""
+        conflicts = []
+        for rule in rules:
+            conflict = self.find_shadowing_rule(rule) or \
+                       self.find_overlapping_rule(rule)
+            if conflict:
+                conflicts.append(conflict)
+        return conflicts
+
+
 class ConflictFileHandler:
-    """Handler for conflicting policy files."""
+    """Handler for conflicting policy files. If our rules are provided,
+    only rules from earlier files that actually override them are shown
+    (and files that cannot be analyzed); otherwise, all earlier files are
+    listed. Earlier files are read in the background (see
+    PolicyManager.read_policy_files), and conflicts are shown once they
+    are all read."""
     def __init__(self, gtk_builder: Gtk.Builder, prefix: str,
                  service_names: List[str], own_file_name: str,
-                 policy_manager: PolicyManager):
+                 policy_manager: PolicyManager,
+                 rules: Optional[List[Rule]] = None):
+        """
+        :param gtk_builder: Gtk.Builder
+        :param prefix: widget name prefix
+        :param service_names: names of services handled by our policy file
+        :param own_file_name: name of our policy file
+        :param policy_manager: PolicyManager
+        :param rules: our current rules; if provided, conflicts are analyzed
+        rule by rule and can be updated with update_rules
+        """
         self.service_names = service_names
         self.own_file_name = own_file_name
         self.policy_manager = policy_manager
@@ -74,15 +266,94 @@ class ConflictFileHandler:
         conflicting_files = []
 
         for service in self.service_names:
-            conflicting_files.extend(
-                self.policy_manager.get_conflicting_policy_files(
-                service, self.own_file_name))
-
-        if conflicting_files:
-            self.problem_box.set_visible(True)
-            for file in conflicting_files:
-                row = ConflictFileListRow(file)
-                self.problem_list.add(row)
-            self.problem_box.show_all()
-        else:
+            for file in self.policy_manager.get_conflicting_policy_files(
+                    service, self.own_file_name):
+                if file not in conflicting_files:
+                    conflicting_files.append(file)
+
+        self.analyzer: Optional[ConflictAnalyzer] = None
+        # files that are listed as a whole
+        self.problem_files: List[str] = conflicting_files
+        self.conflicts: List[RuleConflict] = []
+        # our latest rules, analyzed once all files are read
+        self._rules: Optional[List[Rule]] = rules
+        self._conflicting_files = conflicting_files
+        self._file_reads: Dict[str, Future] = {}
+
+        if rules is None:
+            self._fill_problem_list()
+            return
+
+        self.problem_files = []
+        self._fill_problem_list()
+        self._file_reads = self.policy_manager.read_policy_files(
+            # legacy files cannot be analyzed
+            [file for file in conflicting_files
+             if not file.startswith('/etc/qubes-rpc')])
+        for future in self._file_reads.values():
+            if not future.done():
+                future.add_done_callback(
+                    lambda _f: GLib.idle_add(self._file_read))
+        self._file_read()
+
+    def _file_read(self) -> bool:
+        if self.analyzer or \
+                not all(future.done() for future in self._file_reads.values()):
+            return False
+        self.analyzer = ConflictAnalyzer()
+        for file in self._conflicting_files:
+            if not self._add_file_to_analyzer(file):
+                self.problem_files.append(file)
+        assert self._rules is not None
+        self.conflicts = self.analyzer.analyze(self._rules)
+        self._fill_problem_list()
+        return False
+
+    def _add_file_to_analyzer(self, file_name: str) -> bool:
+        """Return False if the file could not be analyzed."""
+        assert self.analyzer
+        if file_name not in self._file_reads:
+            # legacy format
+            return False
+        try:
+            rules = self.policy_manager.get_read_rules(file_name)
+        except PolicySyntaxError:
+            return False
+        if rules is None:
+            # file could not be read
+            return False
+        self.analyzer.add_rules(file_name, rules)
+        return True
+
+    def update_rules(self, rules: List[Rule]):
+        """Update shown conflicts to match current rules. Does nothing if
+        the handler was created without rules; if earlier files are still
+        being read, rules will be analyzed once they are."""
+        if self._rules is None:
+            return
+        self._rules = rules
+        if not self.analyzer:
+            return
+        conflicts = self.analyzer.analyze(rules)
+        if [(str(c.rule), c.file_name, c.lineno, c.partial)
+                for c in conflicts] == \
+                [(str(c.rule), c.file_name, c.lineno, c.partial)
+                 for c in self.conflicts]:
+            return
+        self.conflicts = conflicts
+        self._fill_problem_list()
+
+    def _fill_problem_list(self):
+        for child in self.problem_list.get_children():
+            self.problem_list.remove(child)
+
+        if not self.problem_files and not self.conflicts:
             self.problem_box.set_visible(False)
+            return
+
+        self.problem_box.set_visible(True)
+        for file in self.problem_files:
+            self.problem_list.add(ConflictFileListRow(file))
+        for conflict in self.conflicts:
+            self.problem_list.add(ConflictRuleListRow(conflict))
+        self.problem_box.show_all()
@@ -20,13 +20,14 @@
 
 # pylint: disable=import-error
 """Global Qubes Config tool."""
-import re
 import sys
 import threading
-from typing import Dict, Optional, List, Union
-import pkg_resources
+from typing import Dict, Optional, List, Union, Callable, Tuple, \
+    TYPE_CHECKING
 import subprocess
 import logging
+from concurrent.futures import Future
+from functools import partial
 
 import qubesadmin
 import qubesadmin.events
@@ -34,15 +35,27 @@ import qubesadmin.exc
 import qubesadmin.vm
 from ..widgets.gtk_utils import show_error, show_dialog, load_theme
 from ..widgets.gtk_widgets import ProgressBarDialog, ViewportHandler
+from ..widgets.resources import add_ui
+from ..widgets.domain_snapshot import get_domain_snapshot
+from ..widgets.lazy_import import lazy_import
+from ..widgets.utils import get_feature_snapshot
 from .page_handler import PageHandler
-from .policy_handler import PolicyHandler, VMSubsetPolicyHandler
-from .policy_rules import RuleSimple, \
-    RuleSimpleAskIsAllow, RuleTargeted, SimpleVerbDescription, \
-    TargetedVerbDescription, RuleSimpleNoAllow
 from .policy_manager import PolicyManager
-from .updates_handler import UpdatesHandler
-from .usb_devices import DevicesHandler
-from .basics_handler import BasicSettingsHandler, FeatureHandler
+from .page_loader import PageDataLoader
+from .hardware_report import get_hardware_report, HardwareReport
+from . import repos
+
+if TYPE_CHECKING:
+    from .policy_handler import PolicyHandler
+    from .basics_handler import FeatureHandler
+
+# modules with page handlers are only imported when a page that needs them
+# is built
+policy_handler = lazy_import('.policy_handler', __package__)
+policy_rules = lazy_import('.policy_rules', __package__)
+updates_handler = lazy_import('.updates_handler', __package__)
+usb_devices = lazy_import('.usb_devices', __package__)
+basics_handler = lazy_import('.basics_handler', __package__)
 
 import gi
 
@@ -53,6 +66,13 @@ from gi.repository import Gtk, GLib, GObject
 logger = logging.getLogger('qubes-config-manager')
 
 
+def _fetch_features(features, domains: Future, feature_names: List[str],
+                    template_feature_names: List[str]):
+    # runs in a worker thread; domains are loaded (once) by another task
+    features.fetch(feature_names, template_feature_names,
+                   domains=domains.result().values())
+
+
 class ClipboardHandler(PageHandler):
     """Handler for Clipboard policy. Adds a couple of comboboxes to a
     normal policy handler."""
@@ -71,7 +91,7 @@ class ClipboardHandler(PageHandler):
             gtk_builder.get_object('clipboard_paste_combo')
 
         self.handlers: List[Union[PolicyHandler, FeatureHandler]] = [
-            PolicyHandler(
+            policy_handler.PolicyHandler(
                 qapp=self.qapp,
                 gtk_builder=gtk_builder,
                 policy_manager=policy_manager,
@@ -80,12 +100,12 @@ class ClipboardHandler(PageHandler):
                 policy_file_name='50-config-clipboard',
                 default_policy="""qubes.ClipboardPaste * @adminvm @anyvm deny\n
 qubes.ClipboardPaste * @anyvm @anyvm ask\n""",
-                verb_description=SimpleVerbDescription({
+                verb_description=policy_rules.SimpleVerbDescription({
                     "ask": 'be allowed to paste\n into clipboard of',
                     "deny": 'be allowed to paste\n into clipboard of'
                 }),
-                rule_class=RuleSimpleAskIsAllow),
-            FeatureHandler(
+                rule_class=policy_rules.RuleSimpleAskIsAllow),
+            basics_handler.FeatureHandler(
                 trait_holder=self.vm, trait_name=self.COPY_FEATURE,
                 widget=self.copy_combo,
                 options={'default (Ctrl+Shift+C)': None,
@@ -93,7 +113,7 @@ qubes.ClipboardPaste * @anyvm @anyvm ask\n""",
                          'Ctrl+Win+C': 'Ctrl-Mod4-c'},
                 readable_name="Global Clipboard copy shortcut"
             ),
-            FeatureHandler(
+            basics_handler.FeatureHandler(
                 trait_holder=self.vm, trait_name=self.PASTE_FEATURE,
                 widget=self.paste_combo,
                 options= {'default (Ctrl+Shift+V)': None,
@@ -130,7 +150,7 @@ class FileAccessHandler(PageHandler):
         self.qapp = qapp
         self.policy_manager = policy_manager
 
-        self.filecopy_handler = PolicyHandler(
+        self.filecopy_handler = policy_handler.PolicyHandler(
             qapp=self.qapp,
             gtk_builder=gtk_builder,
             prefix="filecopy",
@@ -139,13 +159,13 @@ class FileAccessHandler(PageHandler):
 qubes.Filecopy * @anyvm @anyvm ask""",
             service_name="qubes.Filecopy",
             policy_file_name="50-config-filecopy",
-            verb_description=SimpleVerbDescription({
+            verb_description=policy_rules.SimpleVerbDescription({
                 "ask": "to be allowed to copy files to",
                 "allow": "allow files to copied to",
                 "deny": "be allowed to copy files to"
             }),
-            rule_class=RuleSimple)
-        self.openinvm_handler = PolicyHandler(
+            rule_class=policy_rules.RuleSimple)
+        self.openinvm_handler = policy_handler.PolicyHandler(
             qapp=self.qapp,
             gtk_builder=gtk_builder,
             prefix="openinvm",
@@ -155,7 +175,7 @@ qubes.OpenInVM * @anyvm @dispvm allow\n
 qubes.OpenInVM * @anyvm @anyvm ask""",
             service_name="qubes.OpenInVM",
             policy_file_name="50-config-openinvm",
-            verb_description=TargetedVerbDescription(
+            verb_description=policy_rules.TargetedVerbDescription(
                     single_target_descr={
                         "allow": 'open files in',
                         "ask": 'where to open files,\nand select by default',
@@ -167,7 +187,7 @@ qubes.OpenInVM * @anyvm @anyvm ask""",
                         "deny": 'be allowed to open files in'
                     }
                 ),
-            rule_class=RuleTargeted)
+            rule_class=policy_rules.RuleTargeted)
 
     def reset(self):
         self.filecopy_handler.reset()
@@ -190,7 +210,15 @@ class ThisDeviceHandler(PageHandler):
     """Handler for the ThisDevice page."""
     def __init__(self,
                  qapp: qubesadmin.Qubes,
-                 gtk_builder: Gtk.Builder):
+                 gtk_builder: Gtk.Builder,
+                 hardware_report: Optional[Future] = None):
+        """
+        :param qapp: qubesadmin.Qubes object
+        :param gtk_builder: Gtk.Builder
+        :param hardware_report: optional Future with the result of
+        get_hardware_report, started earlier; if not provided, the report
+        is generated in a background thread
+        """
         self.qapp = qapp
 
         self.model_label: Gtk.Label = gtk_builder.get_object(
@@ -198,34 +226,53 @@ class ThisDeviceHandler(PageHandler):
         self.data_label: Gtk.Label = gtk_builder.get_object(
             'thisdevice_data_label')
 
-        hcl_check = subprocess.check_output(['qubes-hcl-report']).decode()
-
-        pattern = re.compile(
-            r"Qubes release\s*(?P<qubes>.+)[\n.]*Brand:\s*(?P<brand>.+)[\n.]*"
-            r"Model:\s*(?P<model>.+)[\n.]*BIOS:\s*(?P<bios>.*)[\n.]+"
-            r"Xen:\s*(?P<xen>.+)[\n.]*Kernel:\s+(?P<kernel>.+)[\n.]*"
-            r"RAM:\s+(?P<ram>.+)[\n.]+CPU:\s*(?P<cpu>.*)[\n.]+"
-            r"Chipset:\s*(?P<chipset>.*)[\n.]+VGA:\s*(?P<vga>.*)")
-        match = pattern.search(hcl_check)
-        if not match:
-            label_text = hcl_check
+        if hardware_report is None:
+            hardware_report = Future()
+            threading.Thread(target=self._generate_report,
+                             args=(hardware_report, self.qapp),
+                             daemon=True).start()
+
+        if hardware_report.done():
+            self._report_ready(hardware_report)
+        else:
+            self.data_label.set_markup("<i>Loading hardware information...</i>")
+            hardware_report.add_done_callback(
+                lambda f: GLib.idle_add(self._report_ready, f))
+
+    @staticmethod
+    def _generate_report(future: Future, qapp: qubesadmin.Qubes):
+        try:
+            future.set_result(get_hardware_report(qapp=qapp))
+        except Exception as ex:  # pylint: disable=broad-except
+            future.set_exception(ex)
+
+    def _report_ready(self, future: Future) -> bool:
+        try:
+            report: HardwareReport = future.result()
+        except (OSError, subprocess.CalledProcessError) as ex:
+            report = HardwareReport(
+                None, f"Failed to get hardware information: {ex}")
+        fields = report.fields
+        if not fields:
+            label_text = GLib.markup_escape_text(report.text)
             self.data_label.get_style_context().add_class('red_code')
         else:
-            label_text = f"""<b>Brand:</b> {match.group('brand')}
-<b>Model:</b> {match.group('model')}
+            label_text = f"""<b>Brand:</b> {fields.brand}
+<b>Model:</b> {fields.model}
         
-<b>CPU:</b> {match.group('cpu')}
-<b>Chipset:</b> {match.group('chipset')}
-<b>Graphics:</b> {match.group('vga')}
+<b>CPU:</b> {fields.cpu}
+<b>Chipset:</b> {fields.chipset}
+<b>Graphics:</b> {fields.vga}
 
-<b>RAM:</b> {match.group('ram')}
+<b>RAM:</b> {fields.ram}
 
-<b>QubesOS version:</b> {match.group('qubes')}
-<b>BIOS:</b> {match.group('bios')}
-<b>Kernel:</b> {match.group('kernel')}
-<b>Xen:</b> {match.group('xen')}
+<b>QubesOS version:</b> {fields.qubes}
+<b>BIOS:</b> {fields.bios}
+<b>Kernel:</b> {fields.kernel}
+<b>Xen:</b> {fields.xen}
 """
         self.data_label.set_markup(label_text)
+        return False
 
     def reset(self):
         # does not apply
@@ -243,6 +290,42 @@ class GlobalConfig(Gtk.Application):
     """
     Main Gtk.Application for new qube widget.
     """
+    # policy files and services whose policy file lists are needed by a given
+    # page; they are all fetched in the background at startup
+    PAGE_POLICY_FILES: Dict[str, List[str]] = {
+        'usb': ['50-config-input', '50-config-u2f'],
+        'updates': ['50-updates-config'],
+        'splitgpg': ['50-config-splitgpg'],
+        'clipboard': ['50-config-clipboard'],
+        'file': ['50-config-filecopy', '50-config-openinvm'],
+        'url': ['50-config-openurl'],
+    }
+    PAGE_POLICY_SERVICES: Dict[str, List[str]] = {
+        'usb': ['qubes.InputMouse', 'qubes.InputKeyboard',
+                'qubes.InputTablet', 'u2f.Register', 'u2f.Authenticate',
+                'policy.RegisterArgument'],
+        'updates': ['qubes.UpdatesProxy'],
+        'splitgpg': ['qubes.Gpg'],
+        'clipboard': ['qubes.ClipboardPaste'],
+        'file': ['qubes.Filecopy', 'qubes.OpenInVM'],
+        'url': ['qubes.OpenURL'],
+    }
+    # features (and features checked with template) of all domains, needed
+    # by a given page; they are fetched in the background at startup
+    PAGE_FEATURES: Dict[str, Tuple[List[str], List[str]]] = {
+        'usb': (['service.qubes-u2f-proxy'],
+                ['supported-service.qubes-u2f-proxy']),
+        'updates': (['service.qubes-update-check'], []),
+    }
+    # labels with links that should be opened in a disposable qube
+    PAGE_URL_LABELS: Dict[str, List[str]] = {
+        'basics': ['basics_info'],
+        'usb': ['usb_info'],
+        'splitgpg': ['splitgpg_info'],
+        'file': ['openinvm_info'],
+        'url': ['url_info'],
+    }
+
     def __init__(self, qapp: qubesadmin.Qubes, policy_manager: PolicyManager):
         """
         :param qapp: qubesadmin.Qubes object
@@ -255,6 +338,16 @@ class GlobalConfig(Gtk.Application):
         self.progress_bar_dialog = ProgressBarDialog(
             self, "Loading system settings...")
         self.handlers: Dict[str, PageHandler] = {}
+        self.page_factories: Dict[str, Callable[[], PageHandler]] = {}
+
+        self.loader = PageDataLoader()
+        self.repo_list: Optional[Future] = None
+        self.hardware_report: Optional[Future] = None
+        # pages whose data is loaded, but that were not built yet
+        self._ready_pages: List[str] = []
+        self._build_in_background = False
+        # widgets shown in pages that wait for their data: page name -> widget
+        self._placeholders: Dict[str, Gtk.Widget] = {}
 
     def do_activate(self, *args, **kwargs):
         """
@@ -266,6 +359,9 @@ class GlobalConfig(Gtk.Application):
         self.perform_setup()
         assert self.main_window
         self.main_window.show()
+        # build remaining pages as their data arrives, after the window has
+        # been drawn
+        self._schedule_page_builds()
         self.hold()
 
     @staticmethod
@@ -295,18 +391,15 @@ class GlobalConfig(Gtk.Application):
         self.progress_bar_dialog.update_progress(0)
 
         self.builder = Gtk.Builder()
-        self.builder.add_from_file(pkg_resources.resource_filename(
-            'qubes_config', 'global_config.glade'))
+        add_ui(self.builder, 'global_config.glade')
 
         self.main_window = self.builder.get_object('main_window')
         self.main_notebook: Gtk.Notebook = \
             self.builder.get_object('main_notebook')
 
         load_theme(widget=self.main_window,
-                   light_theme_path=pkg_resources.resource_filename(
-                       'qubes_config', 'qubes-global-config-light.css'),
-                   dark_theme_path=pkg_resources.resource_filename(
-                       'qubes_config', 'qubes-global-config-dark.css'))
+                   light_theme='qubes-global-config-light.css',
+                   dark_theme='qubes-global-config-dark.css')
 
         self.apply_button: Gtk.Button = self.builder.get_object('apply_button')
         self.cancel_button: Gtk.Button = \
@@ -319,106 +412,200 @@ class GlobalConfig(Gtk.Application):
 
         self.main_window.connect('delete-event', self._ask_to_quit)
 
-        page_progress = 1 / self.main_notebook.get_n_pages()
-
-        # match page by widget name to handler
-        self.handlers['basics'] = BasicSettingsHandler(self.builder, self.qapp)
-        self.progress_bar_dialog.update_progress(page_progress)
-
-        self.handlers['usb'] = DevicesHandler(
-            self.qapp, self.policy_manager, self.builder)
-        self.progress_bar_dialog.update_progress(page_progress)
+        # contents of pages are added as the pages are built
+        self.viewport_handler = ViewportHandler(self.main_window, [])
 
-        self.handlers['updates'] = UpdatesHandler(
-                qapp=self.qapp,
-                policy_manager=self.policy_manager,
-                gtk_builder=self.builder)
-        self.progress_bar_dialog.update_progress(page_progress)
+        self._start_loading()
 
-        self.handlers['splitgpg'] = VMSubsetPolicyHandler(
+        # match page by widget name to handler factory; handlers (and modules
+        # they come from) are only loaded when their page is first needed
+        self.page_factories = {
+            'basics': lambda: basics_handler.BasicSettingsHandler(
+                self.builder, self.qapp),
+            'usb': lambda: usb_devices.DevicesHandler(
+                self.qapp, self.policy_manager, self.builder),
+            'updates': lambda: updates_handler.UpdatesHandler(
                 qapp=self.qapp,
-                gtk_builder=self.builder,
                 policy_manager=self.policy_manager,
-                prefix="splitgpg",
-                service_name='qubes.Gpg',
-                policy_file_name='50-config-splitgpg',
-                default_policy="",
-                main_rule_class=RuleSimpleNoAllow,
-                main_verb_description=SimpleVerbDescription({
-                    "ask": "access GPG\nkeys from",
-                    "deny": "access GPG\nkeys from"
-                }),
-                exception_rule_class=RuleTargeted,
-                exception_verb_description=SimpleVerbDescription({
-                    "allow": 'access GPG\nkeys from',
-                    "ask": 'to access GPG\nkeys from',
-                    "deny": 'access GPG\nkeys from'
-                }))
-        self.progress_bar_dialog.update_progress(page_progress)
-
-        self.handlers['clipboard'] = ClipboardHandler(
-                qapp=self.qapp,
                 gtk_builder=self.builder,
-                policy_manager=self.policy_manager
-            )
-        self.progress_bar_dialog.update_progress(page_progress)
-
-        self.handlers['file'] = FileAccessHandler(
-                qapp=self.qapp,
-                gtk_builder=self.builder,
-                policy_manager=self.policy_manager
-            )
-        self.progress_bar_dialog.update_progress(page_progress)
-
-        self.handlers['url'] = PolicyHandler(
-                qapp=self.qapp,
-                gtk_builder=self.builder,
-                policy_manager=self.policy_manager,
-                prefix="url",
-                service_name='qubes.OpenURL',
-                policy_file_name='50-config-openurl',
-                default_policy="""qubes.OpenURL * @adminvm @anyvm deny\n
-qubes.OpenURL * @anyvm @dispvm allow\n
-qubes.OpenURL * @anyvm @anyvm ask\n""",
-                verb_description=TargetedVerbDescription(
-                    single_target_descr={
-                        "allow": 'open URLs in',
-                        "ask": 'where to open URLs,\nand select by default',
-                        "deny": 'be allowed to open URLs in'
-                    },
-                    multi_target_descr={
-                        "allow": 'open URLs in',
-                        "ask": 'where to open URLs in',
-                        "deny": 'be allowed to open URLs in'
-                    }
-                ),
-                rule_class=RuleTargeted)
-        self.progress_bar_dialog.update_progress(page_progress)
-
-        self.handlers['thisdevice'] = ThisDeviceHandler(self.qapp, self.builder)
-        self.progress_bar_dialog.update_progress(page_progress)
+                repo_list=self.repo_list),
+            'splitgpg': self._create_splitgpg_handler,
+            'clipboard': partial(ClipboardHandler,
+                                 qapp=self.qapp,
+                                 gtk_builder=self.builder,
+                                 policy_manager=self.policy_manager),
+            'file': partial(FileAccessHandler,
+                            qapp=self.qapp,
+                            gtk_builder=self.builder,
+                            policy_manager=self.policy_manager),
+            'url': self._create_url_handler,
+            'thisdevice': partial(ThisDeviceHandler, self.qapp, self.builder,
+                                  self.hardware_report),
+        }
 
         self.main_notebook.connect("switch-page", self._page_switched)
         self.main_window.connect('usbvm-changed', self._usbvm_changed)
 
-        self._handle_urls()
-
-        self.viewport_handler = ViewportHandler(
-            self.main_window,
-            [self.builder.get_object('basics_scrolled_window'),
-             self.builder.get_object('usb_scrolled_window'),
-             self.builder.get_object('updates_scrolled_window'),
-             self.builder.get_object('splitgpg_scrolled_window'),
-             self.builder.get_object('clipboard_scrolled_window'),
-             self.builder.get_object('file_scrolled_window'),
-             self.builder.get_object('url_scrolled_window'),
-             self.builder.get_object('thisdevice_scrolled_window'),
-             ])
+        # the page that will be shown first is built as soon as its data
+        # is loaded; until then, the progress dialog stays visible
+        self.loader.when_page_ready(self._get_current_page_name(),
+                                    self._first_page_ready)
 
+    def _first_page_ready(self, page_name: str):
+        self._show_page(page_name)
+        self.loader.progress_callback = None
         self.progress_bar_dialog.update_progress(1)
         self.progress_bar_dialog.hide()
         self.progress_bar_dialog.destroy()
 
+    def _create_splitgpg_handler(self) -> PageHandler:
+        """Create handler for the Split GPG page."""
+        return policy_handler.VMSubsetPolicyHandler(
+            qapp=self.qapp,
+            gtk_builder=self.builder,
+            policy_manager=self.policy_manager,
+            prefix="splitgpg",
+            service_name='qubes.Gpg',
+            policy_file_name='50-config-splitgpg',
+            default_policy="",
+            main_rule_class=policy_rules.RuleSimpleNoAllow,
+            main_verb_description=policy_rules.SimpleVerbDescription({
+                "ask": "access GPG\nkeys from",
+                "deny": "access GPG\nkeys from"
+            }),
+            exception_rule_class=policy_rules.RuleTargeted,
+            exception_verb_description=policy_rules.SimpleVerbDescription({
+                "allow": 'access GPG\nkeys from',
+                "ask": 'to access GPG\nkeys from',
+                "deny": 'access GPG\nkeys from'
+            }))
+
+    def _create_url_handler(self) -> PageHandler:
+        """Create handler for the Open URL page."""
+        return policy_handler.PolicyHandler(
+            qapp=self.qapp,
+            gtk_builder=self.builder,
+            policy_manager=self.policy_manager,
+            prefix="url",
+            service_name='qubes.OpenURL',
+            policy_file_name='50-config-openurl',
+            default_policy="""qubes.OpenURL * @adminvm @anyvm deny\n
+qubes.OpenURL * @anyvm @dispvm allow\n
+qubes.OpenURL * @anyvm @anyvm ask\n""",
+            verb_description=policy_rules.TargetedVerbDescription(
+                single_target_descr={
+                    "allow": 'open URLs in',
+                    "ask": 'where to open URLs,\nand select by default',
+                    "deny": 'be allowed to open URLs in'
+                },
+                multi_target_descr={
+                    "allow": 'open URLs in',
+                    "ask": 'where to open URLs in',
+                    "deny": 'be allowed to open URLs in'
+                }
+            ),
+            rule_class=policy_rules.RuleTargeted)
+
+    def _start_loading(self):
+        """Start fetching data needed by all pages in the background."""
+        # domain list and properties are needed by everyone; they are
+        # loaded by a single task, submitted first, and other tasks use its
+        # result instead of accessing the domains themselves
+        domains = self.loader.submit(None,
+                                     get_domain_snapshot(self.qapp).refresh)
+
+        for page_name, file_names in self.PAGE_POLICY_FILES.items():
+            for file_name in file_names:
+                self.loader.track(page_name, self.policy_manager.prefetch_rules(
+                    self.loader.executor, file_name))
+        for page_name, services in self.PAGE_POLICY_SERVICES.items():
+            file_lists = [
+                self.loader.track(
+                    page_name, self.policy_manager.prefetch_policy_files(
+                        self.loader.executor, service))
+                for service in services]
+            # files loaded before the page's own ones, needed to find
+            # conflicts; they are read once and shared by all pages
+            self.loader.track(
+                page_name, self.policy_manager.prefetch_earlier_files(
+                    self.loader.executor, file_lists,
+                    self.PAGE_POLICY_FILES.get(page_name, [])))
+        # files not prefetched above are read by conflict handlers in
+        # the background too
+        self.policy_manager.executor = self.loader.executor
+
+        features = get_feature_snapshot(self.qapp)
+        for page_name, (feature_names, template_feature_names) in \
+                self.PAGE_FEATURES.items():
+            self.loader.submit(page_name, _fetch_features, features, domains,
+                               feature_names, template_feature_names)
+
+        self.repo_list = self.loader.submit('updates', repos.fetch_repo_list)
+        # the page can be shown before the report is ready, so it is not
+        # tracked as page data
+        self.hardware_report = self.loader.executor.submit(
+            get_hardware_report, qapp=self.qapp)
+
+        self.loader.start(
+            page_names=[self.main_notebook.get_nth_page(i).get_name()
+                        for i in range(self.main_notebook.get_n_pages())],
+            page_ready_callback=self._page_data_ready,
+            progress_callback=self._loading_progress)
+
+    def _loading_progress(self, fraction: float):
+        # leave the last bit of the progress bar for building the first page
+        self.progress_bar_dialog.set_progress(fraction * 0.9)
+
+    def _page_data_ready(self, page_name: str):
+        self._ready_pages.append(page_name)
+        if self._build_in_background:
+            GLib.idle_add(self._build_page, page_name,
+                          priority=GLib.PRIORITY_LOW)
+
+    def _schedule_page_builds(self):
+        """Build pages in idle callbacks, as soon as their data is loaded."""
+        self._build_in_background = True
+        for page_name in self._ready_pages:
+            GLib.idle_add(self._build_page, page_name,
+                          priority=GLib.PRIORITY_LOW)
+
+    def _show_page(self, page_name: str):
+        """Build a page that is about to be shown, if its data is already
+        loaded; otherwise, show a placeholder and build the page once
+        the data arrives."""
+        if page_name in self.handlers or page_name not in self.page_factories:
+            return
+        if self.loader.is_page_ready(page_name):
+            self._build_page(page_name)
+            return
+        self._show_placeholder(page_name)
+        self.loader.when_page_ready(page_name, self._build_page)
+
+    def _show_placeholder(self, page_name: str):
+        if page_name in self._placeholders:
+            return
+        placeholder = Gtk.Box(orientation=Gtk.Orientation.VERTICAL,
+                              spacing=10)
+        placeholder.set_valign(Gtk.Align.CENTER)
+        spinner = Gtk.Spinner()
+        spinner.start()
+        placeholder.pack_start(spinner, False, False, 0)
+        placeholder.pack_start(Gtk.Label(label="Loading..."), False, False, 0)
+        placeholder.show_all()
+
+        page_box: Gtk.Box = self.builder.get_object(f'{page_name}_page')
+        page_box.pack_start(placeholder, True, True, 0)
+        self._placeholders[page_name] = placeholder
+
+    def _build_page(self, page_name: str) -> bool:
+        if page_name not in self.handlers:
+            try:
+                self.get_page_handler(page_name)
+            except Exception:  # pylint: disable=broad-except
+                # building will be retried when the user opens this page
+                logger.exception("Failed to load page %s", page_name)
+        return False
+
     def _usbvm_changed(self, *_args):
         response = show_dialog(
             parent=self.main_window, title="USB qube change",
@@ -434,13 +621,25 @@ qubes.OpenURL * @anyvm @anyvm ask\n""",
             self._quit()
             return
         usb_handler = self.handlers['usb']
-        assert isinstance(usb_handler, DevicesHandler)
+        assert isinstance(usb_handler, usb_devices.DevicesHandler)
         usb_handler.usbvm_handler.reset()
 
-    def _handle_urls(self):
-        url_label_ids = ["url_info", "openinvm_info", "splitgpg_info",
-                         "usb_info", "basics_info"]
-        for url_label_id in url_label_ids:
+    def _load_page_ui(self, page_name: str):
+        """Load widgets of a given page from its own UI file into the main
+        builder and put them in the notebook, if it was not done yet."""
+        if self.builder.get_object(f'{page_name}_scrolled_window'):
+            return
+        placeholder = self._placeholders.pop(page_name, None)
+        if placeholder:
+            placeholder.destroy()
+        add_ui(self.builder, f'global_config_pages/{page_name}.glade')
+        scrolled_window: Gtk.ScrolledWindow = \
+            self.builder.get_object(f'{page_name}_scrolled_window')
+        page_box: Gtk.Box = self.builder.get_object(f'{page_name}_page')
+        page_box.pack_start(scrolled_window, True, True, 0)
+        self.viewport_handler.add_scrolled_window(scrolled_window)
+
+        for url_label_id in self.PAGE_URL_LABELS.get(page_name, []):
             label: Gtk.Label = self.builder.get_object(url_label_id)
             label.connect("activate-link", self._activate_link)
 
@@ -456,16 +655,32 @@ qubes.OpenURL * @anyvm @anyvm ask\n""",
             ['qvm-run', '-p', '--service', f'--dispvm={default_dvm}',
              'qubes.OpenURL'], input=url.encode(), check=False)
 
+    def get_page_handler(self, page_name: str) -> Optional[PageHandler]:
+        """Get handler for the page with given name, creating it if it
+        was not needed before."""
+        if page_name not in self.handlers and \
+                page_name in self.page_factories:
+            self._load_page_ui(page_name)
+            self.handlers[page_name] = self.page_factories[page_name]()
+        return self.handlers.get(page_name, None)
+
+    def _get_current_page_name(self) -> str:
+        page_num = self.main_notebook.get_current_page()
+        return self.main_notebook.get_nth_page(page_num).get_name()
+
     def get_current_page(self) -> Optional[PageHandler]:
         """Get currently visible page."""
-        page_num = self.main_notebook.get_current_page()
-        return self.handlers.get(
-            self.main_notebook.get_nth_page(page_num).get_name(), None)
+        return self.get_page_handler(self._get_current_page_name())
+
+    def _get_built_current_page(self) -> Optional[PageHandler]:
+        """Get currently visible page, if it was already built; a page that
+        still waits for its data cannot have any changes."""
+        return self.handlers.get(self._get_current_page_name(), None)
 
     def verify_changes(self) -> bool:
         """Verify the current state of the page. Return True if page can
         be abandoned, False if there are unsaved changes remaining."""
-        page = self.get_current_page()
+        page = self._get_built_current_page()
         if page:
             unsaved = page.get_unsaved()
             if unsaved != '':
@@ -483,12 +698,14 @@ qubes.OpenURL * @anyvm @anyvm ask\n""",
                     return False
         return True
 
-    def _page_switched(self, *_args):
+    def _page_switched(self, _notebook, page: Gtk.Widget, *_args):
         old_page_num = self.main_notebook.get_current_page()
         allow_switch = self.verify_changes()
         if not allow_switch:
             GLib.timeout_add(1, lambda: self.main_notebook.set_current_page(
                 old_page_num))
+            return
+        self._show_page(page.get_name())
 
     def _ask_unsaved(self, description: str) -> Gtk.ResponseType:
         box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
@@ -518,7 +735,7 @@ qubes.OpenURL * @anyvm @anyvm ask\n""",
         return response
 
     def _apply(self, _widget=None):
-        page = self.get_current_page()
+        page = self._get_built_current_page()
         if page:
             try:
                 page.save()
@@ -527,7 +744,7 @@ qubes.OpenURL * @anyvm @anyvm ask\n""",
                            f"The following error occurred: {ex}")
 
     def _reset(self, _widget=None):
-        page = self.get_current_page()
+        page = self._get_built_current_page()
         if page:
             page.reset()
 
@@ -552,6 +769,7 @@ def main():
     """
     qapp = qubesadmin.Qubes()
     policy_manager = PolicyManager()
+    get_domain_snapshot(qapp).watch_events()
     app = GlobalConfig(qapp, policy_manager)
     app.run(sys.argv)
 
@@ -0,0 +1,336 @@
+# -*- encoding: utf8 -*-
+#
+# The Qubes OS Project, http://www.qubes-os.org
+#
+# Copyright (C) 2022 Marta Marczykowska-Górecka
+#                               <marmarta@invisiblethingslab.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation; either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program; if not, see <http://www.gnu.org/licenses/>.
+"""
+Hardware information, collected from sysfs and procfs (or, if that fails,
+from qubes-hcl-report) and cached between runs.
+"""
+import json
+import logging
+import os
+import re
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, NamedTuple, List, Tuple, Set
+
+import qubesadmin
+import qubesadmin.exc
+
+import gi
+
+gi.require_version('GLib', '2.0')
+from gi.repository import GLib
+
+logger = logging.getLogger('qubes-config-manager')
+
+HCL_PATTERN = re.compile(
+    r"Qubes release\s*(?P<qubes>.+)[\n.]*Brand:\s*(?P<brand>.+)[\n.]*"
+    r"Model:\s*(?P<model>.+)[\n.]*BIOS:\s*(?P<bios>.*)[\n.]+"
+    r"Xen:\s*(?P<xen>.+)[\n.]*Kernel:\s+(?P<kernel>.+)[\n.]*"
+    r"RAM:\s+(?P<ram>.+)[\n.]+CPU:\s*(?P<cpu>.*)[\n.]+"
+    r"Chipset:\s*(?P<chipset>.*)[\n.]+VGA:\s*(?P<vga>.*)")
+
+
+class HardwareInfo(NamedTuple):
+    """Description of the hardware, as shown on the This Device page."""
+    qubes: str
+    brand: str
+    model: str
+    bios: str
+    xen: str
+    kernel: str
+    ram: str
+    cpu: str
+    chipset: str
+    vga: str
+
+
+class HardwareReport(NamedTuple):
+    """Hardware information, or None if it could not be collected, and raw
+    output of qubes-hcl-report, if it was used."""
+    fields: Optional[HardwareInfo]
+    text: str
+
+
+def parse_hcl_report(text: str) -> HardwareReport:
+    """Parse output of qubes-hcl-report."""
+    match = HCL_PATTERN.search(text)
+    return HardwareReport(HardwareInfo(**match.groupdict()) if match else None,
+                          text)
+
+
+def _read_file(path: str) -> str:
+    try:
+        with open(path, encoding='utf-8') as file:
+            return file.read().strip()
+    except (OSError, UnicodeDecodeError):
+        return ''
+
+
+class HardwareCollector:
+    """
+    Collects hardware information directly from /sys/class/dmi/id,
+    /proc/cpuinfo and /sys/bus/pci/devices; sources are read
+    concurrently. Device names are looked up in the pci.ids database.
+    Under Xen, /proc/meminfo only shows memory of dom0, so total memory
+    is taken from the host (Admin API or xl info) instead.
+    """
+    PCI_IDS_PATHS = ['usr/share/hwdata/pci.ids', 'usr/share/misc/pci.ids']
+    # PCI class prefixes of host bridges and display controllers
+    CHIPSET_CLASS = '0x0600'
+    VGA_CLASSES = ('0x0300', '0x0302', '0x0380')
+
+    def __init__(self, root: str = '/',
+                 qapp: Optional[qubesadmin.Qubes] = None):
+        """
+        :param root: directory relative to which system files are read
+        :param qapp: Qubes object, used to get total memory of the host
+        """
+        self.root = root
+        self.qapp = qapp
+
+    def _path(self, *parts: str) -> str:
+        return os.path.join(self.root, *parts)
+
+    def _read(self, *parts: str) -> str:
+        return _read_file(self._path(*parts))
+
+    def _read_dmi(self) -> Dict[str, str]:
+        brand = self._read('sys/class/dmi/id/sys_vendor')
+        model = self._read('sys/class/dmi/id/product_name')
+        if brand.upper() == 'LENOVO':
+            # Lenovo keeps human-readable model name in product version
+            model = self._read('sys/class/dmi/id/product_version') or model
+        bios = self._read('sys/class/dmi/id/bios_version')
+        return {'brand': brand, 'model': model, 'bios': bios}
+
+    def _read_cpu(self) -> Dict[str, str]:
+        for line in self._read('proc/cpuinfo').splitlines():
+            key, _sep, value = line.partition(':')
+            if key.strip() == 'model name':
+                return {'cpu': value.strip()}
+        return {'cpu': ''}
+
+    def _read_memory(self) -> Dict[str, str]:
+        if self._read('sys/hypervisor/type') == 'xen':
+            return {'ram': self._read_host_memory()}
+        for line in self._read('proc/meminfo').splitlines():
+            key, _sep, value = line.partition(':')
+            if key == 'MemTotal':
+                try:
+                    return {'ram': f"{int(value.split()[0]) // 1024} Mb"}
+                except (ValueError, IndexError):
+                    break
+        return {'ram': ''}
+
+    def _read_host_memory(self) -> str:
+        if self.qapp:
+            try:
+                # in KiB
+                return f"{int(self.qapp.host.memory_total) // 1024} Mb"
+            except (qubesadmin.exc.QubesException, AttributeError,
+                    NotImplementedError, TypeError, ValueError):
+                pass
+        try:
+            xl_info = subprocess.check_output(
+                ['xl', 'info'], stderr=subprocess.DEVNULL).decode()
+        except (OSError, subprocess.CalledProcessError):
+            return ''
+        for line in xl_info.splitlines():
+            key, _sep, value = line.partition(':')
+            if key.strip() == 'total_memory':
+                # in MiB
+                return f"{value.strip()} Mb"
+        return ''
+
+    def _read_versions(self) -> Dict[str, str]:
+        qubes = self._read('etc/qubes-release')
+        if qubes.startswith('Qubes release'):
+            qubes = qubes[len('Qubes release'):].strip()
+        xen = self._read('sys/hypervisor/version/major')
+        if xen:
+            xen = f"{xen}.{self._read('sys/hypervisor/version/minor')}" \
+                  f"{self._read('sys/hypervisor/version/extra')}"
+        return {'qubes': qubes, 'xen': xen, 'kernel': os.uname().release}
+
+    def _read_pci(self) -> Dict[str, str]:
+        devices_dir = self._path('sys/bus/pci/devices')
+        chipset: List[Tuple[str, str]] = []
+        vga: List[Tuple[str, str]] = []
+        try:
+            addresses = sorted(os.listdir(devices_dir))
+        except OSError:
+            addresses = []
+        for address in addresses:
+            pci_class = _read_file(os.path.join(devices_dir, address, 'class'))
+            if pci_class.startswith(self.CHIPSET_CLASS):
+                device_list = chipset
+            elif pci_class.startswith(self.VGA_CLASSES):
+                device_list = vga
+            else:
+                continue
+            device_list.append(tuple(  # type: ignore
+                _read_file(os.path.join(devices_dir, address, name))[2:]
+                for name in ('vendor', 'device')))
+
+        names = self._lookup_pci_names(set(chipset + vga))
+        return {
+            'chipset': '\n'.join(names.get(ids, ':'.join(ids))
+                                 for ids in chipset),
+            'vga': '\n'.join(names.get(ids, ':'.join(ids)) for ids in vga)}
+
+    def _lookup_pci_names(self, ids: Set[Tuple[str, str]]) -> \
+            Dict[Tuple[str, str], str]:
+        """Find names of (vendor, device) ids in the pci.ids database."""
+        result: Dict[Tuple[str, str], str] = {}
+        vendors = {vendor for vendor, _device in ids}
+        for path in self.PCI_IDS_PATHS:
+            try:
+                with open(self._path(path), encoding='utf-8',
+                          errors='replace') as file:
+                    vendor, vendor_name = '', ''
+                    for line in file:
+                        if len(result) == len(ids):
+                            break
+                        if line.startswith(('#', '\t\t')) or \
+                                not line.strip():
+                            continue
+                        if not line.startswith('\t'):
+                            vendor, _sep, vendor_name = \
+                                line.strip().partition('  ')
+                        elif vendor in vendors:
+                            device, _sep, device_name = \
+                                line.strip().partition('  ')
+                            if (vendor, device) in ids:
+                                result[(vendor, device)] = \
+                                    f"{vendor_name} {device_name}"
+                return result
+            except OSError:
+                continue
+        return result
+
+    def collect(self) -> Optional[HardwareInfo]:
+        """Collect hardware information; return None if basic information
+        (brand, model and CPU) is not available."""
+        collectors = [self._read_dmi, self._read_cpu, self._read_memory,
+                      self._read_versions, self._read_pci]
+        fields: Dict[str, str] = {}
+        with ThreadPoolExecutor(max_workers=len(collectors),
+                                thread_name_prefix='qubes-config-hw') \
+                as executor:
+            for result in executor.map(lambda collector: collector(),
+                                       collectors):
+                fields.update(result)
+        if not (fields['brand'] and fields['model'] and fields['cpu']):
+            return None
+        return HardwareInfo(**fields)
+
+
+class HardwareReportCache:
+    """
+    Parsed hardware report stored in the user's cache directory. The report
+    is valid as long as the system is not rebooted and runs the same kernel
+    and Xen version; if boot id cannot be read, nothing is cached.
+    """
+    # version 1 stored memory of dom0 instead of the host
+    VERSION = 2
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        :param path: path of the cache file; by default,
+        qubes-config/hardware-report.json in user cache directory
+        """
+        self.path = path or os.path.join(
+            GLib.get_user_cache_dir(), 'qubes-config', 'hardware-report.json')
+
+    @staticmethod
+    def get_system_key() -> Optional[str]:
+        """Identifier of current boot, kernel and Xen version, or None
+        if boot id is not available."""
+        boot_id = _read_file('/proc/sys/kernel/random/boot_id')
+        if not boot_id:
+            return None
+        xen_version = '.'.join(
+            _read_file(f'/sys/hypervisor/version/{part}')
+            for part in ('major', 'minor', 'extra'))
+        return f"{boot_id} {os.uname().release} {xen_version}"
+
+    def get(self) -> Optional[HardwareInfo]:
+        """Get cached hardware information, or None if there is none
+        valid."""
+        key = self.get_system_key()
+        if key is None:
+            return None
+        try:
+            with open(self.path, encoding='utf-8') as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as ex:
+            logger.warning("Failed to read hardware report cache %s: %s",
+                           self.path, str(ex))
+            return None
+        if not isinstance(data, dict) or data.get('version') != self.VERSION \
+                or data.get('key') != key:
+            return None
+        try:
+            return HardwareInfo(**data['fields'])
+        except (KeyError, TypeError):
+            return None
+
+    def store(self, fields: HardwareInfo):
+        """Store hardware information."""
+        key = self.get_system_key()
+        if key is None:
+            return
+        data = {'version': self.VERSION, 'key': key,
+                'fields': fields._asdict()}
+        temp_path = self.path + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                json.dump(data, file)
+            os.replace(temp_path, self.path)
+        except OSError as ex:
+            logger.warning("Failed to write hardware report cache %s: %s",
+                           self.path, str(ex))
+
+
+def get_hardware_report(
+        cache: Optional[HardwareReportCache] = None,
+        collector: Optional[HardwareCollector] = None,
+        qapp: Optional[qubesadmin.Qubes] = None) -> HardwareReport:
+    """Get hardware report from cache or collect it from system files;
+    if that fails, run qubes-hcl-report (which takes a while). The result
+    is stored in cache. If collector is not provided, qapp is used to
+    get information about the host."""
+    if cache is None:
+        cache = HardwareReportCache()
+    fields = cache.get()
+    if fields:
+        return HardwareReport(fields, '')
+    fields = (collector or HardwareCollector(qapp=qapp)).collect()
+    if fields:
+        cache.store(fields)
+        return HardwareReport(fields, '')
+    report = parse_hcl_report(
+        subprocess.check_output(['qubes-hcl-report']).decode())
+    if report.fields:
+        cache.store(report.fields)
+    return report
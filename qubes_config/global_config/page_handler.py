@@ -17,8 +17,15 @@
 #
 # You should have received a copy of the GNU Lesser General Public License along
 # with this program; if not, see <http://www.gnu.org/licenses/>.
-"""Abstract class representing Settings pages."""
+"""Abstract class representing Settings pages, and helpers for page handlers."""
 import abc
+from typing import Optional
+
+import gi
+
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gtk
+
 
 class PageHandler(abc.ABC):
     """abstract class for page handlers"""
@@ -35,3 +42,38 @@ class PageHandler(abc.ABC):
     def get_unsaved(self) -> str:
         """Get human-readable description of unsaved changes, or
         empty string if none were found."""
+
+
+class UnsavedChangesTracker(abc.ABC):
+    """
+    Mixin for handlers that remember the result of their last check for
+    unsaved changes. The check (_find_unsaved) is only repeated after
+    _mark_changed was called: it should be connected to change signals of
+    all widgets the result depends on, with _watch_for_changes, and called
+    whenever the initial state changes (e.g. after saving).
+    """
+    # result of the last check, None if anything changed since then
+    _unsaved: Optional[str] = None
+
+    def _watch_for_changes(self, widget: Gtk.Widget, *signals: str):
+        """Mark state as changed whenever widget emits any of signals."""
+        for signal in signals:
+            widget.connect(signal, self._mark_changed)
+
+    def _mark_changed(self, *_args):
+        """Note that state may have changed since get_unsaved last
+        checked it."""
+        self._unsaved = None
+
+    @abc.abstractmethod
+    def _find_unsaved(self) -> str:
+        """Compare current state with the initial one and get
+        human-readable description of unsaved changes, or empty string
+        if none were found."""
+
+    def get_unsaved(self) -> str:
+        """Get human-readable description of unsaved changes, or
+        empty string if none were found."""
+        if self._unsaved is None:
+            self._unsaved = self._find_unsaved()
+        return self._unsaved
@@ -0,0 +1,139 @@
+# -*- encoding: utf8 -*-
+#
+# The Qubes OS Project, http://www.qubes-os.org
+#
+# Copyright (C) 2022 Marta Marczykowska-Górecka
+#                               <marmarta@invisiblethingslab.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation; either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program; if not, see <http://www.gnu.org/licenses/>.
+"""Loading data required by Settings pages outside of the main thread."""
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Set
+
+import gi
+
+gi.require_version('Gtk', '3.0')
+from gi.repository import GLib
+
+
+class PageDataLoader:
+    """
+    Runs data-fetching tasks (Admin API calls, policy reads, subprocesses)
+    in a pool of worker threads. Each task belongs to a page (or, if page
+    name is None, to all pages); when all tasks of a page are finished,
+    page_ready_callback is called in the main thread. Results themselves are
+    consumed through the returned Future objects.
+    """
+    def __init__(self, max_workers: int = 4):
+        """
+        :param max_workers: maximum number of worker threads
+        """
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='qubes-config-loader')
+
+        self._page_tasks: Dict[Optional[str], List[Future]] = {}
+        self._finished: Set[Future] = set()
+        self._ready_pages: Set[str] = set()
+        self._started = False
+        # page name -> callbacks waiting for that page to become ready
+        self._page_callbacks: Dict[str, List[Callable[[str], None]]] = {}
+
+        self.page_ready_callback: Optional[Callable[[str], None]] = None
+        self.progress_callback: Optional[Callable[[float], None]] = None
+
+    def submit(self, page_name: Optional[str], function: Callable,
+               *args) -> Future:
+        """Run function with args in a worker thread, as a task needed by
+        page_name (or all pages, if page_name is None)."""
+        return self.track(page_name, self.executor.submit(function, *args))
+
+    def track(self, page_name: Optional[str], future: Future) -> Future:
+        """Treat an already submitted future as a task needed by page_name
+        (or all pages, if page_name is None)."""
+        self._page_tasks.setdefault(page_name, []).append(future)
+        future.add_done_callback(
+            lambda f: GLib.idle_add(self._task_finished, f))
+        return future
+
+    def start(self, page_names: List[str],
+              page_ready_callback: Optional[Callable[[str], None]] = None,
+              progress_callback: Optional[Callable[[float], None]] = None):
+        """
+        Start reporting progress to callbacks.
+        :param page_names: list of names of all pages, including those that
+        have no tasks of their own
+        :param page_ready_callback: called in main thread with page name as
+        parameter, once all data for that page is loaded
+        :param progress_callback: called in main thread with fraction of
+        finished tasks, whenever a task is finished
+        """
+        self.page_ready_callback = page_ready_callback
+        self.progress_callback = progress_callback
+        for page_name in page_names:
+            self._page_tasks.setdefault(page_name, [])
+        self._started = True
+        self._check_pages()
+
+    @property
+    def progress(self) -> float:
+        """Fraction of all tasks that are finished."""
+        total = sum(len(tasks) for tasks in self._page_tasks.values())
+        if not total:
+            return 1
+        return len(self._finished) / total
+
+    def is_page_ready(self, page_name: str) -> bool:
+        """Are all tasks required for a given page finished?"""
+        return all(task in self._finished
+                   for task in self.page_tasks(page_name))
+
+    def page_tasks(self, page_name: str) -> List[Future]:
+        """All tasks required by a given page, including those required
+        by all pages."""
+        return self._page_tasks.get(page_name, []) + \
+            self._page_tasks.get(None, [])
+
+    def when_page_ready(self, page_name: str,
+                        callback: Callable[[str], None]):
+        """Call callback (in the main thread) with page name as parameter
+        once all tasks required by the given page are finished; if they
+        already are, callback is called immediately."""
+        if page_name in self._ready_pages:
+            callback(page_name)
+            return
+        self._page_callbacks.setdefault(page_name, []).append(callback)
+
+    def shutdown(self):
+        """Stop accepting tasks; does not wait for running tasks."""
+        self.executor.shutdown(wait=False)
+
+    def _task_finished(self, future: Future) -> bool:
+        self._finished.add(future)
+        if self._started:
+            if self.progress_callback:
+                self.progress_callback(self.progress)
+            self._check_pages()
+        return False
+
+    def _check_pages(self):
+        # callbacks may add new tasks
+        for page_name in list(self._page_tasks):
+            if page_name is None or page_name in self._ready_pages:
+                continue
+            if self.is_page_ready(page_name):
+                self._ready_pages.add(page_name)
+                if self.page_ready_callback:
+                    self.page_ready_callback(page_name)
+                for callback in self._page_callbacks.pop(page_name, []):
+                    callback(page_name)
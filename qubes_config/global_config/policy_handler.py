@@ -22,18 +22,20 @@
 RPC Policy-related functionality.
 """
 from copy import deepcopy
-from typing import Optional, List, Type, Set
+from typing import Optional, List, Type, Set, Union, Tuple, Dict
 
 from qrexec.policy.parser import Rule
 from qrexec.exc import PolicySyntaxError
 
 from ..widgets.gtk_widgets import VMListModeler, ExpanderHandler
-from ..widgets.gtk_utils import show_error, ask_question, show_dialog
-from .page_handler import PageHandler
+from ..widgets.gtk_utils import show_error, ask_question, show_dialog, \
+    BulkUpdate
+from .page_handler import PageHandler, UnsavedChangesTracker
 from .policy_rules import AbstractRuleWrapper, AbstractVerbDescription
 from .policy_manager import PolicyManager
 from .rule_list_widgets import RuleListBoxRow, LimitedRuleListBoxRow
 from .conflict_handler import ConflictFileHandler
+from .virtual_rule_list import VirtualRuleList, RuleEntry
 
 import gi
 
@@ -44,8 +46,78 @@ gi.require_version('Gtk', '3.0')
 from gi.repository import Gtk
 
 
-class PolicyHandler(PageHandler):
+RuleRow = Union[RuleListBoxRow, RuleEntry]
+
+
+class RuleConflictIndex:
+    """
+    Index of rows (RuleListBoxRows or RuleEntries) by source and target of
+    their rules, and, for rules that conflict with any rule with the same
+    source (see AbstractRuleWrapper.conflicts_with_source), by source alone.
+    Finds the same conflicts as checking is_rule_conflicting of every row,
+    without going through all of them.
+    """
+    def __init__(self):
+        self._by_pair: Dict[Tuple[str, str], List[RuleRow]] = {}
+        self._by_source: Dict[str, List[RuleRow]] = {}
+        # rule -> row and keys under which it was indexed; a rule can be
+        # represented by a RuleEntry and, while being edited, by
+        # a RuleListBoxRow, but only one of them is indexed
+        self._keys: Dict[AbstractRuleWrapper,
+                         Tuple[RuleRow, Tuple[str, str], Optional[str]]] = {}
+
+    def add(self, row: RuleRow):
+        """Add a row to the index, replacing any other row with the same
+        rule."""
+        self.remove(row)
+        pair = (str(row.rule.source), str(row.rule.target))
+        source = pair[0] if row.rule.conflicts_with_source() else None
+        self._by_pair.setdefault(pair, []).append(row)
+        if source is not None:
+            self._by_source.setdefault(source, []).append(row)
+        self._keys[row.rule] = (row, pair, source)
+
+    def remove(self, row: RuleRow):
+        """Remove a row (or any other row with the same rule) from the index,
+        if it's there."""
+        keys = self._keys.pop(row.rule, None)
+        if not keys:
+            return
+        indexed_row, pair, source = keys
+        self._by_pair[pair].remove(indexed_row)
+        if source is not None:
+            self._by_source[source].remove(indexed_row)
+
+    def update(self, row: RuleRow):
+        """Update index after rule of a row has changed."""
+        self.add(row)
+
+    def clear(self):
+        """Remove all rows."""
+        self._by_pair.clear()
+        self._by_source.clear()
+        self._keys.clear()
+
+    def find_conflicts(self, row: RuleRow, new_source: str,
+                       new_target: str) -> List[RuleRow]:
+        """Find rows, other than the provided one, conflicting with a rule
+        with new_source and new_target."""
+        result = []
+        for other_row in self._by_pair.get((new_source, new_target), []) + \
+                self._by_source.get(new_source, []):
+            if other_row.rule is row.rule or other_row in result:
+                continue
+            result.append(other_row)
+        return result
+
+
+class PolicyHandler(UnsavedChangesTracker, PageHandler):
     """Handler for a single page with Policy settings."""
+    # if there are more exceptions than this, they are shown in
+    # a VirtualRuleList instead of a list of RuleListBoxRows; None disables
+    # the VirtualRuleList
+    VIRTUAL_LIST_THRESHOLD: Optional[int] = 200
+
     def __init__(self,
                  qapp: qubesadmin.Qubes,
                  gtk_builder: Gtk.Builder,
@@ -117,6 +189,11 @@ class PolicyHandler(PageHandler):
         self.main_list_box.connect('row-activated', self._rule_clicked)
         self.exception_list_box.connect('rules-changed', self.fill_raw_rules)
         self.main_list_box.connect('rules-changed', self.fill_raw_rules)
+        self.exception_list_box.connect('rules-changed',
+                                        self._update_rule_index)
+        self.main_list_box.connect('rules-changed', self._update_rule_index)
+        self.exception_list_box.connect('rules-changed', self._mark_changed)
+        self.main_list_box.connect('rules-changed', self._mark_changed)
 
         self.raw_save.connect("clicked", self._save_raw)
         self.raw_cancel.connect("clicked", self._cancel_raw)
@@ -127,11 +204,20 @@ class PolicyHandler(PageHandler):
         self.exception_list_box.set_sort_func(self.rule_sorting_function)
         self.main_list_box.set_sort_func(self.rule_sorting_function)
 
+        # created when first needed
+        self.virtual_list: Optional[VirtualRuleList] = None
+
+        # built when first needed, see verify_new_rule
+        self._rule_index = RuleConflictIndex()
+        self._rule_index_valid = False
+        # row that passed verification and is being saved
+        self._row_being_saved: Optional[RuleListBoxRow] = None
+
         self.conflict_handler = ConflictFileHandler(
             gtk_builder=gtk_builder, prefix=prefix,
             service_names=[self.service_name],
             own_file_name=self.policy_file_name,
-            policy_manager=self.policy_manager)
+            policy_manager=self.policy_manager, rules=[])
 
         self.expander_handler = ExpanderHandler(
             event_button=self.raw_event_button,
@@ -160,6 +246,7 @@ class PolicyHandler(PageHandler):
             self.rule_class(deny_all_rule), self.qapp, self.verb_description,
                                  is_new_row=True)
         self.exception_list_box.add(new_row)
+        self._rule_index_row_added(new_row)
         new_row.activate()
 
     @property
@@ -168,56 +255,116 @@ class PolicyHandler(PageHandler):
         Get the currently selected set of AbstractRuleWrapper rules.
         """
         if self.disable_radio.get_active():
-            return self.policy_manager.text_to_rules(self.default_policy)
+            return self.default_rules
         return [row.rule.raw_rule for row in self.current_rows if
                 not row.is_new_row or row.changed_from_initial]
 
     @property
-    def current_rows(self) -> List[RuleListBoxRow]:
+    def default_rules(self) -> List[Rule]:
         """
-        Get the current list of all RuleListBoxRows
+        Get rules from the default policy; the policy is parsed only once.
+        Returned rules are shared and must not be modified (deepcopy them
+        first).
         """
-        return self.exception_list_box.get_children() + \
-               self.main_list_box.get_children()
+        return list(
+            self.policy_manager.parse_policy_text(self.default_policy)[0])
+
+    @property
+    def current_rows(self) -> List[Union[RuleListBoxRow, RuleEntry]]:
+        """
+        Get the current list of all RuleListBoxRows (and RuleEntries, for
+        rules shown in the virtual list)
+        """
+        virtual_entries: List[Union[RuleListBoxRow, RuleEntry]] = \
+            self.virtual_list.entries if self.virtual_list else []
+        return self.exception_list_box.get_children() + virtual_entries + \
+            self.main_list_box.get_children()
+
+    def _make_virtual_list_row(self, entry: RuleEntry) -> RuleListBoxRow:
+        assert self.virtual_list
+        row = RuleListBoxRow(self,
+            rule=entry.rule, qapp=self.qapp,
+            verb_description=self.verb_description,
+            enable_delete=entry.enable_delete,
+            enable_vm_edit=entry.enable_vm_edit,
+            is_new_row=entry.is_new_row,
+            edit_finished_callback=self.virtual_list.edit_finished)
+        row.changed_from_initial = entry.changed_from_initial
+        return row
 
     def populate_rule_lists(self, rules: List[Rule]):
         """Populate rule lists with the provided set of Rule objects."""
+        self._rule_index_valid = False
+        self._mark_changed()
+        with BulkUpdate(self.main_list_box,
+                        sort_func=self.rule_sorting_function) as main_update, \
+                BulkUpdate(self.exception_list_box,
+                           sort_func=self.rule_sorting_function) as \
+                exception_update:
+            self._populate_rule_lists(rules, main_update, exception_update)
+
+    def _populate_rule_lists(self, rules: List[Rule], main_update: BulkUpdate,
+                             exception_update: BulkUpdate):
         for child in self.main_list_box.get_children():
             self.main_list_box.remove(child)
         for child in self.exception_list_box.get_children():
             self.exception_list_box.remove(child)
 
+        main_rows: List[RuleListBoxRow] = []
+        exceptions: List[RuleEntry] = []
         for rule in rules:
             wrapped_rule = self.rule_class(rule)
             if wrapped_rule.is_rule_fundamental():
-                self.main_list_box.add(RuleListBoxRow
-                                       (self, wrapped_rule,
-                                        self.qapp, self.verb_description,
-                                        enable_delete=False,
-                                        enable_vm_edit=False))
+                main_rows.append(RuleListBoxRow(self, wrapped_rule,
+                                                self.qapp,
+                                                self.verb_description,
+                                                enable_delete=False,
+                                                enable_vm_edit=False))
                 continue
             fundamental = not (rule.source == '@adminvm' and
                                rule.target == '@anyvm')
-            self.exception_list_box.add(RuleListBoxRow(self,
-                rule=wrapped_rule, qapp=self.qapp,
-                verb_description=self.verb_description,
-                enable_delete=fundamental, enable_vm_edit=fundamental))
-
-        if not self.main_list_box.get_children():
+            exceptions.append(RuleEntry(wrapped_rule,
+                                        enable_delete=fundamental,
+                                        enable_vm_edit=fundamental))
+
+        if self.VIRTUAL_LIST_THRESHOLD is not None and \
+                len(exceptions) > self.VIRTUAL_LIST_THRESHOLD:
+            if not self.virtual_list:
+                self.virtual_list = VirtualRuleList(
+                    edit_list_box=self.exception_list_box,
+                    make_row=self._make_virtual_list_row,
+                    sort_function=self.rule_sorting_function,
+                    row_replaced_callback=self._rule_index_row_replaced)
+            self.virtual_list.set_entries(exceptions)
+        else:
+            if self.virtual_list:
+                self.virtual_list.clear()
+            exception_update.add_sorted(
+                (RuleListBoxRow(self,
+                    rule=entry.rule, qapp=self.qapp,
+                    verb_description=self.verb_description,
+                    enable_delete=entry.enable_delete,
+                    enable_vm_edit=entry.enable_vm_edit)
+                 for entry in exceptions), key=self.rule_sort_key)
+
+        if not main_rows:
             deny_all_rule = self.policy_manager.new_rule(
                 service=self.service_name, source='@anyvm',
                 target='@anyvm', action='deny')
-            self.main_list_box.add(
+            main_rows.append(
                 RuleListBoxRow(self,
                     self.rule_class(deny_all_rule), self.qapp,
                     self.verb_description,
                     enable_delete=False, enable_vm_edit=False))
+        main_update.add_sorted(main_rows, key=self.rule_sort_key)
 
     def set_custom_editable(self, state: bool):
         """If true, set widgets to accept editing custom rules."""
         self.add_button.set_sensitive(state)
         self.main_list_box.set_sensitive(state)
         self.exception_list_box.set_sensitive(state)
+        if self.virtual_list:
+            self.virtual_list.set_sensitive(state)
 
     def _save_raw(self, _widget):
         try:
@@ -245,29 +392,37 @@ class PolicyHandler(PageHandler):
     def fill_raw_rules(self, *_args):
         """Fill raw text window with appropriate data, based on whatever's
         currently selected"""
-        self.text_buffer.set_text(self.policy_manager.rules_to_text(
-            self.current_rules))
+        rules = self.current_rules
+        self.text_buffer.set_text(self.policy_manager.rules_to_text(rules))
+        self.conflict_handler.update_rules(rules)
 
     @staticmethod
-    def cmp_token(token_1, token_2):
-        """Helper method to compare VMTokens in a format Gtk likes."""
+    def token_sort_key(token) -> Tuple[int, str]:
+        """Sort key for VMTokens, ordering them the same way as cmp_token."""
         # @anyvm goes at the end, then other generic tokens,
         # otherwise compare lexically
-        if token_1 == token_2:
+        if token == '@anyvm':
+            return 2, str(token)
+        if token.startswith('@'):
+            return 1, str(token)
+        return 0, str(token)
+
+    @classmethod
+    def cmp_token(cls, token_1, token_2):
+        """Helper method to compare VMTokens in a format Gtk likes."""
+        key_1 = cls.token_sort_key(token_1)
+        key_2 = cls.token_sort_key(token_2)
+        if key_1 == key_2:
             return 0
-        if token_1 == '@anyvm':
-            return 1
-        if token_2 == '@anyvm':
-            return -1
-        is_token_1_keyword = token_1.startswith('@')
-        is_token_2_keyword = token_2.startswith('@')
-        if is_token_1_keyword == is_token_2_keyword:
-            if token_1 < token_2:
-                return -1
-            return 1
-        if is_token_1_keyword:
-            return 1
-        return -1
+        return -1 if key_1 < key_2 else 1
+
+    @classmethod
+    def rule_sort_key(cls, row: Union[RuleListBoxRow, RuleEntry]) -> \
+            Tuple[Tuple[int, str], Tuple[int, str]]:
+        """Sort key for rows, ordering them the same way as
+        rule_sorting_function."""
+        return cls.token_sort_key(row.rule.source), \
+            cls.token_sort_key(row.rule.target)
 
     def rule_sorting_function(self,
                               row_1: RuleListBoxRow, row_2: RuleListBoxRow):
@@ -290,6 +445,7 @@ class PolicyHandler(PageHandler):
         self._custom_toggled()
 
     def _custom_toggled(self, _widget=None):
+        self._mark_changed()
         self.close_all_edits()
         self.set_custom_editable(self.enable_radio.get_active())
         self.fill_raw_rules()
@@ -327,8 +483,50 @@ class PolicyHandler(PageHandler):
         if it was to be associated with provided row. Return None if rule would
         be correct, and string description of error otherwise.
         """
-        return self.verify_rule_against_rows(self.current_rows, row,
-                                      new_source, new_target, new_action)
+        self._row_being_saved = None
+        conflicts = self._get_rule_index().find_conflicts(
+            row, new_source, new_target)
+        if not conflicts:
+            # if verification succeeded, the rule will be saved
+            self._row_being_saved = row
+            return None
+        if len(conflicts) > 1:
+            # report the same row as checking all rows in order would
+            for other_row in self.current_rows:
+                if any(other_row.rule is conflict.rule
+                       for conflict in conflicts):
+                    return str(other_row)
+        return str(conflicts[0])
+
+    def _get_rule_index(self) -> RuleConflictIndex:
+        if not self._rule_index_valid:
+            self._rule_index.clear()
+            for row in self.current_rows:
+                self._rule_index.add(row)
+            self._rule_index_valid = True
+        return self._rule_index
+
+    def _rule_index_row_added(self, row: RuleListBoxRow):
+        if self._rule_index_valid:
+            self._rule_index.add(row)
+
+    def _rule_index_row_replaced(self, old_row: RuleRow, new_row: RuleRow):
+        # a row of the virtual list was activated or restored
+        self._mark_changed()
+        if self._rule_index_valid:
+            self._rule_index.remove(old_row)
+            self._rule_index.add(new_row)
+
+    def _update_rule_index(self, *_args):
+        # rules-changed is emitted after a rule is saved, or after a row
+        # is deleted
+        row = self._row_being_saved
+        self._row_being_saved = None
+        if row is not None and row.get_parent() is not None:
+            if self._rule_index_valid:
+                self._rule_index.update(row)
+        else:
+            self._rule_index_valid = False
 
     @staticmethod
     def close_rows_in_list(row_list: List[RuleListBoxRow]):
@@ -368,26 +566,24 @@ class PolicyHandler(PageHandler):
     def save(self):
         """Save current rules, whatever they are - custom or default."""
         rules = self.current_rules
-        self.policy_manager.save_rules(self.policy_file_name,
-                                       rules, self.current_token)
-        _, self.current_token = self.policy_manager.get_rules_from_filename(
-            self.policy_file_name, self.default_policy)
+        self.current_token = self.policy_manager.save_rules(
+            self.policy_file_name, rules, self.current_token)
 
         self.initial_rules = deepcopy(rules)
+        self._unsaved = ""
 
     def get_unsaved(self) -> str:
         """Get human-readable description of unsaved changes, or
         empty string if none were found."""
         self.close_all_edits()
-
-        unsaved_found = False
-        if len(self.initial_rules) != len(self.current_rules):
-            unsaved_found = True
-        for rule1, rule2 in zip(self.initial_rules, self.current_rules):
-            if str(rule1) != str(rule2):
-                unsaved_found = True
-
-        if unsaved_found:
+        return super().get_unsaved()
+
+    def _find_unsaved(self) -> str:
+        fingerprint_rules = self.policy_manager.fingerprint_rules
+        # edited rows are moved to a separate list, which changes the order
+        # of current rules, but not the rules themselves
+        if sorted(fingerprint_rules(self.initial_rules)) != \
+                sorted(fingerprint_rules(self.current_rules)):
             return "Policy rules"
         return ""
 
@@ -398,6 +594,9 @@ class VMSubsetPolicyHandler(PolicyHandler):
     of VMs, that is, SplitGPG. Currently makes SplitGPG assumptions, such
     as networked qube is dangerous.
     """
+    # lists of exceptions are short, as they are limited to the select qubes
+    VIRTUAL_LIST_THRESHOLD = None
+
     def __init__(self,
                  qapp: qubesadmin.Qubes,
                  gtk_builder: Gtk.Builder,
@@ -469,10 +668,19 @@ class VMSubsetPolicyHandler(PolicyHandler):
         self.close_all_edits()
         self.select_qubes = {row.rule.target for row in
                         self.main_list_box.get_children()}
-        self.populate_rule_lists(self.current_rules)
+        rules = self.current_rules
+        if self.disable_radio.get_active():
+            # rows modify their rules, and default rules are shared
+            rules = deepcopy(rules)
+        self.populate_rule_lists(rules)
 
     def _add_main_rule(self, rule):
-        self.main_list_box.add(RuleListBoxRow(
+        row = self._make_main_row(rule)
+        self.main_list_box.add(row)
+        self._rule_index_row_added(row)
+
+    def _make_main_row(self, rule) -> RuleListBoxRow:
+        return RuleListBoxRow(
             parent_handler=self,
             rule=self.main_rule_class(rule),
             qapp=self.qapp,
@@ -482,18 +690,22 @@ class VMSubsetPolicyHandler(PolicyHandler):
             custom_deletion_warning="Are you sure you want to delete this "
                                     "rule? All related exceptions will also "
                                     "be deleted."
-        ))
+        )
 
     def _add_exception_rule(self, rule):
-        row = LimitedRuleListBoxRow(
+        row = self._make_exception_row(rule)
+        self.exception_list_box.add(row)
+        self._rule_index_row_added(row)
+        return row
+
+    def _make_exception_row(self, rule) -> LimitedRuleListBoxRow:
+        return LimitedRuleListBoxRow(
             parent_handler=self,
             rule=self.exception_rule_class(rule),
             qapp=self.qapp,
             verb_description=self.exception_verb_description,
             filter_function=lambda x: str(x) in self.select_qubes
         )
-        self.exception_list_box.add(row)
-        return row
 
     @staticmethod
     def _has_partial_duplicate(rule: Rule, rules: List[Rule]) -> bool:
@@ -509,10 +721,13 @@ class VMSubsetPolicyHandler(PolicyHandler):
                 return True
         return False
 
-    def populate_rule_lists(self, rules: List[Rule]):
+    def _populate_rule_lists(self, rules: List[Rule], main_update: BulkUpdate,
+                             exception_update: BulkUpdate):
         for child in self.main_list_box.get_children() + \
                      self.exception_list_box.get_children():
             child.get_parent().remove(child)
+        main_rows: List[RuleListBoxRow] = []
+        exception_rows: List[RuleListBoxRow] = []
         # rules with source = '@anyvm' go to main list and their
         # qubes are key qubes
         for rule in reversed(rules):
@@ -523,13 +738,15 @@ class VMSubsetPolicyHandler(PolicyHandler):
                 if rule.target.type == 'keyword':
                     # we do not support this
                     continue
-                self._add_main_rule(rule)
+                main_rows.append(self._make_main_row(rule))
             else:
                 wrapped_exception_rule = self.exception_rule_class(rule)
                 if wrapped_exception_rule.target not in self.select_qubes:
                     continue
-                self._add_exception_rule(rule)
-        self.add_button.set_sensitive(bool(self.main_list_box.get_children()))
+                exception_rows.append(self._make_exception_row(rule))
+        main_update.add_sorted(main_rows, key=self.rule_sort_key)
+        exception_update.add_sorted(exception_rows, key=self.rule_sort_key)
+        self.add_button.set_sensitive(bool(main_rows))
 
     def set_custom_editable(self, state: bool):
         super().set_custom_editable(state)
@@ -591,14 +808,18 @@ class VMSubsetPolicyHandler(PolicyHandler):
         is saved as two rules: a normal one and a one with target/default_target
         put in the default space"""
         if self.disable_radio.get_active():
-            return self.policy_manager.text_to_rules(self.default_policy)
+            return self.default_rules
         rules: List[Rule] = []
+        fingerprints: Set[str] = set()
+        rule_fingerprint = self.policy_manager.rule_fingerprint
         for row in self.exception_list_box.get_children():
             new_rule: Rule = row.rule.raw_rule
-            if str(new_rule) in [str(rule) for rule in rules]:
+            fingerprint = rule_fingerprint(new_rule)
+            if fingerprint in fingerprints:
                 # do not save duplicates
                 continue
             rules.append(new_rule)
+            fingerprints.add(fingerprint)
 
             if new_rule.target == '@default':
                 if getattr(new_rule.action, "default_target", None):
@@ -611,10 +832,12 @@ class VMSubsetPolicyHandler(PolicyHandler):
                     service=self.service_name, source=new_rule.source,
                     target=new_target,
                     action=type(new_rule.action).__name__.lower())
-                if str(another_rule) in [str(rule) for rule in rules]:
+                fingerprint = rule_fingerprint(another_rule)
+                if fingerprint in fingerprints:
                     # do not save duplicates
                     continue
                 rules.append(another_rule)
+                fingerprints.add(fingerprint)
         rules.extend([row.rule.raw_rule for row in
                       self.main_list_box.get_children()])
         return rules
@@ -18,23 +18,208 @@
 # You should have received a copy of the GNU Lesser General Public License along
 # with this program; if not, see <http://www.gnu.org/licenses/>.
 """Class used to manage PolicyClient and do some convenience processing."""
+import hashlib
 import subprocess
-from typing import Optional, List, Tuple
+import threading
+from collections import OrderedDict
+from concurrent.futures import Executor, Future
+from copy import deepcopy
+from typing import Optional, List, Tuple, Dict, Callable, Union, \
+    TYPE_CHECKING
 
 from qrexec.policy.admin_client import PolicyClient
-from qrexec.policy.parser import StringPolicy, Rule
+from ..widgets.lazy_import import lazy_import
+
+if TYPE_CHECKING:
+    from qrexec.policy.parser import Rule
+
+# the parser is only needed once policy files are read
+parser = lazy_import('qrexec.policy.parser')
+
+class PolicyFileIndex:
+    """
+    Index of policy files that apply to services: service name -> list of
+    files in load order, as returned by the policy admin API. Each service
+    is looked up once per session (possibly in the background, see prefetch)
+    and the result is shared by all users, until the index is invalidated.
+    """
+    def __init__(self, get_files: Callable[[str], List[str]]):
+        """
+        :param get_files: function returning list of policy files for
+        a given service
+        """
+        self.get_files = get_files
+        # service name -> list of files, or Future that will return it
+        self._files: Dict[str, Union[List[str], Future]] = {}
+
+    def prefetch(self, executor: Executor, service: str) -> Future:
+        """Start looking up a given service in the background."""
+        future = executor.submit(self.get_files, service)
+        self._files[service] = future
+        return future
+
+    def get(self, service: str) -> List[str]:
+        """Get list of policy files that apply to a given service."""
+        files = self._files.get(service)
+        if isinstance(files, Future):
+            files = files.result()
+        elif files is None:
+            files = self.get_files(service)
+        self._files[service] = files
+        return files
+
+    def contains_file(self, file_name: str) -> bool:
+        """Check if a given file is known to apply to any indexed service."""
+        for files in self._files.values():
+            if not isinstance(files, Future) and file_name in files:
+                return True
+        return False
+
+    def invalidate(self):
+        """Forget everything; services will be looked up again when
+        needed."""
+        self._files.clear()
+
 
 class PolicyManager:
     """
     Single manager for interacting with Qubes Policy.
     Should be used as a singleton.
     """
+    # maximum number of parsed policy texts that are remembered
+    PARSED_TEXTS_CACHE_SIZE = 32
+
     def __init__(self):
         self.policy_client = PolicyClient()
         self.policy_disclaimer = """
 # THIS IS AN AUTOMATICALLY GENERATED POLICY FILE.
 # Any changes made manually may be overwritten by Qubes Configuration Tools.
 """
+        # results of policy queries started in advance, consumed (and removed)
+        # by the first call that needs them
+        self._prefetched_rules: Dict[str, Future] = {}
+        # reads of policy files that can override our files, shared by all
+        # conflict handlers: file name -> Future returning (text, token),
+        # or None if the file could not be read
+        self._file_reads: Dict[str, Future] = {}
+        self._file_reads_lock = threading.Lock()
+        # used to read files for read_policy_files in the background; if
+        # not set, they are read immediately
+        self.executor: Optional[Executor] = None
+        # shared by all conflict handlers
+        self.policy_file_index = PolicyFileIndex(self._get_policy_files)
+        # parsed policy files: file name -> (token, text, rules); an entry
+        # is valid as long as the file has the same token (or, if the token
+        # is not known, the same text)
+        self._policy_cache: \
+            Dict[str, Tuple[Optional[str], str, List[Rule]]] = {}
+        # tokens computed locally after saving a file, not yet confirmed
+        # by the policy admin API: file name -> token
+        self._unverified_tokens: Dict[str, str] = {}
+        # policy text (e.g. default policy of a handler) -> parsed rules
+        # and their fingerprints, least recently used first
+        self._parsed_texts: \
+            'OrderedDict[str, Tuple[List[Rule], Tuple[str, ...]]]' = \
+            OrderedDict()
+
+    def _get_policy_files(self, service: str) -> List[str]:
+        # policy_client is looked up on every call, as it can be replaced
+        return self.policy_client.policy_get_files(service)
+
+    def prefetch_policy_files(self, executor: Executor, service: str) -> Future:
+        """Start getting the list of policy files that apply to a given service
+        in the background, into the policy file index."""
+        return self.policy_file_index.prefetch(executor, service)
+
+    def prefetch_rules(self, executor: Executor, filename: str) -> Future:
+        """Start getting contents of a given policy file in the background;
+        result will be used by the next get_rules_from_filename call
+        for this file."""
+        future = executor.submit(self.policy_client.policy_get, filename)
+        self._prefetched_rules[filename] = future
+        return future
+
+    def prefetch_earlier_files(self, executor: Executor,
+                               file_lists: List[Future],
+                               own_files: List[str]) -> Future:
+        """Start reading, in the background, policy files that are loaded
+        before own_files and thus can override them. file_lists are futures
+        returning lists of files of the relevant services (see
+        prefetch_policy_files); they must have been submitted to the executor
+        before. Files are shared by all users, see read_policy_files."""
+        return executor.submit(self._read_earlier_files, file_lists, own_files)
+
+    def _read_earlier_files(self, file_lists: List[Future],
+                            own_files: List[str]):
+        # runs in a worker thread; files read (or being read) by someone
+        # else are skipped, waiting for them could block the worker pool
+        for file_list in file_lists:
+            for file_name in file_list.result():
+                if file_name in own_files:
+                    break
+                if not file_name or file_name.startswith('/etc/qubes-rpc'):
+                    continue
+                future, claimed = self._claim_file_read(file_name)
+                if claimed:
+                    self._read_file_into(future, file_name)
+
+    def read_policy_files(self, file_names: List[str]) -> Dict[str, Future]:
+        """Start reading given policy files, in the background if executor
+        is set; each file is read once and shared by all users, until it is
+        saved or the cache is invalidated. Return a dict of file name:
+        Future; get the rules with get_read_rules once it is finished."""
+        reads = {}
+        for file_name in file_names:
+            future, claimed = self._claim_file_read(file_name)
+            if claimed:
+                if self.executor:
+                    self.executor.submit(self._read_file_into, future,
+                                         file_name)
+                else:
+                    self._read_file_into(future, file_name)
+            reads[file_name] = future
+        return reads
+
+    def get_read_rules(self, file_name: str) -> Optional[List['Rule']]:
+        """Get rules of a file read with read_policy_files, which must be
+        finished. Return None if the file could not be read, raise
+        PolicySyntaxError if it could not be parsed. Returned rules are
+        shared and must not be modified."""
+        with self._file_reads_lock:
+            future = self._file_reads[file_name]
+        result = future.result()
+        if result is None:
+            return None
+        rules_text, token = result
+        self._check_external_change(file_name, rules_text)
+        return self._get_cached_rules(file_name, rules_text, token)
+
+    def _claim_file_read(self, file_name: str) -> Tuple[Future, bool]:
+        """Get Future of a shared read of the file; if it is not read yet,
+        a new Future is created and the caller must fill it (second
+        returned value is True)."""
+        with self._file_reads_lock:
+            future = self._file_reads.get(file_name)
+            if future is not None:
+                return future, False
+            future = Future()
+            self._file_reads[file_name] = future
+            return future, True
+
+    def _read_file_into(self, future: Future, file_name: str):
+        try:
+            future.set_result(self.policy_client.policy_get(file_name))
+        except subprocess.CalledProcessError:
+            future.set_result(None)
+        except Exception as ex:  # pylint: disable=broad-except
+            future.set_exception(ex)
+
+    def _forget_file_reads(self, file_name: Optional[str] = None):
+        with self._file_reads_lock:
+            if file_name is None:
+                self._file_reads.clear()
+            else:
+                self._file_reads.pop(file_name, None)
 
     def get_conflicting_policy_files(self, service: str,
                                      own_file: str) -> List[str]:
@@ -45,9 +230,8 @@ class PolicyManager:
         :param own_file: name of the config's own file
         :return: list of file names as str
         """
-        files = self.policy_client.policy_get_files(service)
         conflicting_files = []
-        for f in files:
+        for f in self.policy_file_index.get(service):
             if not f:
                 # this is a workaround; if there is no file applicable to the
                 # policy, PolicyClient returns a single empty string.
@@ -58,56 +242,176 @@ class PolicyManager:
         return conflicting_files
 
     def get_rules_from_filename(self, filename: str, default_policy: str) -> \
-            Tuple[List[Rule], Optional[str]]:
+            Tuple[List['Rule'], Optional[str]]:
         """Get rules contained in a provided file. If the file does not exist,
         populate it with provided default policy and return the contents.
         Return list of Rule objects and str of the PolicyClient's token
-        for the file."""
+        for the file. Returned rules are shared with the parsed policy cache
+        and must not be modified (deepcopy them first).
+
+        The file is always read, as the policy admin API does not provide
+        a cheaper way to check its token; only parsing is skipped if
+        the file did not change."""
+        future = self._prefetched_rules.pop(filename, None)
         try:
-            rules_text, token = self.policy_client.policy_get(filename)
+            if future:
+                rules_text, token = future.result()
+            else:
+                rules_text, token = self.policy_client.policy_get(filename)
         except subprocess.CalledProcessError:
             if not default_policy:
                 return [], None
             self.policy_client.policy_replace(filename, default_policy)
+            self._file_saved(filename)
             rules_text, token = self.policy_client.policy_get(filename)
 
+        # token is now known from the source
+        self._unverified_tokens.pop(filename, None)
+        self._check_external_change(filename, rules_text)
+        return self._get_cached_rules(filename, rules_text, token), token
+
+    def _check_external_change(self, filename: str, rules_text: str):
+        cached = self._policy_cache.get(filename)
+        if cached and cached[1] != rules_text:
+            # file was changed outside of this program, it could now apply
+            # to different services
+            self.policy_file_index.invalidate()
+
+    def _get_cached_rules(self, filename: str, rules_text: str,
+                          token: Optional[str]) -> List['Rule']:
+        """Get rules parsed from rules_text, using the parsed policy cache
+        if possible. Returned rules are shared and must not be modified."""
+        cached = self._policy_cache.get(filename)
+        if cached:
+            cached_token, cached_text, cached_rules = cached
+            if (token is not None and cached_token == token) or \
+                    cached_text == rules_text:
+                self._policy_cache[filename] = \
+                    (token, cached_text, cached_rules)
+                return cached_rules
+
         rules = self.text_to_rules(rules_text)
+        self._policy_cache[filename] = (token, rules_text, rules)
+        return rules
 
-        return rules, token
+    def invalidate_cache(self, filename: Optional[str] = None):
+        """Forget parsed contents of a given policy file, or of all files
+        if no file name is provided."""
+        if filename is None:
+            self._policy_cache.clear()
+        else:
+            self._policy_cache.pop(filename, None)
+        self._forget_file_reads(filename)
 
     def compare_rules_to_text(self, rules, file_text) -> bool:
         """Check if the list of rules is equivalent to policy file text."""
-        second_rules = self.text_to_rules(file_text)
-        if len(rules) != len(second_rules):
-            return False
-        for rule, rule_2 in zip(rules, second_rules):
-            if str(rule) != str(rule_2):
-                return False
-        return True
+        return self.fingerprint_rules(rules) == \
+            self.parse_policy_text(file_text)[1]
+
+    def parse_policy_text(self, text: str) -> \
+            Tuple[List['Rule'], Tuple[str, ...]]:
+        """Get rules parsed from a policy text and their fingerprints;
+        each text is parsed only once. Returned rules are shared and must
+        not be modified (deepcopy them first). Only the most recently used
+        texts are remembered."""
+        parsed = self._parsed_texts.get(text)
+        if parsed is None:
+            rules = self.text_to_rules(text)
+            parsed = (rules, self.fingerprint_rules(rules))
+            self._parsed_texts[text] = parsed
+            if len(self._parsed_texts) > self.PARSED_TEXTS_CACHE_SIZE:
+                self._parsed_texts.popitem(last=False)
+        else:
+            self._parsed_texts.move_to_end(text)
+        return parsed
+
+    @staticmethod
+    def rule_fingerprint(rule: 'Rule') -> str:
+        """Canonical representation of a rule: equivalent rules have equal
+        fingerprints, regardless of file and line they come from.
+        The fingerprint is stored in the rule and computed again only if
+        any of its parts was replaced."""
+        action = rule.action
+        parts = (rule.service, rule.argument, rule.source, rule.target,
+                 action, getattr(action, 'target', None),
+                 getattr(action, 'default_target', None))
+        cached = getattr(rule, '_config_fingerprint', None)
+        if cached and all(part is cached_part
+                          for part, cached_part in zip(parts, cached[0])):
+            return cached[1]
+        fingerprint = str(rule)
+        # pylint: disable=protected-access
+        rule._config_fingerprint = (parts, fingerprint)
+        return fingerprint
+
+    @classmethod
+    def fingerprint_rules(cls, rules: List['Rule']) -> Tuple[str, ...]:
+        """Fingerprints of a list of rules, in order."""
+        return tuple(cls.rule_fingerprint(rule) for rule in rules)
 
     @staticmethod
     def new_rule(service: str, source: str, target: str, action: str,
-                 argument: str = "*") -> Rule:
+                 argument: str = "*") -> 'Rule':
         """Create a new Rule object from given parameters: service, source,
         target and action should be provided according to policy file specs."""
-        return Rule.from_line(
+        return parser.Rule.from_line(
             None, f"{service}\t{argument}\t{source}\t{target}\t{action}",
             filepath=None, lineno=0)
 
-    def save_rules(self, file_name: str, rules_list: List[Rule],
-                   token: Optional[str]):
+    @staticmethod
+    def compute_token(text: str) -> str:
+        """Compute the token the policy admin API uses for a file with
+        given contents (a hash of the contents)."""
+        return 'sha256:' + hashlib.sha256(text.encode()).hexdigest()
+
+    def save_rules(self, file_name: str, rules_list: List['Rule'],
+                   token: Optional[str]) -> str:
         """Save provided list of rules to a file. Must provide
         a token corresponding to last file access, to avoid unexpected
-        overwriting."""
+        overwriting. Return token of the file after saving, computed
+        locally; there is no need to read the file again to get it."""
+        # anything fetched earlier is now outdated
+        self._prefetched_rules.pop(file_name, None)
+        self._forget_file_reads(file_name)
         new_text = self.rules_to_text(rules_list)
-        self.policy_client.policy_replace(file_name, new_text, token or "any")
+        self._replace_policy(file_name, new_text, token or "any")
+        self._file_saved(file_name)
+        new_token = self.compute_token(new_text)
+        self._policy_cache[file_name] = \
+            (new_token, new_text, deepcopy(rules_list))
+        self._unverified_tokens[file_name] = new_token
+        return new_token
+
+    def _file_saved(self, file_name: str):
+        if not self.policy_file_index.contains_file(file_name):
+            # a new file may change lists of files of any service
+            self.policy_file_index.invalidate()
+
+    def _replace_policy(self, file_name: str, text: str, token: str):
+        """Replace policy file contents. If token is an unverified, locally
+        computed one and it is rejected, check if the file still contains
+        what was last saved to it; if so, the local token was wrong (and not
+        the file changed), so try again with the actual one."""
+        try:
+            self.policy_client.policy_replace(file_name, text, token)
+        except subprocess.CalledProcessError:
+            if self._unverified_tokens.get(file_name) != token:
+                raise
+            current_text, current_token = \
+                self.policy_client.policy_get(file_name)
+            cached = self._policy_cache.get(file_name)
+            if not cached or cached[1] != current_text:
+                raise
+            self.policy_client.policy_replace(file_name, text, current_token)
+        finally:
+            self._unverified_tokens.pop(file_name, None)
 
-    def rules_to_text(self, rules_list: List[Rule]) -> str:
+    def rules_to_text(self, rules_list: List['Rule']) -> str:
         """Convert list of Rules to text ready to be stored in a file."""
         return self.policy_disclaimer + \
                '\n'.join([str(rule) for rule in rules_list]) + '\n'
 
     @staticmethod
-    def text_to_rules(text: str) -> List[Rule]:
+    def text_to_rules(text: str) -> List['Rule']:
         """Convert policy file text to a list of Rules."""
-        return StringPolicy(policy={'__main__': text}).rules
+        return parser.StringPolicy(policy={'__main__': text}).rules
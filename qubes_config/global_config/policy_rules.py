@@ -91,6 +91,13 @@ class AbstractRuleWrapper(abc.ABC):
         return self.source == other_source and \
                self.target == other_target
 
+    def conflicts_with_source(self) -> bool:
+        """
+        Return True if the rule conflicts with any rule with the same source,
+        regardless of target (see is_rule_conflicting).
+        """
+        return False
+
     @staticmethod
     def get_rule_errors(source: str, target: str, action: str) -> \
             Optional[str]: # pylint: disable=unused-argument
@@ -257,10 +264,13 @@ class RuleTargeted(AbstractRuleWrapper):
         if super().is_rule_conflicting(other_source, other_target,
                                        other_action):
             return True
-        if self.action == 'allow' and other_source == self.source:
+        if self.conflicts_with_source() and other_source == self.source:
             return True
         return False
 
+    def conflicts_with_source(self) -> bool:
+        return self.action == 'allow'
+
 
 class AbstractVerbDescription(abc.ABC):
     """Class used to represent human-readable verb descriptions:
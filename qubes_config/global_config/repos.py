@@ -0,0 +1,50 @@
+# -*- encoding: utf8 -*-
+#
+# The Qubes OS Project, http://www.qubes-os.org
+#
+# Copyright (C) 2022 Marta Marczykowska-Górecka
+#                               <marmarta@invisiblethingslab.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation; either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program; if not, see <http://www.gnu.org/licenses/>.
+"""
+Access to dom0 repository settings, through qubes.repos.* services. Kept
+separate from the Updates page, so that the repository list can be fetched
+in the background without importing its (GTK) handlers.
+"""
+import os
+import subprocess
+
+
+def run_qrexec_repo(service: str, arg: str = '') -> str:
+    """Call a qubes.repos.* service and return its output; raise
+    RuntimeError if the call failed. Safe to call outside of the main
+    thread."""
+    # Set default locale to C in order to prevent error msg
+    # in subprocess call related to falling back to C locale
+    env = os.environ.copy()
+    env['LC_ALL'] = 'C'
+    # Fake up a "qrexec call" to dom0 because dom0 can't qrexec to itself
+    cmd = '/etc/qubes-rpc/' + service
+    process = subprocess.run(['sudo', cmd, arg],
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                       check=False, env=env)
+    if process.returncode != 0 or process.stderr:
+        raise RuntimeError('qrexec call failed')
+    return process.stdout.decode('utf-8')
+
+
+def fetch_repo_list() -> str:
+    """Get raw list of repositories; safe to call outside of the main
+    thread."""
+    return run_qrexec_repo('qubes.repos.List')
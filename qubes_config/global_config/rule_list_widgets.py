@@ -60,7 +60,8 @@ LIMITED_CATEGORIES = {
 }
 
 class VMWidget(Gtk.Box):
-    """VM/category selection widget."""
+    """VM/category selection widget. The selection combobox is only created
+    when the widget becomes editable for the first time."""
     def __init__(self,
                  qapp: qubesadmin.Qubes,
                  categories: Optional[Dict[str, str]],
@@ -85,27 +86,20 @@ class VMWidget(Gtk.Box):
         super().__init__(orientation=Gtk.Orientation.HORIZONTAL)
         self.qapp = qapp
         self.selected_value = initial_value
+        self.categories = categories
+        self.change_callback = change_callback
         self.filter_function = filter_function if filter_function else \
             lambda x: str(x) != 'dom0'
 
-        self.combobox: Gtk.ComboBox = Gtk.ComboBox.new_with_entry()
-        self.combobox.get_child().set_width_chars(24)
-        self.model = VMListModeler(combobox=self.combobox,
-                                   qapp=self.qapp,
-                                   filter_function=self.filter_function,
-                                   event_callback=change_callback,
-                                   current_value=str(self.selected_value),
-                                   additional_options=categories)
+        self._combobox: Optional[Gtk.ComboBox] = None
+        self._model: Optional[VMListModeler] = None
 
         self.name_widget = TokenName(self.selected_value, self.qapp,
                                      categories=categories)
 
-        self.combobox.set_no_show_all(True)
         self.name_widget.set_no_show_all(True)
 
-        self.pack_start(self.combobox, True, True, 0)
         self.pack_start(self.name_widget, True, True, 0)
-        self.combobox.set_halign(Gtk.Align.START)
 
         if additional_text:
             additional_text_widget = \
@@ -121,38 +115,82 @@ class VMWidget(Gtk.Box):
 
         self.set_editable(False)
 
+    def _create_combobox(self):
+        """Create the selection combobox and its model, if they do not
+        exist yet."""
+        if self._combobox is not None:
+            return
+        self._combobox = Gtk.ComboBox.new_with_entry()
+        self._combobox.get_child().set_width_chars(24)
+        self._model = VMListModeler(combobox=self._combobox,
+                                    qapp=self.qapp,
+                                    filter_function=self.filter_function,
+                                    event_callback=self.change_callback,
+                                    current_value=str(self.selected_value),
+                                    additional_options=self.categories)
+        self._combobox.set_no_show_all(True)
+        self._combobox.set_visible(False)
+        self._combobox.set_halign(Gtk.Align.START)
+        self.pack_start(self._combobox, True, True, 0)
+        self.reorder_child(self._combobox, 0)
+
+    @property
+    def combobox(self) -> Gtk.ComboBox:
+        """Selection combobox; created on first use."""
+        self._create_combobox()
+        return self._combobox
+
+    @property
+    def model(self) -> VMListModeler:
+        """VMListModeler of the selection combobox; created on first use."""
+        self._create_combobox()
+        return self._model
+
     def set_editable(self, editable: bool):
         """Change state between editable and non-editable."""
-        # if setting editable to False, make sure combobox is
-        # reverted to initial state
-        if not editable:
+        if editable:
+            self._create_combobox()
+        else:
+            # if setting editable to False, make sure combobox is
+            # reverted to initial state
             self.revert_changes()
-        self.combobox.set_visible(editable)
+        if self._combobox is not None:
+            self._combobox.set_visible(editable)
         self.name_widget.set_visible(not editable)
 
     def is_changed(self) -> bool:
         """Return True if widget was changed from its initial state."""
-        new_value = self.model.get_selected()
+        if self._model is None:
+            return False
+        new_value = self._model.get_selected()
         return str(self.selected_value) != str(new_value)
 
     def save(self):
         """Store changes in model; must be used before set_editable(False) if
         it's desired to see changes reflected in non-editable state"""
-        new_value = str(self.model.get_selected())
+        new_value = str(self.get_selected())
         self.selected_value = new_value
         self.name_widget.set_token(new_value)
 
     def get_selected(self):
         """Get currently selected value."""
-        return self.model.get_selected()
+        if self._model is not None:
+            return self._model.get_selected()
+        # same result as the model would give for its initial value
+        return VMListModeler.get_initial_selection(
+            self.qapp, filter_function=self.filter_function,
+            current_value=str(self.selected_value),
+            additional_options=self.categories)
 
     def revert_changes(self):
         """Roll back to last saved state."""
-        self.model.select_value(self.selected_value)
+        if self._model is not None:
+            self._model.select_value(self.selected_value)
 
 
 class ActionWidget(Gtk.Box):
-    """Action selection widget."""
+    """Action selection widget. The selection combobox is only created
+    when the widget becomes editable for the first time."""
     def __init__(self,
                  choices: Dict[str, str],
                  verb_description: Optional[AbstractVerbDescription],
@@ -171,11 +209,8 @@ class ActionWidget(Gtk.Box):
         self.rule = rule
 
         self.selected_value = rule.action.lower()
-        self.combobox = Gtk.ComboBoxText()
-        self.model = TextModeler(
-            self.combobox,
-            self.choices.inverted,
-            selected_value=self.selected_value)
+        self._combobox: Optional[Gtk.ComboBoxText] = None
+        self._model: Optional[TextModeler] = None
         self.name_widget = Gtk.Label()
         self.name_widget.get_style_context().add_class(action_style_class)
         if self.verb_description:
@@ -185,21 +220,46 @@ class ActionWidget(Gtk.Box):
         else:
             self.additional_text_widget = None
 
-        self.combobox.set_no_show_all(True)
         self.name_widget.set_no_show_all(True)
 
-        self.pack_start(self.combobox, True, True, 0)
         self.pack_start(self.name_widget, True, True, 0)
         if self.verb_description:
             self.pack_end(self.additional_text_widget, False, False, 0)
             self.additional_text_widget.set_halign(Gtk.Align.END)
-        self.combobox.set_halign(Gtk.Align.START)
         self.name_widget.set_halign(Gtk.Align.START)
 
         self._format_new_value(self.selected_value)
-        self.combobox.connect('changed', self._format_verb_description)
         self.set_editable(False)
 
+    def _create_combobox(self):
+        """Create the selection combobox and its model, if they do not
+        exist yet."""
+        if self._combobox is not None:
+            return
+        self._combobox = Gtk.ComboBoxText()
+        self._model = TextModeler(
+            self._combobox,
+            self.choices.inverted,
+            selected_value=self.selected_value)
+        self._combobox.set_no_show_all(True)
+        self._combobox.set_visible(False)
+        self._combobox.set_halign(Gtk.Align.START)
+        self.pack_start(self._combobox, True, True, 0)
+        self.reorder_child(self._combobox, 0)
+        self._combobox.connect('changed', self._format_verb_description)
+
+    @property
+    def combobox(self) -> Gtk.ComboBoxText:
+        """Selection combobox; created on first use."""
+        self._create_combobox()
+        return self._combobox
+
+    @property
+    def model(self) -> TextModeler:
+        """TextModeler of the selection combobox; created on first use."""
+        self._create_combobox()
+        return self._model
+
     def _format_verb_description(self, *_args):
         if self.verb_description:
             self.additional_text_widget.set_text(
@@ -215,30 +275,38 @@ class ActionWidget(Gtk.Box):
 
     def set_editable(self, editable: bool):
         """Change state between editable and non-editable."""
-        if not editable:
+        if editable:
+            self._create_combobox()
+        else:
             self.revert_changes()
-        self.combobox.set_visible(editable)
+        if self._combobox is not None:
+            self._combobox.set_visible(editable)
         self.name_widget.set_visible(not editable)
 
     def is_changed(self) -> bool:
         """Return True if widget was changed from its initial state."""
-        new_value = self.model.get_selected()
+        if self._model is None:
+            return False
+        new_value = self._model.get_selected()
         return str(self.selected_value) != str(new_value)
 
     def save(self):
         """Store changes in model; must be used before set_editable(True) if
         it's desired to see changes reflected in non-editable state"""
-        new_value = self.model.get_selected()
+        new_value = self.get_selected()
         self.selected_value = new_value
         self._format_new_value(new_value)
 
     def get_selected(self):
         """Get currently selected value."""
-        return self.model.get_selected()
+        if self._model is None:
+            return self.selected_value
+        return self._model.get_selected()
 
     def revert_changes(self):
         """Roll back to last saved state."""
-        self.model.select_value(self.selected_value)
+        if self._model is not None:
+            self._model.select_value(self.selected_value)
 
 
 class RuleListBoxRow(Gtk.ListBoxRow):
@@ -253,7 +321,9 @@ class RuleListBoxRow(Gtk.ListBoxRow):
                  initial_verb: str = "will",
                  custom_deletion_warning: str = "Are you sure you want to "
                                                 "delete this rule?",
-                 is_new_row: bool = False):
+                 is_new_row: bool = False,
+                 edit_finished_callback: Optional[Callable[
+                     ['RuleListBoxRow'], None]] = None):
         """
         :param parent_handler: PolicyHandler object this rule belongs to, or
         other owner object that implements verify_new_rule method.
@@ -265,6 +335,8 @@ class RuleListBoxRow(Gtk.ListBoxRow):
         :param initial_verb: verb between source_qube and action
         :param is_new_row: if True, the row is marked as new row and
         will be deleted when closing edit mode without saving changes
+        :param edit_finished_callback: optional function called with this row
+        whenever it leaves edit mode
         """
         super().__init__()
 
@@ -277,6 +349,7 @@ class RuleListBoxRow(Gtk.ListBoxRow):
         self.parent_handler = parent_handler
         self.custom_deletion_warning = custom_deletion_warning
         self.is_new_row = is_new_row
+        self.edit_finished_callback = edit_finished_callback
 
         self.get_style_context().add_class("permission_row")
 
@@ -398,6 +471,9 @@ class RuleListBoxRow(Gtk.ListBoxRow):
         self.show_all()
         self.editing = editing
 
+        if not editing and not setup and self.edit_finished_callback:
+            self.edit_finished_callback(self)
+
     def __str__(self):  # pylint: disable=arguments-differ
         # base class has automatically generated params
         result = "From: "
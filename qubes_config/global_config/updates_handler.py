@@ -20,18 +20,24 @@
 """
 Updates page handler
 """
-import os
-import subprocess
-from typing import Optional, List, Dict
+from copy import deepcopy
+from concurrent.futures import Future
+from functools import partial
+from typing import Optional, List, Dict, Collection, Tuple
 
 from qrexec.policy.parser import Rule
 
-from ..widgets.gtk_widgets import VMListModeler, NONE_CATEGORY
-from ..widgets.utils import get_boolean_feature, apply_feature_change
-from .page_handler import PageHandler
+from ..widgets.gtk_widgets import VMListModeler, NONE_CATEGORY, \
+    SaveProgressDialog
+from ..widgets.utils import get_boolean_feature, apply_feature_changes, \
+    get_feature_snapshot, FeatureChangeError
+from ..widgets.domain_snapshot import get_domain_snapshot
+from ..widgets.gtk_utils import BulkUpdate, show_error
+from .page_handler import PageHandler, UnsavedChangesTracker
 from .policy_rules import RuleTargeted, SimpleVerbDescription
 from .policy_handler import PolicyHandler
 from .policy_manager import PolicyManager
+from . import repos
 from .rule_list_widgets import NoActionListBoxRow
 from .conflict_handler import ConflictFileHandler
 from .vm_flowbox import VMFlowboxHandler
@@ -46,9 +52,16 @@ gi.require_version('Gtk', '3.0')
 from gi.repository import Gtk
 
 
-class RepoHandler:
+class RepoHandler(UnsavedChangesTracker):
     """Handler for repository settings."""
-    def __init__(self, gtk_builder: Gtk.Builder):
+    def __init__(self, gtk_builder: Gtk.Builder,
+                 repo_list: Optional[Future] = None):
+        """
+        :param gtk_builder: Gtk.Builder object
+        :param repo_list: optional Future with the result of
+        repos.fetch_repo_list started earlier; if not provided, repositories
+        will be listed synchronously
+        """
         self.dom0_stable_radio: Gtk.RadioButton = \
             gtk_builder.get_object('updates_dom0_stable_radio')
         self.dom0_testing_sec_radio: Gtk.RadioButton = \
@@ -84,9 +97,12 @@ class RepoHandler:
         self.initial_state: Dict[str, bool] = {}
 
         self.template_community.connect('toggled', self._community_toggled)
+        for repo_dict in self.repo_to_widget_mapping:
+            for widget in repo_dict.values():
+                self._watch_for_changes(widget, 'toggled')
 
         self.repos: Dict[str, Dict] = dict()
-        self._load_data()
+        self._load_data(repo_list)
         self._load_state()
         self._community_toggled()
 
@@ -97,9 +113,11 @@ class RepoHandler:
         else:
             self.template_community_testing.set_sensitive(True)
 
-    def _load_data(self):
+    def _load_data(self, repo_list: Optional[Future] = None):
         try:
-            for row in self._run_qrexec_repo('qubes.repos.List').split('\n'):
+            repo_text = repo_list.result() if repo_list \
+                else repos.fetch_repo_list()
+            for row in repo_text.split('\n'):
                 lst = row.split('\0')
                 repo_name = lst[0]
                 self.repos[repo_name] = dict()
@@ -129,30 +147,14 @@ class RepoHandler:
                 self.initial_state[repo] = widget.get_active()
 
     @staticmethod
-    def _run_qrexec_repo(service, arg=''):
-        # Set default locale to C in order to prevent error msg
-        # in subprocess call related to falling back to C locale
-        env = os.environ.copy()
-        env['LC_ALL'] = 'C'
-        # Fake up a "qrexec call" to dom0 because dom0 can't qrexec to itself
-        cmd = '/etc/qubes-rpc/' + service
-        process = subprocess.run(['sudo', cmd, arg],
-                           stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                           check=False, env=env)
-        if process.returncode != 0 or process.stderr:
-            raise RuntimeError('qrexec call failed')
-        return process.stdout.decode('utf-8')
-
-    def _set_repository(self, repository, state):
+    def _set_repository(repository, state):
         action = 'Enable' if state else 'Disable'
-        result = self._run_qrexec_repo(f'qubes.repos.{action}', repository)
+        result = repos.run_qrexec_repo(f'qubes.repos.{action}', repository)
         if result != 'ok\n':
             raise RuntimeError('qrexec call stdout did not contain "ok"'
                         ' as expected')
 
-    def get_unsaved(self) -> str:
-        """Get human-readable description of unsaved changes, or
-        empty string if none were found."""
+    def _find_unsaved(self) -> str:
         if not self.repos:
             return ""
 
@@ -197,6 +199,7 @@ class RepoHandler:
                         f'Failed to set repository data: {ex}') from ex
         self._load_data()
         self._load_state()
+        self._mark_changed()
 
     def reset(self):
         """Reset any user changes."""
@@ -205,12 +208,16 @@ class RepoHandler:
                 widget.set_active(self.initial_state[repo])
 
 
-class UpdateCheckerHandler:
+class UpdateCheckerHandler(UnsavedChangesTracker):
     """Handler for checking for updates settings."""
     FEATURE_NAME = 'service.qubes-update-check'
 
     def __init__(self, gtk_builder: Gtk.Builder, qapp: qubesadmin.Qubes):
         self.qapp = qapp
+        self.features = get_feature_snapshot(self.qapp)
+        self.features.fetch([self.FEATURE_NAME])
+
+        self.main_window: Gtk.Window = gtk_builder.get_object('main_window')
 
         # check for updates dom0 checkbutton
         self.dom0_update_check: Gtk.CheckButton = \
@@ -228,8 +235,8 @@ class UpdateCheckerHandler:
         self.exception_label: Gtk.Label = \
             gtk_builder.get_object('updates_check_exception_label')
 
-        self.initial_dom0 = get_boolean_feature(self.qapp.domains['dom0'],
-                                 self.FEATURE_NAME, True)
+        self.initial_dom0 = self.features.get_boolean_feature(
+            self.qapp.domains['dom0'], self.FEATURE_NAME, True)
         self.dom0_update_check.set_active(self.initial_dom0)
 
         self.initial_default = get_boolean_feature(
@@ -243,14 +250,8 @@ class UpdateCheckerHandler:
         self.enable_radio.connect('toggled', self._set_label)
         self.disable_radio.connect('toggled', self._set_label)
 
-        self.initial_exceptions: List[qubesadmin.vm.QubesVM] = []
-
-        for vm in self.qapp.domains:
-            if vm.klass == 'AdminVM':
-                continue
-            if get_boolean_feature(vm, self.FEATURE_NAME, True) != \
-                    self.initial_default:
-                self.initial_exceptions.append(vm)
+        self.initial_exceptions: List[qubesadmin.vm.QubesVM] = \
+            self._get_exceptions()
 
         self.exceptions_check.set_active(bool(self.initial_exceptions))
 
@@ -264,6 +265,18 @@ class UpdateCheckerHandler:
         self.exceptions_check.connect("toggled",
                                       self._enable_exceptions_clicked)
 
+        self._watch_for_changes(self.dom0_update_check, 'toggled')
+        self._watch_for_changes(self.enable_radio, 'toggled')
+        self._watch_for_changes(self.exceptions_check, 'toggled')
+        self.flowbox_handler.connect_change_callback(self._mark_changed)
+
+    def _get_exceptions(self) -> List[qubesadmin.vm.QubesVM]:
+        """Get list of vms whose current setting differs from the
+        initial default."""
+        return [vm for vm in self.qapp.domains if vm.klass != 'AdminVM' and
+                self.features.get_boolean_feature(vm, self.FEATURE_NAME, True)
+                != self.initial_default]
+
     def _set_label(self, *_args):
         if self.enable_radio.get_active():
             self.exception_label.set_markup(
@@ -278,9 +291,7 @@ class UpdateCheckerHandler:
     def _enable_exceptions_clicked(self, _widget=None):
         self.flowbox_handler.set_visible(self.exceptions_check.get_active())
 
-    def get_unsaved(self) -> str:
-        """Get human-readable description of unsaved changes, or
-        empty string if none were found."""
+    def _find_unsaved(self) -> str:
         unsaved = []
         if self.initial_dom0 != self.dom0_update_check.get_active():
             unsaved.append('dom0 "check for updates" setting')
@@ -295,20 +306,19 @@ class UpdateCheckerHandler:
 
     def save(self):
         """Save any changes."""
-        # FUTURE: this is fairly slow
+        dom0 = self.qapp.domains['dom0']
+        changes: Dict[qubesadmin.vm.QubesVM, Dict[str, Optional[bool]]] = {}
+
         if self.initial_dom0 != self.dom0_update_check.get_active():
-            apply_feature_change(self.qapp.domains['dom0'],
-                                 self.FEATURE_NAME,
-                                 self.dom0_update_check.get_active())
-            self.initial_dom0 = self.dom0_update_check.get_active()
+            changes.setdefault(dom0, {})[self.FEATURE_NAME] = \
+                self.dom0_update_check.get_active()
 
         default_state = self.enable_radio.get_active()
         changed_default = False
 
         if self.initial_default != default_state:
-            apply_feature_change(
-                self.qapp.domains['dom0'], 'config.default.qubes-update-check',
-                default_state)
+            changes.setdefault(dom0, {})[
+                'config.default.qubes-update-check'] = default_state
             changed_default = True
 
         exceptions = self.flowbox_handler.selected_vms
@@ -318,14 +328,50 @@ class UpdateCheckerHandler:
                     continue
                 vm_desired_state = default_state if vm not in exceptions else \
                     not default_state
-                vm_value = get_boolean_feature(vm, self.FEATURE_NAME, True)
+                vm_value = self.features.get_boolean_feature(
+                    vm, self.FEATURE_NAME, True)
                 if vm_value != vm_desired_state:
                     # if we want False, we need to explicitly set it, else
                     # we just need to erase the feature
-                    apply_feature_change(vm, self.FEATURE_NAME,
-                                         None if vm_desired_state else False)
+                    changes[vm] = {self.FEATURE_NAME:
+                                   None if vm_desired_state else False}
+
+        progress_dialog = SaveProgressDialog(
+            self.main_window, "Saving update checking settings...")
+        progress_dialog.run(partial(apply_feature_changes, self.qapp, changes),
+                            self._changes_applied)
+
+    def _changes_applied(self, future: Future):
+        """Treat applied changes as saved and report those that failed."""
+        failures: Dict[Tuple[str, str], str] = {}
+        try:
+            future.result()
+        except FeatureChangeError as ex:
+            failures = ex.failures
+        except qubesadmin.exc.QubesException as ex:
+            show_error(self.main_window, "Could not save changes",
+                       f"The following error occurred: {ex}")
+            return
 
-        self.flowbox_handler.save()
+        self._update_initial_state({vm for vm, _feature in failures})
+        if failures:
+            show_error(self.main_window, "Could not save changes",
+                       "Failed to change \"check for updates\" setting for "
+                       "the following qubes:\n" + "\n".join(
+                           f"{vm}: {error}" for (vm, _feature), error
+                           in failures.items()))
+
+    def _update_initial_state(self, failed_vms: Collection[str]):
+        """Treat current state as initial, except for changes to
+        failed_vms, which were not saved."""
+        if 'dom0' not in failed_vms:
+            self.initial_dom0 = self.dom0_update_check.get_active()
+            self.initial_default = self.enable_radio.get_active()
+        # features of vms that were changed are fetched again
+        self.initial_exceptions = self._get_exceptions()
+        self.flowbox_handler.save(self.initial_exceptions
+                                  if failed_vms else None)
+        self._mark_changed()
 
     def reset(self):
         """Reset changes and go back to initial state."""
@@ -335,7 +381,7 @@ class UpdateCheckerHandler:
         self.flowbox_handler.reset()
 
 
-class UpdateProxy:
+class UpdateProxy(UnsavedChangesTracker):
     """Handler for the rules connected to UpdateProxy policy."""
     def __init__(self, gtk_builder: Gtk.Builder, qapp: qubesadmin.Qubes,
                  policy_manager: PolicyManager, policy_file_name: str,
@@ -351,9 +397,9 @@ class UpdateProxy:
         self.default_whonix_updatevm = self.qapp.domains.get('sys-whonix', None)
 
         self.first_eligible_vm = None
-        for vm in self.qapp.domains:
+        for vm in get_domain_snapshot(self.qapp):
             if vm.klass != 'AdminVM' and not vm.is_networked():
-                self.first_eligible_vm = vm
+                self.first_eligible_vm = vm.vm
                 break
 
         self.def_updatevm_combo: Gtk.ComboBox = \
@@ -370,10 +416,13 @@ class UpdateProxy:
 
         self.problem_box: Gtk.Box = \
             gtk_builder.get_object('updates_problem_policy')
+        self.main_window: Gtk.Window = gtk_builder.get_object('main_window')
 
-        self.rules, self.current_token = \
+        rules, self.current_token = \
             self.policy_manager.get_rules_from_filename(
                 self.policy_file_name, "")
+        # rules are modified by the exception rows
+        self.rules = deepcopy(rules)
 
         self.updatevm_model = VMListModeler(
             combobox=self.def_updatevm_combo, qapp=self.qapp,
@@ -390,10 +439,15 @@ class UpdateProxy:
                                              self._rule_clicked)
         self.add_updatevm_rule_button.connect("clicked", self.add_new_rule)
 
+        self._watch_for_changes(self.def_updatevm_combo, 'changed')
+        self._watch_for_changes(self.whonix_updatevm_combo, 'changed')
+        self._watch_for_changes(self.updatevm_exception_list,
+                                'rules-changed', 'add', 'remove')
+
         self.whonix_updatevm_box.set_visible(self.has_whonix)
 
     def _check_for_whonix(self) -> bool:
-        for vm in self.qapp.domains:
+        for vm in get_domain_snapshot(self.qapp):
             if 'whonix-updatevm' in vm.tags or 'anon-gateway' in vm.tags:
                 return True
         return False
@@ -416,6 +470,7 @@ class UpdateProxy:
 
     def load_rules(self):
         """Load rules into widgets."""
+        self._mark_changed()
         def_updatevm = self.default_updatevm
         def_whonix_updatevm = None
         if self.has_whonix:
@@ -438,11 +493,13 @@ class UpdateProxy:
             self.whonix_updatevm_model.select_value(str(def_whonix_updatevm))
             self.whonix_updatevm_model.update_initial()
 
-        for child in self.updatevm_exception_list.get_children():
-            self.updatevm_exception_list.remove(child)
+        # this list is not sorted, as order of rules matters
+        with BulkUpdate(self.updatevm_exception_list):
+            for child in self.updatevm_exception_list.get_children():
+                self.updatevm_exception_list.remove(child)
 
-        for rule in reversed(remaining_rules):
-            self.updatevm_exception_list.add(self._get_row(rule))
+            for rule in reversed(remaining_rules):
+                self.updatevm_exception_list.add(self._get_row(rule))
 
     def _get_row(self, rule: Rule, new: bool = False):
         return NoActionListBoxRow(
@@ -518,6 +575,11 @@ class UpdateProxy:
             return True
         return False
 
+    def _find_unsaved(self) -> str:
+        if self.is_changed():
+            return "Update proxy settings"
+        return ""
+
     def reset(self):
         """Reset to initial state."""
         self.load_rules()
@@ -548,29 +610,39 @@ class UpdateProxy:
                        f"target={self.updatevm_model.get_selected()}"))
         new_update_proxies.add(self.updatevm_model.get_selected())
 
-        self.policy_manager.save_rules(self.policy_file_name,
-                                       raw_rules, self.current_token)
-        _, self.current_token = self.policy_manager.get_rules_from_filename(
-            self.policy_file_name, "")
+        self.current_token = self.policy_manager.save_rules(
+            self.policy_file_name, raw_rules, self.current_token)
+        self._mark_changed()
 
-        for vm in self.qapp.domains:
-            if 'service.qubes-updates-proxy' in vm.features:
-                apply_feature_change(vm, 'service.qubes-updates-proxy',
-                                     True if vm in new_update_proxies else None)
-            elif vm in new_update_proxies:
-                apply_feature_change(vm, 'service.qubes-updates-proxy',
-                                     True)
+        progress_dialog = SaveProgressDialog(
+            self.main_window, "Saving update proxy settings...")
+        progress_dialog.run(
+            partial(apply_feature_changes, self.qapp,
+                    {vm: {'service.qubes-updates-proxy':
+                              True if vm in new_update_proxies else None}
+                     for vm in self.qapp.domains}),
+            self._changes_applied)
+
+    def _changes_applied(self, future: Future):
+        try:
+            future.result()
+        except qubesadmin.exc.QubesException as ex:
+            show_error(self.main_window, "Could not save changes",
+                       f"The following error occurred: {ex}")
 
 class UpdatesHandler(PageHandler):
     """Handler for all the disparate Updates functions."""
     def __init__(self,
                  qapp: qubesadmin.Qubes,
                  policy_manager: PolicyManager,
-                 gtk_builder: Gtk.Builder
+                 gtk_builder: Gtk.Builder,
+                 repo_list: Optional[Future] = None
  ):
         """
         :param qapp: Qubes object
         :param policy_manager: PolicyManager object
+        :param repo_list: optional Future with repository list fetched
+        in the background, see repos.fetch_repo_list
         """
 
         self.qapp = qapp
@@ -594,7 +666,8 @@ class UpdatesHandler(PageHandler):
         )
 
         # repo handler
-        self.repo_handler = RepoHandler(gtk_builder=gtk_builder)
+        self.repo_handler = RepoHandler(gtk_builder=gtk_builder,
+                                        repo_list=repo_list)
         self.update_checker = UpdateCheckerHandler(gtk_builder=gtk_builder,
                                                    qapp=self.qapp)
         self.update_proxy = UpdateProxy(gtk_builder=gtk_builder, qapp=self.qapp,
@@ -606,7 +679,8 @@ class UpdatesHandler(PageHandler):
             gtk_builder=gtk_builder, prefix="updates",
             service_names=[self.service_name],
             own_file_name=self.policy_file_name,
-            policy_manager=self.policy_manager)
+            policy_manager=self.policy_manager,
+            rules=self.update_proxy.rules)
 
 
     def close_all_edits(self):
@@ -622,8 +696,7 @@ class UpdatesHandler(PageHandler):
 
         if self.dom0_updatevm_model.is_changed():
             unsaved.append("dom0 Update Proxy")
-        if self.update_proxy.is_changed():
-            unsaved.append("Update proxy settings")
+        unsaved.append(self.update_proxy.get_unsaved())
         unsaved = [x for x in unsaved if x]
         return "\n".join(unsaved)
 
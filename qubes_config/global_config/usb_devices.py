@@ -20,16 +20,18 @@
 """
 USB Devices-related functionality.
 """
+from copy import deepcopy
+from concurrent.futures import Future
 from functools import partial
-from typing import List, Union, Optional, Dict, Callable
+from typing import List, Union, Optional, Dict, Callable, Tuple
 
 from qrexec.policy.parser import Allow
 
-from ..widgets.gtk_widgets import ImageTextButton
+from ..widgets.gtk_widgets import ImageTextButton, SaveProgressDialog
 from ..widgets.utils import get_feature, apply_feature_change_from_widget, \
-    apply_feature_change
-from ..widgets.gtk_utils import ask_question
-from .page_handler import PageHandler
+    apply_feature_changes, get_feature_snapshot, FeatureChangeError
+from ..widgets.gtk_utils import ask_question, show_error
+from .page_handler import PageHandler, UnsavedChangesTracker
 from .policy_rules import RuleSimple
 from .policy_manager import PolicyManager
 from .rule_list_widgets import VMWidget, ActionWidget
@@ -117,7 +119,7 @@ class WidgetWithButtons(Gtk.Box):
         self._initial_value = self.select_widget.get_selected()
 
 
-class USBVMHandler:
+class USBVMHandler(UnsavedChangesTracker):
     """Handler for the usb vm selector."""
 
     FEATURE_NAME = 'config-usbvm-name'
@@ -135,6 +137,8 @@ class USBVMHandler:
         self.widget_with_buttons = WidgetWithButtons(
             self.select_widget, confirm_callback=self._emit_signal)
         self.usb_qube_box.pack_start(self.widget_with_buttons, False, False, 0)
+        self._watch_for_changes(self.widget_with_buttons.confirm_button,
+                                'clicked')
 
     def _emit_signal(self, *_args):
         self.usb_qube_box.get_toplevel().emit('usbvm-changed', None)
@@ -151,6 +155,7 @@ class USBVMHandler:
                                          self.vm,
                                          self.FEATURE_NAME)
         self.widget_with_buttons.update_changed()
+        self._mark_changed()
 
     def get_selected_usbvm(self):
         """Get currently chosen usbvm."""
@@ -160,6 +165,9 @@ class USBVMHandler:
         """Get human-readable description of unsaved changes, or
         empty string if none were found."""
         self.widget_with_buttons.close_edit()
+        return super().get_unsaved()
+
+    def _find_unsaved(self) -> str:
         if self.widget_with_buttons.is_changed():
             return "USB qube"
         return ""
@@ -168,9 +176,10 @@ class USBVMHandler:
         """Reset all changes to their initial state."""
         self.widget_with_buttons.close_edit()
         self.widget_with_buttons.reset()
+        self._mark_changed()
 
 
-class InputDeviceHandler:
+class InputDeviceHandler(UnsavedChangesTracker):
     """Handler for various qubes.Input policies."""
     ACTION_CHOICES = {
         "ask": "always ask",
@@ -204,9 +213,11 @@ qubes.InputTablet * {self.sys_usb} @adminvm deny
                              'qubes.InputTablet': 2}
         self.action_widgets: Dict[str, WidgetWithButtons] = {}
 
-        self.rules, self.current_token = \
+        rules, self.current_token = \
             self.policy_manager.get_rules_from_filename(
                 self.policy_file_name, self.default_policy)
+        # rules are modified by the action widgets
+        self.rules = deepcopy(rules)
 
         self.grid: Gtk.Grid = gtk_builder.get_object('usb_input_grid')
 
@@ -224,6 +235,8 @@ qubes.InputTablet * {self.sys_usb} @adminvm deny
                 verb_description=None,
                 rule=wrapped_rule)
             widget_with_buttons = WidgetWithButtons(action_widget)
+            self._watch_for_changes(widget_with_buttons.confirm_button,
+                                    'clicked')
 
             self.action_widgets[rule.service] = widget_with_buttons
             self.grid.attach(child=widget_with_buttons,
@@ -234,7 +247,7 @@ qubes.InputTablet * {self.sys_usb} @adminvm deny
             gtk_builder=gtk_builder, prefix="usb_input",
             service_names=list(self.policy_order.keys()),
             own_file_name=self.policy_file_name,
-            policy_manager=self.policy_manager)
+            policy_manager=self.policy_manager, rules=self.rules)
 
     def _warn(self):
         self.warn_box.set_visible(True)
@@ -248,20 +261,23 @@ qubes.InputTablet * {self.sys_usb} @adminvm deny
                 widget.select_widget.get_selected()
             rules.append(widget.select_widget.rule.raw_rule)
 
-        self.policy_manager.save_rules(self.policy_file_name, rules,
-                                       self.current_token)
-        _, self.current_token = self.policy_manager.get_rules_from_filename(
-            self.policy_file_name, self.default_policy)
+        self.current_token = self.policy_manager.save_rules(
+            self.policy_file_name, rules, self.current_token)
 
         for widget in self.action_widgets.values():
             widget.update_changed()
+        self._mark_changed()
 
     def get_unsaved(self) -> str:
         """Get human-readable description of unsaved changes, or
         empty string if none were found."""
+        for widget in self.action_widgets.values():
+            widget.close_edit()
+        return super().get_unsaved()
+
+    def _find_unsaved(self) -> str:
         unsaved = []
         for policy, widget in self.action_widgets.items():
-            widget.close_edit()
             if widget.is_changed():
                 name = policy[len('qubes.Input'):]
                 unsaved.append(f'{name} input settings')
@@ -271,9 +287,10 @@ qubes.InputTablet * {self.sys_usb} @adminvm deny
         """Reset changes to the initial state."""
         for widget in self.action_widgets.values():
             widget.reset()
+        self._mark_changed()
 
 
-class U2FPolicyHandler:
+class U2FPolicyHandler(UnsavedChangesTracker):
     """Handler for u2f policy and services."""
     SERVICE_FEATURE = 'service.qubes-u2f-proxy'
     SUPPORTED_SERVICE_FEATURE = 'supported-service.qubes-u2f-proxy'
@@ -304,6 +321,7 @@ policy.RegisterArgument +u2f.Register @anyvm @anyvm deny
         self.problem_no_usbvm_box: Gtk.Box = \
             gtk_builder.get_object('usb_u2f_no_usb_vm_problem')
 
+        self.main_window: Gtk.Window = gtk_builder.get_object('main_window')
         self.enable_check: Gtk.CheckButton = \
             gtk_builder.get_object('usb_u2f_enable_check') # general enable
         self.box: Gtk.Box = \
@@ -354,11 +372,18 @@ policy.RegisterArgument +u2f.Register @anyvm @anyvm deny
             widget.connect('toggled', partial(self._enable_clicked, box))
             self._enable_clicked(box, widget)
 
-        self.initial_enable_state: bool = self.enable_check.get_active()
-        self.initial_register_state: bool = self.register_check.get_active()
-        self.initial_register_all_state: bool = \
-            self.register_all_radio.get_active()
-        self.initial_blanket_check_state: bool = self.blanket_check.get_active()
+        self.initial_enable_state: bool = False
+        self.initial_register_state: bool = False
+        self.initial_register_all_state: bool = False
+        self.initial_blanket_check_state: bool = False
+        self._store_initial_state()
+
+        for widget in (self.enable_check, self.register_check,
+                       self.register_all_radio, self.blanket_check):
+            self._watch_for_changes(widget, 'toggled')
+        for handler in (self.enable_some_handler, self.register_some_handler,
+                        self.blanket_handler):
+            handler.connect_change_callback(self._mark_changed)
 
         self.conflict_file_handler = ConflictFileHandler(
             gtk_builder=gtk_builder, prefix="usb_u2f",
@@ -385,21 +410,67 @@ policy.RegisterArgument +u2f.Register @anyvm @anyvm deny
             return True
         return False
 
+    def _store_initial_state(self):
+        self.initial_enable_state = self.enable_check.get_active()
+        self.initial_register_state = self.register_check.get_active()
+        self.initial_register_all_state = self.register_all_radio.get_active()
+        self.initial_blanket_check_state = self.blanket_check.get_active()
+
+    def _apply_service_changes(self, changes: Dict[
+            qubesadmin.vm.QubesVM, Dict[str, Optional[bool]]]):
+        """Apply changes to U2F service feature in the background; state
+        is reloaded once they are applied."""
+        progress_dialog = SaveProgressDialog(self.main_window,
+                                             "Saving U2F settings...")
+        progress_dialog.run(partial(apply_feature_changes, self.qapp, changes),
+                            self._saved)
+
+    def _saved(self, future: Future):
+        """Reload state after saving; features of qubes that were changed
+        are fetched again, so the state reflects changes that failed."""
+        failures: Dict[Tuple[str, str], str] = {}
+        error = None
+        try:
+            future.result()
+        except FeatureChangeError as ex:
+            failures = ex.failures
+        except qubesadmin.exc.QubesException as ex:
+            error = str(ex)
+        self._initialize_data()
+        self._store_initial_state()
+        self.enable_some_handler.save(self.initially_enabled_vms)
+        self.register_some_handler.save(self.initial_register_vms)
+        self.blanket_handler.save(self.initial_blanket_vms)
+        self._mark_changed()
+        if failures:
+            error = "Failed to change U2F settings for the following " \
+                    "qubes:\n" + "\n".join(
+                        f"{vm} ({feature}): {message}"
+                        for (vm, feature), message in failures.items())
+        if error:
+            show_error(self.main_window, "Could not save changes",
+                       f"The following error occurred: {error}")
+
     def _initialize_data(self):
         self.initially_enabled_vms.clear()
         self.available_vms.clear()
         self.initial_register_vms.clear()
         self.initial_blanket_vms.clear()
 
+        features = get_feature_snapshot(self.qapp)
+        features.fetch([self.SERVICE_FEATURE],
+                       [self.SUPPORTED_SERVICE_FEATURE])
+
         for vm in self.qapp.domains:
-            if vm.features.check_with_template(self.SUPPORTED_SERVICE_FEATURE):
+            if features.check_with_template(
+                    vm, self.SUPPORTED_SERVICE_FEATURE):
                 if vm == self.sys_usb:
                     continue
                 self.available_vms.append(vm)
-            if get_feature(vm, self.SERVICE_FEATURE):
+            if features.get_feature(vm, self.SERVICE_FEATURE):
                 self.initially_enabled_vms.append(vm)
-        available_in_sys_usb = self.sys_usb.features.check_with_template(
-                    self.SUPPORTED_SERVICE_FEATURE)
+        available_in_sys_usb = features.check_with_template(
+            self.sys_usb, self.SUPPORTED_SERVICE_FEATURE)
         if not self.available_vms or not available_in_sys_usb:
             self.problem_no_usbvm_box.show_all()
             self.problem_no_vms_box.show_all()
@@ -453,25 +524,16 @@ policy.RegisterArgument +u2f.Register @anyvm @anyvm deny
 
         if not self.enable_check.get_active():
             # disable all service:
-            for vm in self.initially_enabled_vms:
-                apply_feature_change(vm, self.SERVICE_FEATURE, None)
-
-            self.policy_manager.save_rules(
+            self.current_token = self.policy_manager.save_rules(
                 self.policy_filename,
                 self.policy_manager.text_to_rules(self.deny_all_policy),
                 self.current_token)
 
-            _, self.current_token = self.policy_manager.get_rules_from_filename(
-                self.policy_filename, self.default_policy)
-
-            self._initialize_data()
+            self._apply_service_changes({
+                vm: {self.SERVICE_FEATURE: None}
+                for vm in self.initially_enabled_vms})
             return
 
-        enabled_vms = self.enable_some_handler.selected_vms
-        for vm in self.available_vms:
-            value = None if vm not in enabled_vms else True
-            apply_feature_change(vm, self.SERVICE_FEATURE, value)
-
         rules = []
 
         # register rules
@@ -513,12 +575,13 @@ policy.RegisterArgument +u2f.Register @anyvm @anyvm deny
                     source=str(vm),
                     target=str(self.sys_usb), action="allow"))
 
-        self.policy_manager.save_rules(self.policy_filename, rules,
-                                       self.current_token)
-        _, self.current_token = self.policy_manager.get_rules_from_filename(
-            self.policy_filename, self.default_policy)
+        self.current_token = self.policy_manager.save_rules(
+            self.policy_filename, rules, self.current_token)
 
-        self._initialize_data()
+        enabled_vms = self.enable_some_handler.selected_vms
+        self._apply_service_changes({
+            vm: {self.SERVICE_FEATURE: None if vm not in enabled_vms else True}
+            for vm in self.available_vms})
 
     def reset(self):
         """Reset state to initial state."""
@@ -530,9 +593,7 @@ policy.RegisterArgument +u2f.Register @anyvm @anyvm deny
         self.register_some_handler.reset()
         self.blanket_handler.reset()
 
-    def get_unsaved(self) -> str:
-        """Get human-readable description of unsaved changes, or
-        empty string if none were found."""
+    def _find_unsaved(self) -> str:
         if self.initial_enable_state != self.enable_check.get_active():
             if self.enable_check.get_active():
                 return "U2F enabled"
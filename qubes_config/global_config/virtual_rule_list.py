@@ -0,0 +1,212 @@
+# -*- encoding: utf8 -*-
+#
+# The Qubes OS Project, http://www.qubes-os.org
+#
+# Copyright (C) 2022 Marta Marczykowska-Górecka
+#                               <marmarta@invisiblethingslab.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation; either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program; if not, see <http://www.gnu.org/licenses/>.
+"""
+Model-backed view of long lists of policy rules, which only creates
+widgets for the rule being edited.
+"""
+from typing import List, Callable, Optional, Union
+
+from .policy_rules import AbstractRuleWrapper
+from .rule_list_widgets import RuleListBoxRow, TARGET_CATEGORIES
+
+import gi
+
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gtk, GObject, GLib
+
+
+class RuleEntry:
+    """
+    Lightweight stand-in for a RuleListBoxRow that is not being edited;
+    provides the parts of the RuleListBoxRow interface used by PolicyHandler.
+    """
+    editing = False
+
+    def __init__(self, rule: AbstractRuleWrapper, enable_delete: bool = True,
+                 enable_vm_edit: bool = True, is_new_row: bool = False,
+                 changed_from_initial: bool = False):
+        self.rule = rule
+        self.enable_delete = enable_delete
+        self.enable_vm_edit = enable_vm_edit
+        self.is_new_row = is_new_row
+        self.changed_from_initial = changed_from_initial
+
+    @classmethod
+    def from_row(cls, row: RuleListBoxRow) -> 'RuleEntry':
+        """Create entry with the same state as a given row."""
+        return cls(row.rule, enable_delete=row.enable_delete,
+                   enable_vm_edit=row.enable_vm_edit,
+                   is_new_row=row.is_new_row,
+                   changed_from_initial=row.changed_from_initial)
+
+    @staticmethod
+    def is_changed() -> bool:
+        """Entries are never edited, so never changed."""
+        return False
+
+    def __str__(self):
+        return f"From: {self.rule.source} to: {self.rule.target} " \
+               f"Action: {self.rule.action}"
+
+
+class VirtualRuleList(Gtk.TreeView):
+    """
+    Rules shown in a Gtk.TreeView: only visible rows are rendered, and no
+    widgets are created per rule. When a rule is activated, a regular
+    RuleListBoxRow is created for it in the provided edit ListBox
+    (and the rule is removed from the tree); once editing is finished,
+    the rule goes back to the tree.
+    """
+    def __init__(self, edit_list_box: Gtk.ListBox,
+                 make_row: Callable[[RuleEntry], RuleListBoxRow],
+                 sort_function: Callable,
+                 row_replaced_callback: Optional[Callable[
+                     [Union[RuleEntry, RuleListBoxRow],
+                      Union[RuleEntry, RuleListBoxRow]], None]] = None):
+        """
+        :param edit_list_box: ListBox for rows being edited; the view is
+        packed right after it, in its parent Gtk.Box
+        :param make_row: function creating a RuleListBoxRow for an entry;
+        the row must call VirtualRuleList.edit_finished when its edit mode ends
+        :param sort_function: function comparing two rows (or entries), as
+        used by Gtk.ListBox.set_sort_func
+        :param row_replaced_callback: optional function called with the old
+        and the new object whenever an entry is replaced by a row for
+        editing, or a row goes back to the view as an entry
+        """
+        self.store = Gtk.ListStore(GObject.TYPE_PYOBJECT)
+        super().__init__(model=self.store)
+        self.edit_list_box = edit_list_box
+        self.make_row = make_row
+        self.sort_function = sort_function
+        self.row_replaced_callback = row_replaced_callback
+
+        self.set_headers_visible(False)
+        self.set_activate_on_single_click(True)
+        self.get_style_context().add_class('permission_list')
+
+        for title, data_func in (('Source', self._source_data),
+                                 ('Action', self._action_data),
+                                 ('Target', self._target_data)):
+            renderer = Gtk.CellRendererText()
+            column = Gtk.TreeViewColumn(title, renderer)
+            column.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+            column.set_expand(True)
+            column.set_cell_data_func(renderer, data_func)
+            self.append_column(column)
+        # all rows have the same height, so it does not need to be
+        # computed for each row
+        self.set_fixed_height_mode(True)
+
+        self.store.set_default_sort_func(self._sort_entries)
+        self.store.set_sort_column_id(
+            Gtk.TREE_SORTABLE_DEFAULT_SORT_COLUMN_ID, Gtk.SortType.ASCENDING)
+
+        self.connect('row-activated', self._row_activated)
+        self.edit_list_box.connect('add', self._update_edit_list_visibility)
+        self.edit_list_box.connect('remove',
+                                   self._update_edit_list_visibility)
+
+        parent: Gtk.Box = self.edit_list_box.get_parent()
+        parent.pack_start(self, False, True, 0)
+        parent.reorder_child(
+            self, parent.get_children().index(self.edit_list_box) + 1)
+        self.set_no_show_all(True)
+
+    @staticmethod
+    def _display_token(token: str) -> str:
+        return TARGET_CATEGORIES.get(token, token)
+
+    def _source_data(self, _column, renderer, model, tree_iter, *_args):
+        entry: RuleEntry = model[tree_iter][0]
+        renderer.set_property('text', self._display_token(entry.rule.source))
+
+    @staticmethod
+    def _action_data(_column, renderer, model, tree_iter, *_args):
+        entry: RuleEntry = model[tree_iter][0]
+        renderer.set_property('text', entry.rule.ACTION_CHOICES.get(
+            entry.rule.action, entry.rule.action))
+
+    def _target_data(self, _column, renderer, model, tree_iter, *_args):
+        entry: RuleEntry = model[tree_iter][0]
+        renderer.set_property('text', self._display_token(entry.rule.target))
+
+    def _sort_entries(self, model, iter_1, iter_2, *_args):
+        return self.sort_function(model[iter_1][0], model[iter_2][0])
+
+    def _update_edit_list_visibility(self, *_args):
+        # avoid showing 'no exceptions' placeholder of the empty edit list
+        # when the rules are all here
+        self.edit_list_box.set_visible(
+            bool(self.edit_list_box.get_children()) or not len(self.store))
+
+    @property
+    def entries(self) -> List[RuleEntry]:
+        """All entries currently in the view, in sorted order."""
+        return [row[0] for row in self.store]
+
+    def set_entries(self, entries: List[RuleEntry]):
+        """Replace all entries with the provided ones."""
+        # sorting once after all entries are added is much faster than
+        # keeping the store sorted during insertion
+        self.store.set_sort_column_id(
+            Gtk.TREE_SORTABLE_UNSORTED_SORT_COLUMN_ID, Gtk.SortType.ASCENDING)
+        self.set_model(None)
+        self.store.clear()
+        for entry in entries:
+            self.store.append([entry])
+        self.store.set_sort_column_id(
+            Gtk.TREE_SORTABLE_DEFAULT_SORT_COLUMN_ID, Gtk.SortType.ASCENDING)
+        self.set_model(self.store)
+        self.set_visible(bool(entries))
+        self._update_edit_list_visibility()
+
+    def clear(self):
+        """Remove all entries and hide the view."""
+        self.set_entries([])
+        self.edit_list_box.set_visible(True)
+
+    def _row_activated(self, _tree_view, path, _column):
+        tree_iter = self.store.get_iter(path)
+        entry: RuleEntry = self.store[tree_iter][0]
+        self.store.remove(tree_iter)
+        row = self.make_row(entry)
+        self.edit_list_box.add(row)
+        if self.row_replaced_callback:
+            self.row_replaced_callback(entry, row)
+        row.activate()
+
+    def edit_finished(self, row: RuleListBoxRow):
+        """Should be called when a row created by this view stops being
+        edited; the row is then replaced with an entry in the view."""
+        # the row may still be used by the code that ended editing
+        GLib.idle_add(self._restore_row, row)
+
+    def _restore_row(self, row: RuleListBoxRow):
+        if row.editing or row.get_parent() is not self.edit_list_box:
+            # edited again or deleted
+            return False
+        self.edit_list_box.remove(row)
+        entry = RuleEntry.from_row(row)
+        self.store.append([entry])
+        if self.row_replaced_callback:
+            self.row_replaced_callback(row, entry)
+        self._update_edit_list_visibility()
+        return False
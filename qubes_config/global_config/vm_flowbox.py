@@ -23,7 +23,8 @@ Widget that's a flow box with vms.
 from typing import Optional, List, Callable
 
 from ..widgets.gtk_widgets import VMListModeler, QubeName
-from ..widgets.gtk_utils import load_icon, show_error, ask_question
+from ..widgets.gtk_utils import load_icon, show_error, ask_question, \
+    BulkUpdate
 
 import gi
 
@@ -141,8 +142,9 @@ class VMFlowboxHandler:
         self.flowbox.add(self.placeholder)
 
         self._initial_vms = sorted(initial_vms)
-        for vm in self._initial_vms:
-            self.flowbox.add(VMFlowBoxButton(vm))
+        with BulkUpdate(self.flowbox, sort_func=self._sort_flowbox) as update:
+            update.add_sorted((VMFlowBoxButton(vm) for vm in
+                               self._initial_vms), key=str)
         self.flowbox.show_all()
         self.placeholder.set_visible(not bool(self._initial_vms))
         self.add_box.set_visible(False)
@@ -192,6 +194,14 @@ class VMFlowboxHandler:
         if not state:
             self.add_box.set_visible(False)
 
+    def connect_change_callback(self, callback: Callable):
+        """Add a function to be run whenever the list of selected vms
+        may have changed."""
+        self.flowbox.connect('add', callback)
+        self.flowbox.connect('remove', callback)
+        # vms are only selected if the box is visible
+        self.box.connect('notify::visible', callback)
+
     def add_selected_vm(self, vm):
         """
         Add a vm to selected vms.
@@ -214,16 +224,21 @@ class VMFlowboxHandler:
         """Is the flowbox changed from initial state?"""
         return self.selected_vms != self._initial_vms
 
-    def save(self):
-        """Mark changes as saved, for use in is_changed."""
-        self._initial_vms = self.selected_vms
+    def save(self, saved_vms: Optional[List[qubesadmin.vm.QubesVM]] = None):
+        """Mark changes as saved, for use in is_changed.
+        :param saved_vms: list of vms that are actually selected now, if
+        not all changes could be saved
+        """
+        self._initial_vms = self.selected_vms if saved_vms is None \
+            else sorted(saved_vms)
 
     def reset(self):
         """Reset changed to initial state."""
-        for child in self.flowbox.get_children():
-            if isinstance(child, VMFlowBoxButton):
-                self.flowbox.remove(child)
+        with BulkUpdate(self.flowbox, sort_func=self._sort_flowbox) as update:
+            for child in self.flowbox.get_children():
+                if isinstance(child, VMFlowBoxButton):
+                    self.flowbox.remove(child)
 
-        for vm in self._initial_vms:
-            self.flowbox.add(VMFlowBoxButton(vm))
+            update.add_sorted((VMFlowBoxButton(vm) for vm in
+                               self._initial_vms), key=str)
         self.placeholder.set_visible(not bool(self.selected_vms))
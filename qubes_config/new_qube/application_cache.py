@@ -0,0 +1,142 @@
+# -*- encoding: utf8 -*-
+#
+# The Qubes OS Project, http://www.qubes-os.org
+#
+# Copyright (C) 2022 Marta Marczykowska-Górecka
+#                               <marmarta@invisiblethingslab.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation; either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program; if not, see <http://www.gnu.org/licenses/>.
+"""On-disk cache of applications available in templates."""
+import json
+import logging
+import os
+import threading
+from typing import Optional, List, Dict, Any
+
+from . import appmenus
+from .appmenus import ApplicationEntry
+
+import gi
+
+gi.require_version('GLib', '2.0')
+from gi.repository import GLib
+
+logger = logging.getLogger('qubes-config-manager')
+
+
+def get_default_cache_path() -> str:
+    """Default location of the cache file, in user cache directory."""
+    return os.path.join(
+        GLib.get_user_cache_dir(), 'qubes-config', 'available-apps.json')
+
+
+class ApplicationCache:
+    """
+    Lists of applications available in templates, stored in the user's cache
+    directory between runs. An entry is valid as long as modification times
+    of the template's apps.templates directory and of all .desktop files in
+    it do not change (and no files are added or removed); templates without
+    such directory are never cached. The whole cache is dropped if
+    the locale changes.
+    """
+    VERSION = 3
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        :param path: path of the cache file; by default,
+        qubes-config/available-apps.json in user cache directory
+        """
+        self.path = path or get_default_cache_path()
+        self._lock = threading.Lock()
+        self._templates: Dict[str, Dict[str, Any]] = self._read()
+
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.path, encoding='utf-8') as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as ex:
+            logger.warning("Failed to read application cache %s: %s",
+                           self.path, str(ex))
+            return {}
+        if not isinstance(data, dict) or data.get('version') != self.VERSION:
+            return {}
+        if data.get('languages') != self._get_languages():
+            # application names are translated to the current locale
+            return {}
+        return data.get('templates', {})
+
+    def _write(self):
+        # must be called with self._lock held
+        data = {'version': self.VERSION, 'languages': self._get_languages(),
+                'templates': self._templates}
+        temp_path = self.path + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                json.dump(data, file)
+            os.replace(temp_path, self.path)
+        except OSError as ex:
+            logger.warning("Failed to write application cache %s: %s",
+                           self.path, str(ex))
+
+    @staticmethod
+    def _get_languages() -> List[str]:
+        return list(GLib.get_language_names())
+
+    @staticmethod
+    def _get_mtimes(template_name: str) -> Optional[Dict[str, float]]:
+        """Modification times of the template's apps.templates directory
+        (as '.') and of .desktop files in it, as a dict of file name: mtime;
+        None if the directory cannot be read."""
+        templates_dir = os.path.join(
+            appmenus.get_appmenus_dir(template_name), 'apps.templates')
+        try:
+            mtimes = {'.': os.stat(templates_dir).st_mtime}
+            with os.scandir(templates_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith('.desktop'):
+                        mtimes[entry.name] = entry.stat().st_mtime
+        except OSError:
+            return None
+        return mtimes
+
+    def get(self, template_name: str) -> Optional[List[ApplicationEntry]]:
+        """Get cached applications of a given template, or None if there
+        is no valid cache entry."""
+        mtimes = self._get_mtimes(template_name)
+        if mtimes is None:
+            return None
+        with self._lock:
+            entry = self._templates.get(template_name)
+        if not entry or entry.get('mtimes') != mtimes:
+            return None
+        return [tuple(app) for app in entry['apps']]  # type: ignore
+
+    def store(self, template_name: str, apps: List[ApplicationEntry]):
+        """Store applications of a given template."""
+        mtimes = self._get_mtimes(template_name)
+        if mtimes is None:
+            return
+        with self._lock:
+            self._templates[template_name] = {
+                'mtimes': mtimes, 'apps': [list(app) for app in apps]}
+            self._write()
+
+    def invalidate(self, template_name: str):
+        """Remove a given template from cache."""
+        with self._lock:
+            if self._templates.pop(template_name, None) is not None:
+                self._write()
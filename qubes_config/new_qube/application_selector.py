@@ -20,17 +20,17 @@
 """Handling application selection"""
 # pylint: disable=import-error
 import os
-from typing import Optional, List
+from typing import Optional, List, Tuple, Dict, Set
 import logging
 
 import qubesadmin.vm
 from ..widgets.gtk_widgets import QubeName
-from ..widgets.gtk_utils import load_icon
+from ..widgets.gtk_utils import load_icon, BulkUpdate
 
 import gi
 
 gi.require_version('Gtk', '3.0')
-from gi.repository import Gtk, Gdk, Pango
+from gi.repository import Gtk, Gdk, Pango, GLib
 
 
 logger = logging.getLogger('qubes-config-manager')
@@ -41,37 +41,206 @@ class ApplicationData:
     Class representing information about an available application.
     """
     def __init__(self, name: str, ident: str, comment: Optional[str] = None,
-                 template: Optional[qubesadmin.vm.QubesVM] = None):
+                 template: Optional[qubesadmin.vm.QubesVM] = None,
+                 icon_path: Optional[str] = None):
         """
         :param name: application name
         :param ident: application id (as expected by qvm-appmenus)
         :param comment: optional comment
         :param template: optional qubes VM that is this app's template
+        :param icon_path: optional path to app icon; if not provided,
+        icon from template's apps.tempicons directory is used
         """
         self.name = name
         self.ident = ident
         self.template = template
         additional_description = ".desktop filename: " + str(self.ident)
 
-        file_name_root = self.ident[:-len('.desktop')]
-        self.icon_path = os.path.expanduser(
-            f'~/.local/share/qubes-appmenus/{template}'
-            f'/apps.tempicons/{file_name_root}.png')
+        if icon_path:
+            self.icon_path = icon_path
+        else:
+            file_name_root = self.ident[:-len('.desktop')]
+            self.icon_path = os.path.expanduser(
+                f'~/.local/share/qubes-appmenus/{template}'
+                f'/apps.tempicons/{file_name_root}.png')
 
         if not comment:
             self.comment = additional_description
         else:
             self.comment = comment + "\n" + additional_description
 
+    @staticmethod
+    def parse_line(line: str) -> Tuple[str, str, str]:
+        """
+        Parse output line of qvm-appmenus into ident, name and comment.
+        """
+        ident, name, comment = line.split('|', maxsplit=3)
+        return ident, name, comment
+
     @classmethod
     def from_line(cls, line, template=None):
         """
         Create object from output line of qvm-appmenus, with optional template.
         """
-        ident, name, comment = line.split('|', maxsplit=3)
+        ident, name, comment = cls.parse_line(line)
         return cls(name=name, ident=ident, comment=comment, template=template)
 
 
+class ApplicationSearchIndex:
+    """
+    Search index of applications: lowercase names, comments and .desktop
+    file names, with a trigram index to quickly find substring matches.
+    Results are ranked: matches at the start of name first, then
+    matches at start of a word in the name, anywhere in the name, in .desktop
+    file name, in comment and, finally, fuzzy matches (letters of the search
+    text appear in the name in order). Applications are identified by their
+    template and .desktop file name.
+    """
+    NGRAM_LENGTH = 3
+
+    RANK_NAME_PREFIX = 0
+    RANK_WORD_PREFIX = 1
+    RANK_NAME = 2
+    RANK_IDENT = 3
+    RANK_COMMENT = 4
+    RANK_FUZZY = 5
+
+    def __init__(self):
+        # (template name, ident): (lowercase name, ident, comment)
+        self._entries: Dict[Tuple[str, str], Tuple[str, str, str]] = {}
+        self._ngrams: Dict[str, Set[Tuple[str, str]]] = {}
+        self._last_query: Optional[str] = None
+        self._last_result: Dict[Tuple[str, str], int] = {}
+
+    @staticmethod
+    def get_key(appdata: ApplicationData) -> Tuple[str, str]:
+        """Key identifying a given application in the index."""
+        template = appdata.template
+        return str(template) if template else '', appdata.ident
+
+    @classmethod
+    def _get_ngrams(cls, text: str) -> Set[str]:
+        return {text[i:i + cls.NGRAM_LENGTH]
+                for i in range(len(text) - cls.NGRAM_LENGTH + 1)}
+
+    def add(self, appdata: ApplicationData):
+        """Add application to the index, replacing a previous version of it,
+        if any."""
+        key = self.get_key(appdata)
+        entry = (appdata.name.lower(), appdata.ident.lower(),
+                 appdata.comment.lower())
+        if self._entries.get(key) == entry:
+            return
+        self._remove(key)
+        self._entries[key] = entry
+        for text in entry:
+            for ngram in self._get_ngrams(text):
+                self._ngrams.setdefault(ngram, set()).add(key)
+        self._last_query = None
+
+    def remove_template(self, template_name: str):
+        """Remove all applications of a given template from the index."""
+        for key in [key for key in self._entries if key[0] == template_name]:
+            self._remove(key)
+        self._last_query = None
+
+    def _remove(self, key: Tuple[str, str]):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for text in entry:
+            for ngram in self._get_ngrams(text):
+                keys = self._ngrams.get(ngram)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._ngrams[ngram]
+
+    @staticmethod
+    def _is_fuzzy_match(query: str, text: str) -> bool:
+        position = 0
+        for char in query:
+            position = text.find(char, position) + 1
+            if not position:
+                return False
+        return True
+
+    def _rank(self, query: str, key: Tuple[str, str]) -> Optional[int]:
+        name, ident, comment = self._entries[key]
+        if name.startswith(query):
+            return self.RANK_NAME_PREFIX
+        position = name.find(query)
+        if position > 0:
+            if not name[position - 1].isalnum():
+                return self.RANK_WORD_PREFIX
+            return self.RANK_NAME
+        if query in ident:
+            return self.RANK_IDENT
+        if query in comment:
+            return self.RANK_COMMENT
+        if len(query) > 1 and self._is_fuzzy_match(query, name):
+            return self.RANK_FUZZY
+        return None
+
+    def _get_candidates(self, query: str) -> Set[Tuple[str, str]]:
+        """Entries that can possibly match the query."""
+        if self._last_query and query.startswith(self._last_query):
+            # anything matching the longer text also matches the shorter one
+            # (at least as a fuzzy match)
+            return set(self._last_result)
+        return set(self._entries)
+
+    def _get_substring_candidates(
+            self, query: str,
+            candidates: Set[Tuple[str, str]]) -> Set[Tuple[str, str]]:
+        """Entries that can possibly contain the query as a substring."""
+        if len(query) < self.NGRAM_LENGTH:
+            return candidates
+        for ngram in self._get_ngrams(query):
+            candidates = candidates & self._ngrams.get(ngram, set())
+            if not candidates:
+                break
+        return candidates
+
+    def search(self, text: str) -> Dict[Tuple[str, str], int]:
+        """Find applications matching search text; return dict of
+        key (see get_key): rank, where lower rank means a better match.
+        Result of the last search is cached and used to narrow down
+        the next one, if the search text was extended."""
+        query = text.lower().strip()
+        if query == self._last_query:
+            return self._last_result
+        if not query:
+            result = {key: self.RANK_NAME_PREFIX for key in self._entries}
+            self._last_query, self._last_result = query, result
+            return result
+
+        candidates = self._get_candidates(query)
+        substring_candidates = self._get_substring_candidates(
+            query, candidates)
+
+        result = {}
+        for key in substring_candidates:
+            rank = self._rank(query, key)
+            if rank is not None:
+                result[key] = rank
+        # single letters would match too much
+        if len(query) > 1:
+            for key in candidates - substring_candidates:
+                if self._is_fuzzy_match(query, self._entries[key][0]):
+                    result[key] = self.RANK_FUZZY
+
+        self._last_query = query
+        self._last_result = result
+        return result
+
+    def rank(self, text: str, appdata: ApplicationData) -> Optional[int]:
+        """Rank of a given app for search text, or None if it does not
+        match."""
+        self.add(appdata)
+        return self.search(text).get(self.get_key(appdata))
+
+
 class ApplicationRow(Gtk.ListBoxRow):
     """
     Row representing an app in current template.
@@ -196,6 +365,9 @@ class ApplicationBoxHandler:
     """
     Class to handle popup application box.
     """
+    # time (in ms) without typing after which search results are updated
+    SEARCH_DELAY = 150
+
     def __init__(self, gtk_builder: Gtk.Builder, template_selector):
         """
         :param gtk_builder: Gtk.Builder to get relevant objects
@@ -237,11 +409,16 @@ class ApplicationBoxHandler:
         self.apps_window.connect('key_press_event', self._keypress_event)
         self.apps_list.connect('row-activated', self._row_activated)
 
+        self.search_index = ApplicationSearchIndex()
+        self._search_timeout: Optional[int] = None
+
         self.fill_app_list(default=True)
         self._fill_flow_list()
         self.apps_close.connect('clicked', self._hide_window)
         self.apps_list.set_sort_func(self._sort_func_app_list)
-        self.apps_search.connect('search-changed', self._do_search)
+        # Gtk.SearchEntry's own search-changed signal has a fixed delay,
+        # changed is used to have control over it
+        self.apps_search.connect('changed', self._schedule_search)
         self.template_selector.main_window.connect(
             'template-changed', self.template_change_registered)
 
@@ -269,9 +446,17 @@ class ApplicationBoxHandler:
         # at the top
         selection_comparison = self._cmp(not x.is_selected(),
                                          not y.is_selected())
-        if selection_comparison == 0:
-            return self._cmp(x.appdata.name, y.appdata.name)
-        return selection_comparison
+        if selection_comparison != 0:
+            return selection_comparison
+        search_text = self.apps_search.get_text()
+        if search_text:
+            # better search matches first
+            rank_comparison = self._cmp(
+                self.search_index.rank(search_text, x.appdata) or 0,
+                self.search_index.rank(search_text, y.appdata) or 0)
+            if rank_comparison != 0:
+                return rank_comparison
+        return self._cmp(x.appdata.name, y.appdata.name)
 
     def _sort_flowbox(self, x, y):
         if isinstance(x, AddButton):
@@ -283,7 +468,7 @@ class ApplicationBoxHandler:
     def _filter_func_app_list(self, x: ApplicationRow):
         search_text = self.apps_search.get_text()
         if search_text:
-            return search_text.lower() in x.appdata.name.lower()
+            return self.search_index.rank(search_text, x.appdata) is not None
         return True
 
     def _filter_func_other_list(self, x: ApplicationRow):
@@ -302,15 +487,25 @@ class ApplicationBoxHandler:
         else:
             row.set_selectable(False)
 
+    def _schedule_search(self, *_args):
+        if self._search_timeout is not None:
+            GLib.source_remove(self._search_timeout)
+        self._search_timeout = GLib.timeout_add(self.SEARCH_DELAY,
+                                                self._do_search)
+
     def _do_search(self, *_args):
+        self._search_timeout = None
         self.apps_list.invalidate_filter()
+        self.apps_list.invalidate_sort()
         if self.apps_list_placeholder.get_mapped():
             self.apps_list_other.invalidate_filter()
+            self.apps_list_other.invalidate_sort()
             self.apps_list_other.set_visible(True)
             self.label_other_templates.set_visible(True)
         else:
             self.apps_list_other.set_visible(False)
             self.label_other_templates.set_visible(False)
+        return False
 
     def template_change_registered(self, *_args):
         """
@@ -321,17 +516,10 @@ class ApplicationBoxHandler:
 
     def fill_app_list(self, default=False):
         """Fill application list with apps matching current template."""
-        for child in self.apps_list.get_children():
-            self.apps_list.remove(child)
-
         template_vm = self.template_selector.get_selected_template()
         self.label_apps.set_visible(template_vm is not None)
         self.label_apps_explain.set_visible(template_vm is not None)
-        if not template_vm:
-            return
 
-        available_applications = self.template_selector.get_available_apps(
-            template_vm)
         selected = []
         if default:
             selected = ['firefox.desktop', 'exo-terminal-emulator.desktop',
@@ -341,22 +529,39 @@ class ApplicationBoxHandler:
                 if isinstance(button, ApplicationButton):
                     selected.append(button.appdata.ident)
 
-        for app in available_applications:
-            row = ApplicationRow(app)
-            self.apps_list.add(row)
-            if app.ident in selected:
-                row.activate()
-            row.show_all()
-        self.apps_list.invalidate_sort()
+        with BulkUpdate(self.apps_list, sort_func=self._sort_func_app_list,
+                        filter_func=self._filter_func_app_list) as update:
+            for child in self.apps_list.get_children():
+                self.apps_list.remove(child)
+            if not template_vm:
+                return
+
+            rows = []
+            for app in self.template_selector.get_available_apps(template_vm):
+                self.search_index.add(app)
+                rows.append(ApplicationRow(app))
+            update.add_sorted(rows, key=lambda row: row.appdata.name)
+
+            for row in rows:
+                if row.appdata.ident in selected:
+                    row.activate()
+                row.show_all()
         self.apps_list_other.invalidate_sort()
 
     def _fill_others_list(self):
-        # and the other apps
-        for app in self.template_selector.get_available_apps():
-            row = OtherTemplateApplicationRow(app)
-            self.apps_list_other.add(row)
+        # and the other apps, as they are loaded
         self.apps_list_other.set_visible(False)
         self.apps_list_other.connect('row-activated', self._ask_template_change)
+        self.template_selector.connect_applications_loaded(
+            self._add_other_apps)
+
+    def _add_other_apps(self, template_vm, apps: List[ApplicationData]):
+        # apps of the template could have been loaded before
+        self.search_index.remove_template(str(template_vm))
+        for app in apps:
+            self.search_index.add(app)
+            row = OtherTemplateApplicationRow(app)
+            self.apps_list_other.add(row)
 
     def _hide_template_change(self, *_args):
         self.change_template_msg.hide()
@@ -0,0 +1,141 @@
+# -*- encoding: utf8 -*-
+#
+# The Qubes OS Project, http://www.qubes-os.org
+#
+# Copyright (C) 2022 Marta Marczykowska-Górecka
+#                               <marmarta@invisiblethingslab.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation; either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program; if not, see <http://www.gnu.org/licenses/>.
+"""
+Reading application menu data stored by qvm-appmenus directly from disk.
+"""
+import logging
+import os
+from typing import Optional, List, Dict, Tuple
+
+import qubesadmin.vm
+from ..widgets.domain_snapshot import get_domain_snapshot
+
+import gi
+
+gi.require_version('GLib', '2.0')
+from gi.repository import GLib
+
+logger = logging.getLogger('qubes-config-manager')
+
+# ident, name, comment
+ApplicationEntry = Tuple[str, str, str]
+
+# qvm-appmenus prefixes app names in templates with this placeholder
+VMNAME_PREFIX = '%VMNAME%: '
+
+
+def get_appmenus_dir(vm_name: str) -> str:
+    """Directory where qvm-appmenus keeps menu data of a given qube."""
+    return os.path.join(GLib.get_user_data_dir(), 'qubes-appmenus', vm_name)
+
+
+def _get_source_dirs(vm: qubesadmin.vm.QubesVM, subdir: str) -> List[str]:
+    """Existing subdirectories of qvm-appmenus directories relevant for
+    a given qube: those of its template (recursively) first, then its own,
+    the same order in which qvm-appmenus uses them."""
+    result = []
+    record = get_domain_snapshot(vm.app).get(vm.name)
+    template = getattr(record, 'template', None) if record else None
+    if template is not None:
+        result.extend(_get_source_dirs(template, subdir))
+    path = os.path.join(get_appmenus_dir(vm.name), subdir)
+    if os.path.isdir(path):
+        result.append(path)
+    return result
+
+
+def _get_locale_string(key_file: GLib.KeyFile, key: str) -> Optional[str]:
+    try:
+        return key_file.get_locale_string(
+            GLib.KEY_FILE_DESKTOP_GROUP, key, None)
+    except GLib.Error:
+        return None
+
+
+def _get_boolean(key_file: GLib.KeyFile, key: str) -> bool:
+    try:
+        return key_file.get_boolean(GLib.KEY_FILE_DESKTOP_GROUP, key)
+    except GLib.Error:
+        return False
+
+
+def read_desktop_file(path: str) -> Optional[Tuple[str, str]]:
+    """Read name and comment of an application from its .desktop file,
+    translated to the current locale if possible. Return None if the file
+    cannot be read, has no name, or the application is not meant to be shown
+    (NoDisplay or Hidden is set)."""
+    key_file = GLib.KeyFile()
+    try:
+        key_file.load_from_file(path, GLib.KeyFileFlags.NONE)
+    except GLib.Error as ex:
+        logger.warning("Failed to read %s: %s", path, str(ex))
+        return None
+    if _get_boolean(key_file, GLib.KEY_FILE_DESKTOP_KEY_NO_DISPLAY) or \
+            _get_boolean(key_file, GLib.KEY_FILE_DESKTOP_KEY_HIDDEN):
+        return None
+    name = _get_locale_string(key_file, GLib.KEY_FILE_DESKTOP_KEY_NAME)
+    if not name:
+        return None
+    if name.startswith(VMNAME_PREFIX):
+        name = name[len(VMNAME_PREFIX):]
+    comment = _get_locale_string(key_file, GLib.KEY_FILE_DESKTOP_KEY_COMMENT)
+    return name, comment or ''
+
+
+def read_available_applications(vm: qubesadmin.vm.QubesVM) -> \
+        Optional[List[ApplicationEntry]]:
+    """Get applications available in a given qube from the .desktop files
+    in apps.templates directories, as qvm-appmenus --get-available would.
+    Return None if there are no such directories for this qube."""
+    template_dirs = _get_source_dirs(vm, 'apps.templates')
+    if not template_dirs:
+        return None
+    # later directories override earlier ones
+    files: Dict[str, str] = {}
+    for template_dir in template_dirs:
+        for file_name in os.listdir(template_dir):
+            if file_name.endswith('.desktop'):
+                files[file_name] = os.path.join(template_dir, file_name)
+
+    result = []
+    for ident, path in sorted(files.items()):
+        data = read_desktop_file(path)
+        if data:
+            result.append((ident, data[0], data[1]))
+    return result
+
+
+def get_application_icons(vm: qubesadmin.vm.QubesVM) -> Dict[str, str]:
+    """Get paths of application icons from apps.tempicons directories
+    relevant for a given qube, as a dict of .desktop file name: icon path.
+    If the directories cannot be read, no icons are returned."""
+    icons = {}
+    try:
+        for icon_dir in _get_source_dirs(vm, 'apps.tempicons'):
+            for file_name in os.listdir(icon_dir):
+                root, ext = os.path.splitext(file_name)
+                if ext == '.png':
+                    icons[root + '.desktop'] = \
+                        os.path.join(icon_dir, file_name)
+    except OSError as ex:
+        logger.warning("Failed to read application icons of %s: %s",
+                       vm.name, str(ex))
+        return {}
+    return icons
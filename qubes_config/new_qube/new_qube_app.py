@@ -24,7 +24,6 @@ New Qube program.
 import subprocess
 import sys
 from typing import Optional, Dict, Any
-import pkg_resources
 import logging
 
 import qubesadmin
@@ -36,6 +35,8 @@ from .template_handler import TemplateHandler, TemplateSelector
 from .network_selector import NetworkSelector
 from .advanced_handler import AdvancedHandler
 from ..widgets.gtk_utils import load_icon, show_error, load_theme
+from ..widgets.resources import add_ui
+from ..widgets.domain_snapshot import get_domain_snapshot
 from ..widgets.gtk_widgets import ProgressBarDialog, ImageListModeler,\
     ViewportHandler
 
@@ -89,8 +90,7 @@ class CreateNewQube(Gtk.Application):
         self.progress_bar_dialog.update_progress(0.1)
 
         self.builder = Gtk.Builder()
-        self.builder.add_from_file(pkg_resources.resource_filename(
-            'qubes_config', 'new_qube.glade'))
+        add_ui(self.builder, 'new_qube.glade')
 
         self.main_window = self.builder.get_object('main_window')
         self.qube_name: Gtk.Entry = self.builder.get_object('qube_name')
@@ -98,10 +98,8 @@ class CreateNewQube(Gtk.Application):
             self.builder.get_object('qube_label')
 
         load_theme(widget=self.main_window,
-                   light_theme_path=pkg_resources.resource_filename(
-                       'qubes_config', 'qubes-new-qube-light.css'),
-                   dark_theme_path=pkg_resources.resource_filename(
-                       'qubes_config', 'qubes-new-qube-dark.css'))
+                   light_theme='qubes-new-qube-light.css',
+                   dark_theme='qubes-new-qube-dark.css')
 
         self.progress_bar_dialog.update_progress(0.1)
 
@@ -318,6 +316,7 @@ def main():
     Start the app
     """
     qapp = qubesadmin.Qubes()
+    get_domain_snapshot(qapp).watch_events()
     app = CreateNewQube(qapp)
     app.run(sys.argv)
 
@@ -19,6 +19,9 @@
 # with this program; if not, see <http://www.gnu.org/licenses/>.
 """Template handling."""
 import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
 from typing import Optional, List, Dict, Callable
 import abc
 import logging
@@ -27,12 +30,16 @@ import qubesadmin
 import qubesadmin.events
 import qubesadmin.vm
 from ..widgets.gtk_widgets import VMListModeler
+from ..widgets.domain_snapshot import get_domain_snapshot
 from .application_selector import ApplicationData
+from .application_cache import ApplicationCache
+from .appmenus import ApplicationEntry, read_available_applications, \
+    get_application_icons
 
 import gi
 
 gi.require_version('Gtk', '3.0')
-from gi.repository import Gtk
+from gi.repository import Gtk, GLib
 
 
 logger = logging.getLogger('qubes-config-manager')
@@ -225,12 +232,19 @@ class TemplateSelectorNoneCombo(TemplateSelector):
 
 class TemplateHandler:
     """Class to handle a collection of template selectors"""
-    def __init__(self, gtk_builder: Gtk.Builder, qapp: qubesadmin.Qubes):
+    # maximum number of concurrent qvm-appmenus processes
+    MAX_WORKERS = 4
+
+    def __init__(self, gtk_builder: Gtk.Builder, qapp: qubesadmin.Qubes,
+                 application_cache: Optional[ApplicationCache] = None):
         """
         :param gtk_builder: Gtk.Builder object
         :param qapp: Qubes object
+        :param application_cache: ApplicationCache to use; if not provided,
+        the default on-disk cache is used
         """
         self.qapp = qapp
+        self.application_cache = application_cache or ApplicationCache()
         self.main_window: Gtk.Window = gtk_builder.get_object('main_window')
 
         self.template_selectors: Dict[str, TemplateSelector] = {
@@ -257,10 +271,23 @@ class TemplateHandler:
         self.selected_type: Optional[str] = None
         self.change_vm_type('qube_type_app')
 
-        self._application_data: \
-            Dict[qubesadmin.vm.QubesVM, List[ApplicationData]] = {}
+        # template name: list of available apps; filled in the background
+        # by _collect_application_data
+        self._application_data: Dict[str, List[ApplicationData]] = {}
+        self._application_futures: Dict[str, Future] = {}
+        self._data_lock = threading.Lock()
+        # templates whose apps were already passed to the callbacks
+        self._announced_templates: List[str] = []
+        self._applications_loaded_callbacks: List[Callable[
+            [qubesadmin.vm.QubesVM, List[ApplicationData]], None]] = []
+        self._cached_templates = 0
+        self._collect_start = time.monotonic()
         self._collect_application_data()
 
+        # updating a template can change the apps it provides
+        get_domain_snapshot(self.qapp).add_event_handler(
+            'domain-feature-set:last-updated', self._template_updated)
+
     def change_vm_type(self, vm_type: str):
         """Change selector to one appropriate for the type of VM
         being created"""
@@ -284,24 +311,126 @@ class TemplateHandler:
                 template)
         return False
 
+    @staticmethod
+    def _can_be_template(domain) -> bool:
+        """Can this domain be selected in any of the template selectors?"""
+        return domain.klass in ('TemplateVM', 'StandaloneVM') or \
+            getattr(domain, 'template_for_dispvms', False)
+
     def _collect_application_data(self):
-        for vm in self.qapp.domains:
-            command = ['qvm-appmenus', '--get-available',
-                       '--i-understand-format-is-unstable', '--file-field',
-                       'Comment', vm.name]
+        """Start collecting available apps for all possible templates, in
+        the background; default template goes first, as it is
+        needed to show the main window."""
+        templates = [domain.vm for domain in get_domain_snapshot(self.qapp)
+                     if self._can_be_template(domain)]
+        default_template = self.qapp.default_template
+        if default_template in templates:
+            templates.remove(default_template)
+            templates.insert(0, default_template)
+
+        executor = ThreadPoolExecutor(
+            max_workers=self.MAX_WORKERS, thread_name_prefix='qubes-appmenus')
+        for vm in templates:
+            future = executor.submit(self._load_application_data, vm)
+            future.add_done_callback(
+                lambda _f, vm=vm: GLib.idle_add(self._applications_loaded, vm))
+            self._application_futures[vm.name] = future
+        # already submitted tasks still run to completion
+        executor.shutdown(wait=False)
+
+    def _load_application_data(self, vm: qubesadmin.vm.QubesVM):
+        start = time.monotonic()
+        entries = self.application_cache.get(vm.name)
+        if entries is not None:
+            source = 'cache'
+            with self._data_lock:
+                self._cached_templates += 1
+        else:
+            source = 'application menus'
+            entries = self._get_application_entries(vm)
+            if entries is None:
+                entries = []
+            else:
+                self.application_cache.store(vm.name, entries)
+        icons = get_application_icons(vm)
+        available_applications = [
+            ApplicationData(ident=ident, name=name, comment=comment,
+                            template=vm, icon_path=icons.get(ident))
+            for ident, name, comment in entries]
+        logger.debug("Loaded %d applications of %s from %s in %.3f s",
+                     len(available_applications), vm.name, source,
+                     time.monotonic() - start)
+        with self._data_lock:
+            self._application_data[vm.name] = available_applications
+
+    @staticmethod
+    def _get_application_entries(vm: qubesadmin.vm.QubesVM) -> \
+            Optional[List[ApplicationEntry]]:
+        try:
+            entries = read_available_applications(vm)
+        except OSError as ex:
+            logger.warning("Failed to read application menus of %s: %s",
+                           vm.name, str(ex))
+            entries = None
+        if entries is not None:
+            return entries
+        # appmenus directory layout not available, ask qvm-appmenus
+        command = ['qvm-appmenus', '--get-available',
+                   '--i-understand-format-is-unstable', '--file-field',
+                   'Comment', vm.name]
+        try:
+            output = subprocess.check_output(command).decode()
+        except (subprocess.CalledProcessError, OSError) as ex:
+            logger.warning("Failed to get available applications for %s: %s",
+                           vm.name, str(ex))
+            return None
+        return [ApplicationData.parse_line(line)
+                for line in output.splitlines()]
+
+    def _template_updated(self, subject, _event, **_kwargs):
+        if subject is not None:
+            self.application_cache.invalidate(str(subject))
+
+    def _applications_loaded(self, vm: qubesadmin.vm.QubesVM):
+        self._announced_templates.append(vm.name)
+        if len(self._announced_templates) == len(self._application_futures):
+            logger.debug("Loaded applications of %d templates (%d from cache) "
+                         "in %.3f s", len(self._application_futures),
+                         self._cached_templates,
+                         time.monotonic() - self._collect_start)
+        apps = self.get_available_apps(vm)
+        for callback in self._applications_loaded_callbacks:
+            callback(vm, apps)
+        return False
 
-            available_applications = [
-                ApplicationData.from_line(line, template=vm)
-                for line in subprocess.check_output(
-                    command).decode().splitlines()]
-            self._application_data[vm] = available_applications
+    def connect_applications_loaded(
+            self, callback: Callable[[qubesadmin.vm.QubesVM,
+                                      List[ApplicationData]], None]):
+        """Register a function to be called with a template and list of its
+        apps, for every template whose apps are loaded. Templates that
+        are already loaded are passed to the function immediately,
+        the rest as they finish loading (in Gtk main loop)."""
+        self._applications_loaded_callbacks.append(callback)
+        for vm_name in self._announced_templates:
+            vm = self.qapp.domains[vm_name]
+            callback(vm, self.get_available_apps(vm))
 
     def get_available_apps(self, vm: Optional[qubesadmin.vm.QubesVM] = None):
-        """Get apps available for a given template."""
+        """Get apps available for a given template; if they are still being
+        loaded, wait for them. If template was not given, get apps of all
+        templates that are already loaded, without waiting for the rest
+        (see connect_applications_loaded)."""
         if vm:
-            return self._application_data.get(vm, [])
-        return [appdata for appdata_list
-                in self._application_data.values() for appdata in appdata_list]
+            future = self._application_futures.get(str(vm), None)
+            if future:
+                future.result()
+            with self._data_lock:
+                return self._application_data.get(str(vm), [])
+        result = []
+        with self._data_lock:
+            for vm_name in self._application_futures:
+                result.extend(self._application_data.get(vm_name, []))
+        return result
 
     def select_template(self, vm: Optional[str]):
         """Selected a vm in the current selector as provided by
@@ -19,6 +19,8 @@
 # with this program; if not, see <http://www.gnu.org/licenses/>.
 """Conftest helper pytest file: fixtures container here are
  reachable by all tests"""
+import concurrent.futures
+import os
 import pytest
 import pkg_resources
 import subprocess
@@ -31,7 +33,9 @@ gi.require_version('GdkPixbuf', '2.0')
 from gi.repository import Gtk
 
 from ..global_config.global_config import GlobalConfig
+from ..global_config.hardware_report import HardwareReport
 from ..global_config.policy_manager import PolicyManager
+from ..widgets.gtk_widgets import SaveProgressDialog
 from ..new_qube.new_qube_app import CreateNewQube
 
 default_vm_properties = {
@@ -137,6 +141,9 @@ def add_expected_vm(qapp,
         qapp.expected_calls[(name, "admin.vm.property.Get", prop, None)] = \
             b"0\x00" + prop_line.encode()
 
+    qapp.expected_calls[(name, "admin.vm.property.GetAll", None, None)] = \
+        properties_getall
+
     qapp.expected_calls[(name, "admin.vm.feature.List", None, None)] = \
         ("0\x00" + "".join(f"{feature}\n" for feature, value in
                            features.items() if value is not None)).encode()
@@ -209,6 +216,56 @@ def add_feature_to_all(qapp, feature_name, enable_vm_names: List[str]):
                              feature_name, None)] = result
 
 
+@pytest.fixture(autouse=True)
+def user_data_dirs(tmp_path, monkeypatch):
+    """Keep tests away from caches and application menus of the user
+    running them."""
+    monkeypatch.setattr(
+        'qubes_config.new_qube.application_cache.get_default_cache_path',
+        lambda: str(tmp_path / 'cache' / 'available-apps.json'))
+    monkeypatch.setattr(
+        'qubes_config.new_qube.appmenus.get_appmenus_dir',
+        lambda vm_name: str(tmp_path / 'qubes-appmenus' / vm_name))
+
+
+@pytest.fixture(autouse=True)
+def fake_hardware_report(monkeypatch):
+    """Keep tests away from hardware information of the machine running
+    them (and from its cache). The fake function is what GlobalConfig
+    submits to its loader, so it is also used if loading finishes after
+    the test."""
+    report = HardwareReport(None, 'Hardware information is not available '
+                                  'in tests')
+    monkeypatch.setattr(
+        'qubes_config.global_config.global_config.get_hardware_report',
+        lambda **_kwargs: report)
+    return report
+
+
+@pytest.fixture
+def wait_for_saves():
+    """Function that waits until changes saved in the background (see
+    SaveProgressDialog.run) are applied, and lets the main loop process
+    the results."""
+    def _wait():
+        # there is a single worker, so this runs after all earlier saves
+        SaveProgressDialog.executor.submit(lambda: None).result(timeout=10)
+        while Gtk.events_pending():
+            Gtk.main_iteration()
+    return _wait
+
+
+@pytest.fixture
+def wait_for_applications():
+    """Function that waits until apps of all templates of a given
+    TemplateHandler are loaded."""
+    def _wait(template_handler):
+        # pylint: disable=protected-access
+        concurrent.futures.wait(
+            template_handler._application_futures.values(), timeout=10)
+    return _wait
+
+
 @pytest.fixture
 def test_qapp():
     """Test QubesApp"""
@@ -346,6 +403,10 @@ def real_builder():
     builder = Gtk.Builder()
     builder.add_from_file(pkg_resources.resource_filename(
         'qubes_config', 'global_config.glade'))
+    pages_dir = pkg_resources.resource_filename(
+        'qubes_config', 'global_config_pages')
+    for page_file in sorted(os.listdir(pages_dir)):
+        builder.add_from_file(os.path.join(pages_dir, page_file))
     return builder
 
 
@@ -20,9 +20,12 @@
 # pylint: disable=missing-module-docstring
 # pylint: disable=missing-function-docstring
 # pylint: disable=missing-class-docstring
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
 
 from ..global_config.conflict_handler import ConflictFileListRow,\
-    ConflictFileHandler
+    ConflictFileHandler, ConflictAnalyzer
+from ..global_config.policy_manager import PolicyManager
 
 
 def test_row_normal_and_legacy():
@@ -112,3 +115,163 @@ def test_conflict_handler_empty(test_builder, test_policy_manager):
     )
 
     assert not conflict_handler.problem_box.get_visible()
+
+
+def test_conflict_analyzer():
+    manager = PolicyManager()
+    analyzer = ConflictAnalyzer()
+    analyzer.add_rules('a', manager.text_to_rules(
+        'Test * test-vm test-red deny\n'
+        '* * @anyvm @anyvm deny'))
+    analyzer.add_rules('b', manager.text_to_rules(
+        'Test +arg @anyvm test-blue allow'))
+
+    conflict = analyzer.find_shadowing_rule(
+        manager.new_rule('Test', 'test-vm', 'test-red', 'allow'))
+    assert (conflict.file_name, conflict.lineno) == ('a', 1)
+
+    # more general rule from an earlier file wins
+    conflict = analyzer.find_shadowing_rule(manager.new_rule(
+        'Test', 'test-vm', 'test-blue', 'allow', argument='+arg'))
+    assert (conflict.file_name, conflict.lineno) == ('a', 2)
+
+    # @anyvm does not match dom0 or @default
+    assert not analyzer.find_shadowing_rule(
+        manager.new_rule('Test', 'test-vm', '@adminvm', 'allow'))
+    assert not analyzer.find_shadowing_rule(
+        manager.new_rule('Test', 'test-vm', '@default', 'allow'))
+
+
+def test_conflict_analyzer_partial():
+    manager = PolicyManager()
+    analyzer = ConflictAnalyzer()
+    analyzer.add_rules('a', manager.text_to_rules(
+        'Other * @anyvm @anyvm deny\n'
+        'Test * work @anyvm deny\n'
+        'Test +arg @tag:tagged @anyvm deny'))
+    analyzer.add_rules('b', manager.text_to_rules(
+        'Test * @type:AppVM @anyvm deny\n'
+        '* * test-red @adminvm deny'))
+
+    # narrower earlier rule may override a wider one
+    rule = manager.new_rule('Test', '@anyvm', '@anyvm', 'allow')
+    assert not analyzer.find_shadowing_rule(rule)
+    conflict = analyzer.analyze([rule])[0]
+    assert conflict.partial
+    assert (conflict.file_name, conflict.lineno) == ('a', 2)
+
+    # tags and types may match any qube
+    conflict = analyzer.analyze([manager.new_rule(
+        'Test', 'test-vm', '@anyvm', 'allow', argument='+arg')])[0]
+    assert conflict.partial
+    assert (conflict.file_name, conflict.lineno) == ('a', 3)
+    conflict = analyzer.analyze([manager.new_rule(
+        'Test', 'test-vm', 'test-blue', 'allow', argument='+other')])[0]
+    assert (conflict.file_name, conflict.lineno) == ('b', 1)
+
+    # exact shadowing is not partial
+    conflict = analyzer.analyze([manager.new_rule(
+        'Test', 'work', 'test-blue', 'allow')])[0]
+    assert not conflict.partial
+
+    # different qubes, arguments, services or targets do not overlap
+    assert not analyzer.analyze([
+        manager.new_rule('Test', 'test-vm', '@default', 'allow'),
+        manager.new_rule('Third', 'test-blue', '@adminvm', 'allow')])
+    assert analyzer.analyze([
+        manager.new_rule('Third', 'test-red', 'dom0', 'allow')])
+
+
+def test_conflict_handler_rules(test_builder, test_policy_manager):
+    client = test_policy_manager.policy_client
+    client.service_to_files['ConflictTest'] = ['a', 'b', 'c', 'test', 'z']
+    client.files['a'] = 'ConflictTest * test-vm @anyvm deny\n' \
+                        'Other * @anyvm @anyvm deny'
+    client.file_tokens['a'] = 'a'
+    client.files['b'] = 'ConflictTest * @anyvm test-blue allow'
+    client.file_tokens['b'] = 'b'
+
+    rules = test_policy_manager.text_to_rules(
+        'ConflictTest * test-vm test-red allow\n'
+        'ConflictTest * test-red test-blue ask\n'
+        'ConflictTest * test-red test-vm ask')
+
+    conflict_handler = ConflictFileHandler(
+        gtk_builder=test_builder,
+        prefix="policytest",
+        service_names=['ConflictTest'],
+        own_file_name='test',
+        policy_manager=test_policy_manager,
+        rules=rules
+    )
+
+    # c cannot be read, so it is listed as a whole
+    assert conflict_handler.problem_box.get_visible()
+    children_labels = [str(child) for child in
+                       conflict_handler.problem_list.get_children()]
+    assert children_labels == ['c', 'a:1', 'b:1']
+    assert [str(conflict.rule) for conflict in conflict_handler.conflicts] \
+           == [str(rule) for rule in rules[:2]]
+
+    client.service_to_files['ConflictTest'] = ['a', 'b', 'test', 'z']
+    test_policy_manager.policy_file_index.invalidate()
+    conflict_handler = ConflictFileHandler(
+        gtk_builder=test_builder,
+        prefix="policytest",
+        service_names=['ConflictTest'],
+        own_file_name='test',
+        policy_manager=test_policy_manager,
+        rules=rules
+    )
+    conflict_handler.update_rules(rules[2:])
+    assert not conflict_handler.problem_box.get_visible()
+    assert not conflict_handler.problem_list.get_children()
+
+    conflict_handler.update_rules(rules[1:])
+    assert conflict_handler.problem_box.get_visible()
+    children_labels = [str(child) for child in
+                       conflict_handler.problem_list.get_children()]
+    assert children_labels == ['b:1']
+
+
+def test_conflict_handler_prefetched_files(test_builder, test_policy_manager):
+    client = test_policy_manager.policy_client
+    client.service_to_files['ConflictTest'] = ['a', 'test', 'z']
+    client.service_to_files['ConflictOther'] = ['a', 'b', 'other']
+    client.files['a'] = 'ConflictTest * test-vm @anyvm deny'
+    client.file_tokens['a'] = 'a'
+    client.files['b'] = 'ConflictOther * @anyvm @anyvm deny'
+    client.file_tokens['b'] = 'b'
+
+    rules = test_policy_manager.text_to_rules(
+        'ConflictTest * test-vm test-red allow')
+
+    with ThreadPoolExecutor(max_workers=2) as executor, \
+            patch.object(client, 'policy_get',
+                         wraps=client.policy_get) as mock_get:
+        file_lists = [test_policy_manager.prefetch_policy_files(
+            executor, service) for service in ['ConflictTest',
+                                               'ConflictOther']]
+        test_policy_manager.prefetch_earlier_files(
+            executor, file_lists[:1], ['test']).result()
+        test_policy_manager.prefetch_earlier_files(
+            executor, file_lists[1:], ['other']).result()
+        # shared file is read only once, files after own files are not read
+        assert sorted(call.args[0] for call in mock_get.call_args_list) == \
+               ['a', 'b']
+
+        test_policy_manager.executor = executor
+        conflict_handler = ConflictFileHandler(
+            gtk_builder=test_builder,
+            prefix="policytest",
+            service_names=['ConflictTest'],
+            own_file_name='test',
+            policy_manager=test_policy_manager,
+            rules=rules
+        )
+        assert mock_get.call_count == 2
+
+    # all files were already read, so conflicts are found immediately
+    assert conflict_handler.problem_box.get_visible()
+    assert [str(child) for child in
+            conflict_handler.problem_list.get_children()] == ['a:1']
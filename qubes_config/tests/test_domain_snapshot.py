@@ -0,0 +1,154 @@
+# -*- encoding: utf8 -*-
+#
+# The Qubes OS Project, http://www.qubes-os.org
+#
+# Copyright (C) 2022 Marta Marczykowska-Górecka
+#                               <marmarta@invisiblethingslab.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation; either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program; if not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+# pylint: disable=missing-module-docstring
+import threading
+from unittest.mock import patch
+
+from ..widgets.domain_snapshot import get_domain_snapshot, DomainRecord
+from ..widgets.gtk_widgets import VMListModeler
+
+import gi
+
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gtk
+
+
+def _property_calls(qapp):
+    return [call for call in qapp.actual_calls
+            if call[1] == 'admin.vm.property.Get']
+
+
+def test_snapshot_properties(test_qapp):
+    snapshot = get_domain_snapshot(test_qapp)
+    assert snapshot is get_domain_snapshot(test_qapp)
+
+    assert 'sys-net' in snapshot
+    assert 'no-such-vm' not in snapshot
+    assert snapshot.get('no-such-vm') is None
+
+    sys_net = snapshot['sys-net']
+    assert sys_net == test_qapp.domains['sys-net']
+    assert sys_net == 'sys-net'
+    assert sys_net.klass == 'AppVM'
+    assert sys_net.provides_network is True
+    assert sys_net.is_networked()
+    assert sys_net.maxmem == 4000
+    assert str(sys_net.label) == 'green'
+    assert sys_net.netvm == 'sys-firewall'
+
+    # no netvm
+    assert not snapshot['vault'].is_networked()
+    assert snapshot['vault'].netvm is None
+    # templates do not have the template property
+    assert getattr(snapshot['fedora-36'], 'template', None) is None
+    assert not snapshot['dom0'].is_networked()
+
+    assert [vm.name for vm in snapshot] == \
+           sorted(vm.name for vm in test_qapp.domains)
+
+    assert not _property_calls(test_qapp)
+
+
+def test_snapshot_stale(test_qapp):
+    snapshot = get_domain_snapshot(test_qapp)
+    assert snapshot['test-vm'].maxmem == 4000
+
+    test_qapp.expected_calls[
+        ('test-vm', 'admin.vm.property.GetAll', None, None)] = \
+        b'0\x00maxmem default=False type=int 2000\n'
+    # pylint: disable=protected-access
+    snapshot._domain_changed(test_qapp.domains['test-vm'],
+                             'property-set:maxmem', name='maxmem',
+                             newvalue='2000', oldvalue='4000')
+    assert snapshot['test-vm'].maxmem == 2000
+
+
+def test_modelers_share_snapshot(test_qapp):
+    for _ in range(5):
+        combobox = Gtk.ComboBox.new_with_entry()
+        VMListModeler(combobox=combobox, qapp=test_qapp,
+                      filter_function=lambda vm: vm.klass != 'AdminVM' and
+                      vm.is_networked() and
+                      not getattr(vm, 'template_for_dispvms', False))
+
+    getall_calls = [call for call in test_qapp.actual_calls
+                    if call[1] == 'admin.vm.property.GetAll']
+    assert len(getall_calls) == len(list(test_qapp.domains))
+    assert not _property_calls(test_qapp)
+
+
+def test_snapshot_domain_list_refreshed_on_read(test_qapp):
+    snapshot = get_domain_snapshot(test_qapp)
+    assert 'test-vm' in snapshot
+
+    with patch.object(test_qapp.domains, 'clear_cache') as mock_clear:
+        # pylint: disable=protected-access
+        snapshot._domain_changed(None, 'domain-delete', vm='test-vm')
+        # collection is not refreshed from the events thread
+        mock_clear.assert_not_called()
+        snapshot.get('sys-net')
+        mock_clear.assert_called_once_with()
+
+
+def test_snapshot_refresh_does_not_block_events(test_qapp):
+    snapshot = get_domain_snapshot(test_qapp)
+    snapshot.refresh()
+
+    def load_record(vm):
+        # events thread must be able to mark domains as stale while
+        # the snapshot is being reloaded
+        # pylint: disable=protected-access
+        thread = threading.Thread(target=snapshot._domain_changed, args=(
+            test_qapp.domains['test-vm'], 'property-set:maxmem'))
+        thread.start()
+        thread.join(timeout=5)
+        assert not thread.is_alive()
+        return DomainRecord(snapshot, vm, {})
+
+    with patch.object(snapshot, '_load_record', side_effect=load_record):
+        snapshot.refresh()
+    # pylint: disable=protected-access
+    assert 'test-vm' in snapshot._stale
+
+
+def test_snapshot_changes_loaded_in_main_thread(test_qapp):
+    snapshot = get_domain_snapshot(test_qapp)
+    records = snapshot.refresh()
+    # pylint: disable=protected-access
+    snapshot._domain_changed(test_qapp.domains['test-vm'],
+                             'property-set:maxmem')
+
+    result = []
+    with patch.object(snapshot, '_load_record') as mock_load:
+        # other threads get records loaded so far
+        thread = threading.Thread(
+            target=lambda: result.append(snapshot['test-vm']))
+        thread.start()
+        thread.join(timeout=5)
+        assert result == [records['test-vm']]
+        mock_load.assert_not_called()
+
+        snapshot.get('test-vm')
+        mock_load.assert_called_once()
+
+    # records given out earlier are not modified
+    assert records['test-vm'] is result[0]
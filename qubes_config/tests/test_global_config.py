@@ -22,18 +22,30 @@
 # pylint: disable=missing-function-docstring
 # pylint: disable=missing-class-docstring
 # pylint: disable=protected-access
-from unittest.mock import patch, ANY
+import concurrent.futures
+from unittest.mock import patch, ANY, Mock
 
 from ..global_config.global_config import GlobalConfig, ClipboardHandler,\
     FileAccessHandler
 from ..global_config.usb_devices import DevicesHandler
 from ..global_config.basics_handler import BasicSettingsHandler
+from ..global_config.hardware_report import HardwareReportCache, \
+    HardwareCollector, get_hardware_report, parse_hcl_report
 
 import gi
 gi.require_version('Gtk', '3.0')
 gi.require_version('GdkPixbuf', '2.0')
 from gi.repository import Gtk
 
+def _load_pages(app, *page_names):
+    """Wait for data of given pages to be loaded and let the main loop
+    process the results."""
+    for page_name in page_names:
+        concurrent.futures.wait(app.loader.page_tasks(page_name), timeout=10)
+    while Gtk.events_pending():
+        Gtk.main_iteration()
+
+
 # this entire file has a peculiar arrangement with mock signal registration:
 # to enable tests from this file to run alone,
 # a test_builder fixture is requested because it will try to register
@@ -288,3 +300,174 @@ def test_global_config_failure(mock_error, mock_subprocess,
         # if switch was successful because we don't have the main
         # loop in these tests
         mock_timeout.assert_called()
+
+
+@patch('subprocess.check_output')
+@patch('qubes_config.global_config.global_config.show_error')
+def test_global_config_lazy_pages(mock_error, mock_subprocess,
+                                  test_qapp, test_policy_manager, test_builder,
+                                  fake_hardware_report):
+    mock_subprocess.return_value = b''
+    app = GlobalConfig(test_qapp, test_policy_manager)
+    app.perform_setup()
+    assert test_builder
+
+    # nothing is built before the data arrives
+    assert not app.handlers
+
+    # only the first page should be built at start
+    _load_pages(app, 'basics')
+    assert list(app.handlers.keys()) == ['basics']
+    assert isinstance(app.get_current_page(), BasicSettingsHandler)
+    # and only its widgets should be loaded
+    assert app.builder.get_object('basics_scrolled_window')
+    assert not app.builder.get_object('usb_scrolled_window')
+    assert not app.builder.get_object('thisdevice_scrolled_window')
+
+    # switching to a page builds its handler, once its data is loaded
+    while app.main_notebook.get_nth_page(
+            app.main_notebook.get_current_page()).get_name() != 'usb':
+        app.main_notebook.next_page()
+    _load_pages(app, 'usb')
+    assert isinstance(app.handlers['usb'], DevicesHandler)
+    assert app.builder.get_object('usb_scrolled_window').get_parent() is \
+        app.builder.get_object('usb_page')
+    assert 'thisdevice' not in app.handlers
+
+    # remaining pages are built in the background once their data is loaded
+    app._schedule_page_builds()
+    _load_pages(app, *app.page_factories)
+    assert set(app.handlers.keys()) == set(app.page_factories.keys())
+    # hardware of the machine running tests is not examined
+    assert app.hardware_report.result(timeout=5) is fake_hardware_report
+
+    mock_error.assert_not_called()
+
+
+HCL_REPORT = b"""Qubes release 4.2.0 (R4.2)
+
+Brand:\tLENOVO
+Model:\tThinkPad T480
+BIOS:\tN24ET70W (1.45 )
+
+Xen:\t4.17.2
+Kernel:\t6.1.62-1
+
+RAM:\t16000 Mb
+
+CPU:
+  Intel(R) Core(TM) i7-8650U CPU @ 1.90GHz
+Chipset:
+  Intel Corporation Host Bridge
+VGA:
+  Intel Corporation UHD Graphics 620
+"""
+
+
+def test_hardware_report(tmp_path):
+    report = parse_hcl_report(HCL_REPORT.decode())
+    assert report.fields
+    assert report.fields.model == 'ThinkPad T480'
+    assert report.fields.xen == '4.17.2'
+    assert not parse_hcl_report('garbage').fields
+
+    cache = HardwareReportCache(str(tmp_path / 'report.json'))
+    # no system files available, so qubes-hcl-report is used
+    collector = HardwareCollector(str(tmp_path / 'root'))
+    with patch.object(HardwareReportCache, 'get_system_key',
+                      return_value='boot-1 6.1.62-1 4.17.2') as mock_key, \
+            patch('subprocess.check_output') as mock_subprocess:
+        mock_subprocess.return_value = HCL_REPORT
+
+        assert get_hardware_report(cache, collector).fields == report.fields
+        assert mock_subprocess.call_count == 1
+
+        # second time, the report comes from cache
+        assert get_hardware_report(cache, collector).fields == report.fields
+        assert mock_subprocess.call_count == 1
+
+        # after reboot, the report is generated again
+        mock_key.return_value = 'boot-2 6.1.62-1 4.17.2'
+        assert cache.get() is None
+        assert get_hardware_report(cache, collector).fields == report.fields
+        assert mock_subprocess.call_count == 2
+
+        # unparseable reports are not cached
+        mock_key.return_value = 'boot-3 6.1.62-1 4.17.2'
+        mock_subprocess.return_value = b'garbage'
+        assert get_hardware_report(cache, collector) == (None, 'garbage')
+        assert cache.get() is None
+
+
+def test_hardware_collector(tmp_path):
+    files = {
+        'sys/class/dmi/id/sys_vendor': 'LENOVO',
+        'sys/class/dmi/id/product_name': '20L5CTO1WW',
+        'sys/class/dmi/id/product_version': 'ThinkPad T480',
+        'sys/class/dmi/id/bios_version': 'N24ET70W (1.45 )',
+        'proc/cpuinfo': 'processor\t: 0\nvendor_id\t: GenuineIntel\n'
+                        'model name\t: Intel(R) Core(TM) i7-8650U\n',
+        # dom0 memory, not the host's
+        'proc/meminfo': 'MemTotal:       4096000 kB\nMemFree: 1 kB\n',
+        'etc/qubes-release': 'Qubes release 4.2.0 (R4.2)',
+        'sys/hypervisor/type': 'xen',
+        'sys/hypervisor/version/major': '4',
+        'sys/hypervisor/version/minor': '17',
+        'sys/hypervisor/version/extra': '.2',
+        'sys/bus/pci/devices/0000:00:00.0/class': '0x060000',
+        'sys/bus/pci/devices/0000:00:00.0/vendor': '0x8086',
+        'sys/bus/pci/devices/0000:00:00.0/device': '0x5914',
+        'sys/bus/pci/devices/0000:00:02.0/class': '0x030000',
+        'sys/bus/pci/devices/0000:00:02.0/vendor': '0x8086',
+        'sys/bus/pci/devices/0000:00:02.0/device': '0x5917',
+        'sys/bus/pci/devices/0000:00:1f.6/class': '0x020000',
+        'sys/bus/pci/devices/0000:00:1f.6/vendor': '0x8086',
+        'sys/bus/pci/devices/0000:00:1f.6/device': '0x15d7',
+        'usr/share/hwdata/pci.ids':
+            '# comment\n1234  Other Vendor\n\t5914  Not This\n'
+            '8086  Intel Corporation\n\t5914  Host Bridge\n'
+            '\t\t17aa 2258  ThinkPad\n\t5917  UHD Graphics 620\n',
+    }
+    for path, content in files.items():
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text(content)
+
+    mock_qapp = Mock()
+    mock_qapp.host.memory_total = 16384000
+    info = HardwareCollector(str(tmp_path), mock_qapp).collect()
+    assert info
+    assert info.brand == 'LENOVO'
+    assert info.model == 'ThinkPad T480'
+    assert info.bios == 'N24ET70W (1.45 )'
+    assert info.cpu == 'Intel(R) Core(TM) i7-8650U'
+    assert info.ram == '16000 Mb'
+    assert info.qubes == '4.2.0 (R4.2)'
+    assert info.xen == '4.17.2'
+    assert info.chipset == 'Intel Corporation Host Bridge'
+    assert info.vga == 'Intel Corporation UHD Graphics 620'
+
+    # without Admin API, total memory comes from xl info
+    with patch('subprocess.check_output') as mock_subprocess:
+        mock_subprocess.return_value = b'host : dom0\n' \
+                                       b'total_memory           : 16000\n'
+        assert HardwareCollector(str(tmp_path)).collect().ram == '16000 Mb'
+        mock_subprocess.side_effect = FileNotFoundError
+        assert HardwareCollector(str(tmp_path)).collect().ram == ''
+
+    # collected information is used instead of qubes-hcl-report
+    cache = HardwareReportCache(str(tmp_path / 'report.json'))
+    with patch.object(HardwareReportCache, 'get_system_key',
+                      return_value='boot-1'), \
+            patch('subprocess.check_output') as mock_subprocess:
+        assert get_hardware_report(
+            cache, HardwareCollector(str(tmp_path), mock_qapp)).fields == info
+        mock_subprocess.assert_not_called()
+        assert cache.get() == info
+
+    # outside of Xen, memory is read from /proc/meminfo
+    (tmp_path / 'sys/hypervisor/type').unlink()
+    assert HardwareCollector(str(tmp_path)).collect().ram == '4000 Mb'
+
+    # without DMI information, the collector gives up
+    (tmp_path / 'sys/class/dmi/id/sys_vendor').unlink()
+    assert HardwareCollector(str(tmp_path)).collect() is None
@@ -18,6 +18,8 @@
 # You should have received a copy of the GNU Lesser General Public License along
 # with this program; if not, see <http://www.gnu.org/licenses/>.
 """Tests for gtk utils"""
+import os
+import xml.etree.ElementTree as ET
 from unittest.mock import patch, call
 
 import gi
@@ -26,7 +28,8 @@ gi.require_version('GdkPixbuf', '2.0')
 from gi.repository import GdkPixbuf, Gtk, Gdk
 
 from ..widgets.gtk_utils import load_icon, load_icon_at_gtk_size, \
-    ask_question, show_error, is_theme_light
+    ask_question, show_error, is_theme_light, PixbufCache, BulkUpdate
+from ..widgets import resources
 
 def test_load_icon():
     """Test loading icon methods; tests if they don't error out and
@@ -47,6 +50,78 @@ def test_load_icon():
     assert isinstance(icon_from_name, GdkPixbuf.Pixbuf)
     assert isinstance(icon_from_error, GdkPixbuf.Pixbuf)
 
+def test_pixbuf_cache():
+    """Test if icons are loaded once, cached separately for each size and
+    evicted in least recently used order"""
+    cache = PixbufCache(max_size=2)
+    loaded = []
+
+    def _loader(name, width, height):
+        loaded.append((name, width, height))
+        return load_icon(name, width, height)
+
+    icon = cache.get('xterm', 24, 24, _loader)
+    assert cache.get('xterm', 24, 24, _loader) is icon
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    cache.get('xterm', 16, 16, _loader)
+    assert len(loaded) == 2
+
+    # xterm 24 was used more recently than xterm 16, so 16 is evicted
+    cache.get('xterm', 24, 24, _loader)
+    cache.get('qwertyuiop', 24, 24, _loader)
+    assert len(cache) == 2
+    cache.get('xterm', 16, 16, _loader)
+    assert len(loaded) == 4
+    assert (cache.hits, cache.misses) == (2, 4)
+
+    cache.clear()
+    assert len(cache) == 0
+
+def test_bulk_update():
+    """Test if children are added without sorting and filtering, and sorted
+    and filtered afterwards"""
+    sort_calls = []
+
+    def _sort(row_1, row_2):
+        sort_calls.append((row_1, row_2))
+        name_1 = row_1.get_child().get_text()
+        name_2 = row_2.get_child().get_text()
+        if name_1 == name_2:
+            return 0
+        return -1 if name_1 < name_2 else 1
+
+    def _filter(row):
+        return row.get_child().get_text() != 'b'
+
+    list_box = Gtk.ListBox()
+    list_box.set_sort_func(_sort)
+    list_box.set_filter_func(_filter)
+
+    rows = []
+    for name in ['c', 'a', 'd', 'b']:
+        row = Gtk.ListBoxRow()
+        row.add(Gtk.Label(label=name))
+        rows.append(row)
+
+    with BulkUpdate(list_box, sort_func=_sort, filter_func=_filter) as update:
+        update.add_sorted(rows, key=lambda x: x.get_child().get_text())
+        assert not sort_calls
+
+    assert sort_calls
+    assert [row.get_child().get_text() for row in list_box.get_children()] \
+           == ['a', 'b', 'c', 'd']
+    list_box.show_all()
+    assert [row.get_child().get_text() for row in list_box.get_children()
+            if row.get_child_visible()] == ['a', 'c', 'd']
+
+    # functions are restored
+    new_row = Gtk.ListBoxRow()
+    new_row.add(Gtk.Label(label='0'))
+    list_box.add(new_row)
+    assert list_box.get_children()[0] == new_row
+
+
 def test_ask_question():
     """Simple test to see if the function does something
     and if the function correctly executes run and destroy (instead of,
@@ -99,3 +174,29 @@ label {
     label = Gtk.Label()
 
     assert is_theme_light(label)
+
+
+def test_resource_manifest():
+    """all files listed in the resource bundle definition exist"""
+    tree = ET.parse(os.path.join(resources.PACKAGE_DIR,
+                                 'qubes-config.gresource.xml'))
+    source_dirs = [resources.PACKAGE_DIR,
+                   os.path.join(os.path.dirname(resources.PACKAGE_DIR),
+                                'icons')]
+    files = [file.text for file in tree.iter('file')]
+    assert 'global_config.glade' in files
+    for file in files:
+        assert any(os.path.exists(os.path.join(source_dir, file))
+                   for source_dir in source_dirs), file
+
+
+def test_resources_from_files():
+    """without compiled bundle, UI and css are read from package files"""
+    with patch.object(resources, '_bundle_available', False):
+        builder = Gtk.Builder()
+        resources.add_ui(builder, 'new_qube.glade')
+        assert builder.get_object('main_window')
+
+        provider = Gtk.CssProvider()
+        resources.load_css(provider, 'qubes-new-qube-light.css')
+        assert provider.to_string()
@@ -0,0 +1,165 @@
+# -*- encoding: utf8 -*-
+#
+# The Qubes OS Project, http://www.qubes-os.org
+#
+# Copyright (C) 2022 Marta Marczykowska-Górecka
+#                               <marmarta@invisiblethingslab.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation; either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program; if not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=missing-function-docstring
+"""
+Import time of the applications' entry points, measured with
+python -X importtime in a fresh interpreter.
+
+Time budgets depend on the machine running the tests, so they are only
+checked if the QUBES_CONFIG_IMPORT_BUDGET environment variable is set.
+"""
+import os
+import re
+import subprocess
+import sys
+from typing import Dict, NamedTuple, List
+
+import pytest
+
+from ..widgets.lazy_import import lazy_import
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+# maximum cumulative import time of a module, in microseconds
+IMPORT_BUDGETS: Dict[str, int] = {
+    'qubes_config.global_config.global_config': 1_500_000,
+    'qubes_config.new_qube.new_qube_app': 1_500_000,
+    'qubes_config.global_config.policy_manager': 300_000,
+    'qubes_config.widgets.gtk_utils': 100_000,
+}
+# maximum import time of any module of this package itself (without
+# modules it imports), in microseconds
+OWN_MODULE_BUDGET = 50_000
+
+# modules that must not be imported at startup
+LAZY_MODULES: Dict[str, List[str]] = {
+    'qubes_config.global_config.global_config': [
+        'pkg_resources',
+        'qubes_config.global_config.policy_handler',
+        'qubes_config.global_config.policy_rules',
+        'qubes_config.global_config.updates_handler',
+        'qubes_config.global_config.usb_devices',
+        'qubes_config.global_config.basics_handler',
+    ],
+    'qubes_config.new_qube.new_qube_app': [
+        'pkg_resources',
+    ],
+}
+
+# number of measurements for time budgets; the fastest one is used,
+# to reduce noise
+RUNS = 3
+
+
+class ImportTime(NamedTuple):
+    """Import time of a module, in microseconds."""
+    self_time: int
+    cumulative: int
+
+
+def get_entry_points() -> List[str]:
+    """Modules of entry points defined in setup.py."""
+    setup_path = os.path.join(PROJECT_DIR, 'setup.py')
+    if not os.path.exists(setup_path):
+        pytest.skip("setup.py not available")
+    with open(setup_path, encoding='utf-8') as file:
+        return re.findall(r"'[\w-]+ = ([\w.]+):\w+'", file.read())
+
+
+def measure_imports(module: str, runs: int = 1) -> Dict[str, ImportTime]:
+    """Import a module in a new interpreter and return import times of
+    all modules imported as a result, as reported by -X importtime; if
+    runs > 1, the fastest time of each module is used."""
+    result: Dict[str, ImportTime] = {}
+    for _ in range(runs):
+        process = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+            cwd=PROJECT_DIR, capture_output=True, text=True, check=True)
+        for line in process.stderr.splitlines():
+            match = re.match(
+                r'import time:\s+(\d+) \|\s+(\d+) \| +(\S+)$', line)
+            if not match:
+                continue
+            time = ImportTime(int(match.group(1)), int(match.group(2)))
+            name = match.group(3)
+            if name not in result or time.cumulative < result[name].cumulative:
+                result[name] = time
+    return result
+
+
+def format_report(times: Dict[str, ImportTime], limit: int = 25) -> str:
+    """Most expensive imports, as a table."""
+    lines = [f"{'self [us]':>10} {'cumulative':>10}  module"]
+    for name, time in sorted(times.items(),
+                             key=lambda item: -item[1].cumulative)[:limit]:
+        lines.append(f"{time.self_time:>10} {time.cumulative:>10}  {name}")
+    return "\n".join(lines)
+
+
+@pytest.mark.parametrize('module', ['qubes_config.global_config.global_config',
+                                    'qubes_config.new_qube.new_qube_app'])
+def test_entry_points_measured(module):
+    assert module in get_entry_points()
+
+
+def test_lazy_imports():
+    for module in get_entry_points():
+        times = measure_imports(module)
+        imported = [name for name in LAZY_MODULES.get(module, [])
+                    if name in times]
+        assert not imported, \
+            f"{module} imports {imported} at startup:\n{format_report(times)}"
+
+
+@pytest.mark.skipif(not os.environ.get('QUBES_CONFIG_IMPORT_BUDGET'),
+                    reason="set QUBES_CONFIG_IMPORT_BUDGET to check "
+                           "import time budgets")
+def test_import_time_budget():
+    for module in get_entry_points():
+        times = measure_imports(module, runs=RUNS)
+        over_budget = []
+        for name, time in times.items():
+            if name in IMPORT_BUDGETS:
+                if time.cumulative > IMPORT_BUDGETS[name]:
+                    over_budget.append(
+                        f"{name}: {time.cumulative} us "
+                        f"(budget {IMPORT_BUDGETS[name]} us)")
+            elif name.startswith('qubes_config') and \
+                    time.self_time > OWN_MODULE_BUDGET:
+                over_budget.append(f"{name}: {time.self_time} us self time "
+                                   f"(budget {OWN_MODULE_BUDGET} us)")
+        assert not over_budget, \
+            f"Importing {module} is over budget:\n" + \
+            "\n".join(over_budget) + "\n\n" + format_report(times)
+
+
+def test_lazy_module():
+    sys.modules.pop('colorsys', None)
+    colorsys = lazy_import('colorsys')
+    assert 'colorsys' not in sys.modules
+    assert 'not loaded' in repr(colorsys)
+
+    assert colorsys.rgb_to_hsv(1, 0, 0) == (0, 1, 1)
+    assert 'colorsys' in sys.modules
+    assert colorsys.rgb_to_hsv is sys.modules['colorsys'].rgb_to_hsv
+
+    relative = lazy_import('.lazy_import', 'qubes_config.widgets')
+    assert relative.lazy_import is lazy_import
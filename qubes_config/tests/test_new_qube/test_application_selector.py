@@ -25,9 +25,14 @@
 from unittest.mock import patch
 
 from ...new_qube.application_selector import ApplicationBoxHandler, \
-    ApplicationButton, AddButton, ApplicationRow
+    ApplicationButton, AddButton, ApplicationRow, ApplicationData, \
+    ApplicationSearchIndex
 from ...new_qube.template_handler import TemplateHandler
 
+import gi
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gtk
+
 
 
 @patch('subprocess.check_output')
@@ -207,7 +212,8 @@ def test_app_handler_change_template(mock_subprocess,
 
 @patch('subprocess.check_output')
 def test_app_handler_do_template(mock_subprocess,
-                                     test_qapp, new_qube_builder):
+                                     test_qapp, new_qube_builder,
+                                     wait_for_applications):
     def mock_output(command):
         vm_name = command[-1]
         if vm_name == 'fedora-35':
@@ -227,6 +233,11 @@ def test_app_handler_do_template(mock_subprocess,
            test_qapp.domains['fedora-36']
     app_selector = ApplicationBoxHandler(new_qube_builder, template_handler)
 
+    # apps from other templates are added as they are loaded
+    wait_for_applications(template_handler)
+    while Gtk.events_pending():
+        Gtk.main_iteration()
+
     for child in app_selector.flowbox.get_children():
         if isinstance(child, AddButton):
             child.activate()
@@ -310,3 +321,73 @@ def test_app_handler_delete(mock_subprocess,
         assert False  # app button not found
 
     assert app_selector.get_selected_apps() == ['spaghetti.desktop']
+
+
+def test_app_search_index():
+    index = ApplicationSearchIndex()
+    apps = [ApplicationData(name=name, ident=ident, comment=comment)
+            for name, ident, comment in [
+                ('Firefox', 'firefox.desktop', 'Browse the web'),
+                ('Text Editor', 'org.gnome.gedit.desktop', 'Edit text files'),
+                ('Terminal', 'xterm.desktop', ''),
+                ('LibreOffice Writer', 'libreoffice-writer.desktop',
+                 'Create documents'),
+                ('Settings', 'gnome-control-center.desktop', '')]]
+    for app in apps:
+        index.add(app)
+    firefox, editor, terminal, writer, settings = apps
+
+    def _results(text):
+        return {app.name: index.rank(text, app) for app in apps
+                if index.rank(text, app) is not None}
+
+    assert _results('') == {app.name: 0 for app in apps}
+    assert _results('fire') == {'Firefox': index.RANK_NAME_PREFIX,
+                                'LibreOffice Writer': index.RANK_FUZZY}
+    assert _results('edit') == {'Text Editor': index.RANK_WORD_PREFIX}
+    assert _results('ermin') == {'Terminal': index.RANK_NAME}
+    assert _results('gedit') == {'Text Editor': index.RANK_IDENT}
+    assert _results('documents') == {
+        'LibreOffice Writer': index.RANK_COMMENT}
+    # letters in order
+    assert _results('lbwrt') == {'LibreOffice Writer': index.RANK_FUZZY}
+    assert index.rank('ffx', firefox) == index.RANK_FUZZY
+    assert index.rank('xyz', settings) is None
+
+    # extending the search text narrows down the results
+    assert _results('te') == {'Text Editor': index.RANK_NAME_PREFIX,
+                              'Terminal': index.RANK_NAME_PREFIX,
+                              'LibreOffice Writer': index.RANK_NAME,
+                              'Settings': index.RANK_IDENT}
+    assert _results('ter') == {'Terminal': index.RANK_NAME_PREFIX,
+                               'LibreOffice Writer': index.RANK_NAME,
+                               'Settings': index.RANK_IDENT,
+                               'Text Editor': index.RANK_FUZZY}
+    assert index.rank('term', terminal) == index.RANK_NAME_PREFIX
+    assert index.rank('term', writer) is None
+    assert index.rank('TERM', terminal) == index.RANK_NAME_PREFIX
+    assert index.rank('editor', editor) == index.RANK_WORD_PREFIX
+
+
+def test_app_search_index_reload():
+    index = ApplicationSearchIndex()
+    firefox = ApplicationData(name='Firefox', ident='firefox.desktop',
+                              template='fedora-36')
+    index.add(firefox)
+    assert index.rank('fire', firefox) == index.RANK_NAME_PREFIX
+
+    # reloaded app replaces the previous entry
+    reloaded = ApplicationData(name='Firefox Web Browser',
+                               ident='firefox.desktop', template='fedora-36')
+    index.add(reloaded)
+    assert len(index.search('')) == 1
+    assert index.rank('web', firefox) == index.RANK_WORD_PREFIX
+
+    # the same app from another template is a separate entry
+    other = ApplicationData(name='Firefox', ident='firefox.desktop',
+                            template='debian-11')
+    index.add(other)
+    assert len(index.search('')) == 2
+
+    index.remove_template('fedora-36')
+    assert list(index.search('fire')) == [('debian-11', 'firefox.desktop')]
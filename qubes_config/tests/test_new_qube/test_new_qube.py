@@ -42,13 +42,15 @@ def mock_output(command, *_args, **_kwargs):
 @patch('subprocess.check_output', side_effect = mock_output)
 @patch('qubes_config.new_qube.new_qube_app.show_error')
 def test_simple_new_qube(mock_error, mock_subprocess,
-                         test_qapp, new_qube_builder):
+                         test_qapp, new_qube_builder, wait_for_applications):
     # the builder fixture must be called to register needed signals and
     # only do it once
     assert new_qube_builder
     new_qube_app = CreateNewQube(test_qapp)
 
     new_qube_app.perform_setup()
+    # wait for apps of all templates to be loaded
+    wait_for_applications(new_qube_app.template_handler)
 
     num_setup_calls = len(mock_subprocess.mock_calls)
 
@@ -97,13 +99,15 @@ def test_simple_new_qube(mock_error, mock_subprocess,
 @patch('subprocess.check_output', side_effect = mock_output)
 @patch('qubes_config.new_qube.new_qube_app.show_error')
 def test_complex_new_qube(mock_error, mock_subprocess,
-                         test_qapp, new_qube_builder):
+                         test_qapp, new_qube_builder, wait_for_applications):
     # the builder fixture must be called to register needed signals and
     # only do it once
     assert new_qube_builder
     new_qube_app = CreateNewQube(test_qapp)
 
     new_qube_app.perform_setup()
+    # wait for apps of all templates to be loaded
+    wait_for_applications(new_qube_app.template_handler)
     num_setup_calls = len(mock_subprocess.mock_calls)
 
     assert not new_qube_app.create_button.get_sensitive()
@@ -170,13 +174,15 @@ def test_complex_new_qube(mock_error, mock_subprocess,
 @patch('subprocess.check_output', side_effect = mock_output)
 @patch('qubes_config.new_qube.new_qube_app.show_error')
 def test_new_template_cloned(mock_error, mock_subprocess,
-                      test_qapp, new_qube_builder):
+                      test_qapp, new_qube_builder, wait_for_applications):
     # the builder fixture must be called to register needed signals and
     # only do it once
     assert new_qube_builder
     new_qube_app = CreateNewQube(test_qapp)
 
     new_qube_app.perform_setup()
+    # wait for apps of all templates to be loaded
+    wait_for_applications(new_qube_app.template_handler)
     num_setup_calls = len(mock_subprocess.mock_calls)
 
     assert not new_qube_app.create_button.get_sensitive()
@@ -229,13 +235,15 @@ def test_new_template_cloned(mock_error, mock_subprocess,
 @patch('subprocess.check_output', side_effect = mock_output)
 @patch('qubes_config.new_qube.new_qube_app.show_error')
 def test_new_standalone(mock_error, mock_subprocess,
-                        test_qapp, new_qube_builder):
+                        test_qapp, new_qube_builder, wait_for_applications):
     # the builder fixture must be called to register needed signals and
     # only do it once
     assert new_qube_builder
     new_qube_app = CreateNewQube(test_qapp)
 
     new_qube_app.perform_setup()
+    # wait for apps of all templates to be loaded
+    wait_for_applications(new_qube_app.template_handler)
     num_setup_calls = len(mock_subprocess.mock_calls)
 
     assert not new_qube_app.create_button.get_sensitive()
@@ -293,13 +301,15 @@ def test_new_standalone(mock_error, mock_subprocess,
 @patch('subprocess.check_output', side_effect = mock_output)
 @patch('qubes_config.new_qube.new_qube_app.show_error')
 def test_new_disposable(mock_error, mock_subprocess,
-                        test_qapp, new_qube_builder):
+                        test_qapp, new_qube_builder, wait_for_applications):
     # the builder fixture must be called to register needed signals and
     # only do it once
     assert new_qube_builder
     new_qube_app = CreateNewQube(test_qapp)
 
     new_qube_app.perform_setup()
+    # wait for apps of all templates to be loaded
+    wait_for_applications(new_qube_app.template_handler)
     num_setup_calls = len(mock_subprocess.mock_calls)
 
     assert not new_qube_app.create_button.get_sensitive()
@@ -355,13 +365,15 @@ def test_new_disposable(mock_error, mock_subprocess,
 @patch('subprocess.check_output', side_effect = mock_output)
 @patch('qubes_config.new_qube.new_qube_app.show_error')
 def test_advanced_new_qube(mock_error, mock_subprocess,
-                         test_qapp, new_qube_builder):
+                         test_qapp, new_qube_builder, wait_for_applications):
     # the builder fixture must be called to register needed signals and
     # only do it once
     assert new_qube_builder
     new_qube_app = CreateNewQube(test_qapp)
 
     new_qube_app.perform_setup()
+    # wait for apps of all templates to be loaded
+    wait_for_applications(new_qube_app.template_handler)
 
     num_setup_calls = len(mock_subprocess.mock_calls)
 
@@ -20,11 +20,16 @@
 # pylint: disable=missing-module-docstring
 # pylint: disable=missing-function-docstring
 # pylint: disable=missing-class-docstring
+# pylint: disable=protected-access
 
+import os
 from unittest.mock import patch, Mock, ANY
 
 from ...new_qube.template_handler import TemplateHandler
 from ...new_qube.application_selector import ApplicationData
+from ...new_qube.application_cache import ApplicationCache
+from ...new_qube.appmenus import read_available_applications, \
+    read_desktop_file
 
 import gi
 gi.require_version('Gtk', '3.0')
@@ -185,3 +190,181 @@ def test_template_emit_signal(mock_subprocess, test_qapp, new_qube_builder):
     handler.select_template(test_qapp.domains['fedora-35'])
 
     mock_emit.assert_called_with(ANY, 'fedora-35')
+
+
+@patch('subprocess.check_output')
+def test_appdata_only_templates(mock_subprocess, test_qapp, new_qube_builder,
+                                wait_for_applications):
+    mock_subprocess.return_value = b'test.desktop|Test App|'
+
+    handler = TemplateHandler(new_qube_builder, test_qapp)
+    # wait for everything to load
+    wait_for_applications(handler)
+
+    queried = [c.args[0][-1] for c in mock_subprocess.call_args_list]
+    # default template goes first
+    assert queried[0] == 'fedora-36'
+    assert 'fedora-35' in queried
+    assert 'test-standalone' in queried
+    assert 'test-vm' not in queried
+    assert 'dom0' not in queried
+
+    # apps are announced as they are loaded
+    loaded = []
+    handler.connect_applications_loaded(
+        lambda vm, apps: loaded.append(str(vm)))
+    while Gtk.events_pending():
+        Gtk.main_iteration()
+    assert sorted(loaded) == sorted(queried)
+
+
+def _make_appmenus(path, template, apps):
+    templates_dir = path / 'appmenus' / template / 'apps.templates'
+    templates_dir.mkdir(parents=True)
+    (path / 'appmenus' / template / 'apps.tempicons').mkdir()
+    for ident, name, comment in apps:
+        (templates_dir / ident).write_text(
+            f"[Desktop Entry]\nName=%VMNAME%: {name}\nComment={comment}\n"
+            f"Exec=qvm-run -q -a --service -- %VMNAME% qubes.StartApp+test\n"
+            f"[Desktop Action new-window]\nName=New Window\n")
+
+
+@patch('subprocess.check_output')
+def test_appdata_from_disk(mock_subprocess, test_qapp, new_qube_builder,
+                           tmp_path, wait_for_applications):
+    mock_subprocess.return_value = b'other.desktop|Other App|'
+    _make_appmenus(tmp_path, 'fedora-35',
+                   [('test.desktop', 'Test App', 'test desc'),
+                    ('tomato.desktop', 'Tomato', '')])
+    (tmp_path / 'appmenus' / 'fedora-35' / 'apps.tempicons' /
+     'tomato.png').write_bytes(b'')
+
+    with patch('qubes_config.new_qube.appmenus.get_appmenus_dir',
+               lambda name: str(tmp_path / 'appmenus' / name)):
+        handler = TemplateHandler(
+            new_qube_builder, test_qapp,
+            ApplicationCache(str(tmp_path / 'cache.json')))
+        apps = handler.get_available_apps(test_qapp.domains['fedora-35'])
+        other_apps = handler.get_available_apps(
+            test_qapp.domains['fedora-36'])
+        wait_for_applications(handler)
+
+    # fedora-35 has appmenus directory, so qvm-appmenus was not needed
+    queried = [c.args[0][-1] for c in mock_subprocess.call_args_list]
+    assert 'fedora-35' not in queried
+    assert 'fedora-36' in queried
+
+    assert [(app.ident, app.name) for app in apps] == \
+           [('test.desktop', 'Test App'), ('tomato.desktop', 'Tomato')]
+    assert apps[0].comment.startswith('test desc')
+    assert apps[1].icon_path == str(
+        tmp_path / 'appmenus' / 'fedora-35' / 'apps.tempicons' / 'tomato.png')
+    assert [app.ident for app in other_apps] == ['other.desktop']
+
+
+@patch('subprocess.check_output')
+def test_appdata_unreadable_icons(mock_subprocess, test_qapp,
+                                  new_qube_builder, tmp_path):
+    mock_subprocess.return_value = b''
+    _make_appmenus(tmp_path, 'fedora-35',
+                   [('tomato.desktop', 'Tomato', '')])
+    (tmp_path / 'appmenus' / 'fedora-35' / 'apps.tempicons' /
+     'tomato.png').write_bytes(b'')
+    real_listdir = os.listdir
+
+    def _listdir(path):
+        if str(path).endswith('apps.tempicons'):
+            raise PermissionError(13, 'Permission denied', path)
+        return real_listdir(path)
+
+    with patch('qubes_config.new_qube.appmenus.get_appmenus_dir',
+               lambda name: str(tmp_path / 'appmenus' / name)), \
+            patch('qubes_config.new_qube.appmenus.os.listdir', _listdir):
+        handler = TemplateHandler(
+            new_qube_builder, test_qapp,
+            ApplicationCache(str(tmp_path / 'cache.json')))
+        apps = handler.get_available_apps(test_qapp.domains['fedora-35'])
+
+    # applications are still available, just without icons
+    assert [(app.ident, app.icon_path) for app in apps] == \
+           [('tomato.desktop', None)]
+
+
+@patch('subprocess.check_output')
+def test_appdata_cache(mock_subprocess, test_qapp, new_qube_builder, tmp_path,
+                       wait_for_applications):
+    mock_subprocess.return_value = b''
+    _make_appmenus(tmp_path, 'fedora-35',
+                   [('test.desktop', 'Test App', 'test desc')])
+    _make_appmenus(tmp_path, 'fedora-36', [])
+
+    with patch('qubes_config.new_qube.appmenus.get_appmenus_dir',
+               lambda name: str(tmp_path / 'appmenus' / name)), \
+            patch('qubes_config.new_qube.template_handler.'
+                  'read_available_applications',
+                  wraps=read_available_applications) as mock_read:
+        cache = ApplicationCache(str(tmp_path / 'cache.json'))
+        handler = TemplateHandler(new_qube_builder, test_qapp, cache)
+        wait_for_applications(handler)
+        read_templates = {str(c.args[0]) for c in mock_read.call_args_list}
+        assert {'fedora-35', 'fedora-36'} <= read_templates
+
+        # second run uses cache for templates with appmenus directory
+        mock_read.reset_mock()
+        handler = TemplateHandler(new_qube_builder, test_qapp,
+                                  ApplicationCache(str(tmp_path / 'cache.json')))
+        apps = handler.get_available_apps(test_qapp.domains['fedora-35'])
+        wait_for_applications(handler)
+        read_templates = {str(c.args[0]) for c in mock_read.call_args_list}
+        assert 'fedora-35' not in read_templates
+        assert 'fedora-36' not in read_templates
+
+        assert len(apps) == 1
+        assert apps[0].ident == 'test.desktop'
+        assert apps[0].name == 'Test App'
+        assert apps[0].template == test_qapp.domains['fedora-35']
+
+        # template update invalidates the cache
+        handler._template_updated(test_qapp.domains['fedora-35'],
+                                  'domain-feature-set:last-updated')
+        assert handler.application_cache.get('fedora-35') is None
+        assert handler.application_cache.get('fedora-36') == []
+
+
+def test_appdata_cache_file_changed(tmp_path):
+    _make_appmenus(tmp_path, 'fedora-35', [('test.desktop', 'Test App', '')])
+    desktop_file = tmp_path / 'appmenus' / 'fedora-35' / 'apps.templates' / \
+        'test.desktop'
+
+    with patch('qubes_config.new_qube.appmenus.get_appmenus_dir',
+               lambda name: str(tmp_path / 'appmenus' / name)):
+        cache = ApplicationCache(str(tmp_path / 'cache.json'))
+        cache.store('fedora-35', [('test.desktop', 'Test App', '')])
+        assert cache.get('fedora-35') == [('test.desktop', 'Test App', '')]
+
+        # editing a file in place does not change mtime of the directory
+        stat = desktop_file.stat()
+        os.utime(desktop_file, (stat.st_atime, stat.st_mtime + 10))
+        assert cache.get('fedora-35') is None
+
+
+def test_read_desktop_file(tmp_path, monkeypatch):
+    path = tmp_path / 'test.desktop'
+    path.write_text("[Desktop Entry]\nName=%VMNAME%: Files\n"
+                    "Name[de]=%VMNAME%: Dateien\n"
+                    "Comment=Browse\\sand\\nmanage files\n"
+                    "[Desktop Action new-window]\nName=New Window\n")
+    monkeypatch.setenv('LANGUAGE', 'en')
+    assert read_desktop_file(str(path)) == \
+           ('Files', 'Browse and\nmanage files')
+    monkeypatch.setenv('LANGUAGE', 'de')
+    assert read_desktop_file(str(path))[0] == 'Dateien'
+
+    # applications that should not be shown are skipped
+    for key in ('NoDisplay', 'Hidden'):
+        path.write_text(f"[Desktop Entry]\nName=Files\n{key}=true\n")
+        assert read_desktop_file(str(path)) is None
+
+    path.write_text("[Desktop Entry]\nComment=No name\n")
+    assert read_desktop_file(str(path)) is None
+    assert read_desktop_file(str(tmp_path / 'missing.desktop')) is None
@@ -18,7 +18,8 @@
 # You should have received a copy of the GNU Lesser General Public License along
 # with this program; if not, see <http://www.gnu.org/licenses/>.
 # pylint: disable=missing-module-docstring,missing-function-docstring
-from unittest.mock import patch
+import functools
+from unittest.mock import patch, PropertyMock
 
 from ..global_config.policy_manager import PolicyManager
 from ..global_config.policy_handler import PolicyHandler, VMSubsetPolicyHandler
@@ -761,6 +762,67 @@ TestService * @anyvm @anyvm deny
     assert compare_rule_lists(get_raw_rules(handler), expected_rules)
 
 
+def test_policy_handler_sort_key():
+    tokens = ['test-vm', '@anyvm', '@type:TemplateVM', 'sys-net', '@dispvm',
+              'test-blue', '@anyvm', '@adminvm']
+    assert sorted(tokens, key=PolicyHandler.token_sort_key) == \
+           sorted(tokens, key=functools.cmp_to_key(PolicyHandler.cmp_token))
+    assert sorted(tokens, key=PolicyHandler.token_sort_key) == \
+        ['sys-net', 'test-blue', 'test-vm', '@adminvm', '@dispvm',
+         '@type:TemplateVM', '@anyvm', '@anyvm']
+
+
+def test_policy_handler_conflict_index(
+        test_builder, test_qapp, test_policy_manager: PolicyManager):
+    default_policy = """TestService * test-vm @default allow target=test-blue
+TestService * test-red test-vm ask
+TestService * test-red @anyvm deny
+TestService * @anyvm @anyvm deny"""
+    handler = PolicyHandler(
+        qapp=test_qapp,
+        gtk_builder=test_builder,
+        prefix='policytest',
+        policy_manager=test_policy_manager,
+        default_policy=default_policy,
+        service_name="TestService",
+        policy_file_name="c-test",
+        verb_description=SimpleVerbDescription({}),
+        rule_class=RuleTargeted)
+    handler.enable_radio.set_active(True)
+
+    def _check_all():
+        for row in handler.current_rows:
+            for source in ['test-vm', 'test-red', '@anyvm']:
+                for target in ['test-vm', 'test-blue', 'test-red', '@anyvm']:
+                    for action in ['allow', 'ask', 'deny']:
+                        assert handler.verify_new_rule(
+                            row, source, target, action) == \
+                               PolicyHandler.verify_rule_against_rows(
+                                   handler.current_rows, row, source,
+                                   target, action)
+
+    _check_all()
+    # test-vm has an allow rule, so it cannot have other rules
+    assert handler.verify_new_rule(
+        handler.current_rows[0], 'test-vm', 'test-red', 'ask') == \
+           str(handler.current_rows[2])
+
+    # edit a rule, the index should follow
+    for row in handler.current_rows:
+        if row.rule.source == 'test-red' and row.rule.target == 'test-vm':
+            row.activate()
+            row.source_widget.model.select_value('test-blue')
+            row.action_widget.model.select_value('allow')
+            assert row.validate_and_save()
+            break
+    _check_all()
+
+    # add a new rule
+    add_rule(handler, source='test-blue', target='test-red', action='ask',
+             expect_error=True)
+    _check_all()
+
+
 def test_policy_handler_get_unsaved(
         test_builder, test_qapp, test_policy_manager: PolicyManager):
     default_policy = """TestService * test-vm test-blue allow
@@ -809,6 +871,43 @@ TestService * @anyvm @anyvm deny"""
     assert not handler.get_unsaved()
 
 
+def test_policy_handler_get_unsaved_cached(
+        test_builder, test_qapp, test_policy_manager: PolicyManager):
+    default_policy = """TestService * test-vm test-blue allow
+TestService * @anyvm @anyvm deny"""
+
+    handler = PolicyHandler(
+        qapp=test_qapp,
+        gtk_builder=test_builder,
+        prefix='policytest',
+        policy_manager=test_policy_manager,
+        default_policy=default_policy,
+        service_name="TestService",
+        policy_file_name="c-test",
+        verb_description=SimpleVerbDescription({}),
+        rule_class=RuleSimple)
+    handler.enable_radio.set_active(True)
+
+    assert not handler.get_unsaved()
+
+    # nothing changed, rules should not be compared again
+    with patch.object(PolicyHandler, 'current_rules',
+                      new_callable=PropertyMock) as mock_rules:
+        assert not handler.get_unsaved()
+        mock_rules.assert_not_called()
+
+    add_rule(handler, 'test-vm', 'test-red', 'deny')
+    assert handler.get_unsaved()
+
+    with patch.object(PolicyHandler, 'current_rules',
+                      new_callable=PropertyMock) as mock_rules:
+        assert handler.get_unsaved()
+        mock_rules.assert_not_called()
+
+    handler.save()
+    assert not handler.get_unsaved()
+
+
 ####### Subset handler
 
 def test_subset_handler(test_builder, test_qapp,
@@ -1077,3 +1176,112 @@ TestService * @anyvm vault ask
         print(row)
     # should only have one exception visible, not two
     assert len(handler.exception_list_box.get_children()) == 1
+
+
+def test_policy_handler_virtual_list(
+        test_builder, test_qapp, test_policy_manager: PolicyManager):
+    current_policy = """TestService * test-vm test-red allow
+TestService * test-red @anyvm ask
+TestService * test-blue test-vm allow
+TestService * @anyvm @anyvm deny"""
+    test_policy_manager.policy_client.policy_replace('c-test',
+                                                     current_policy, 'any')
+
+    with patch.object(PolicyHandler, 'VIRTUAL_LIST_THRESHOLD', 2):
+        handler = PolicyHandler(
+            qapp=test_qapp,
+            gtk_builder=test_builder,
+            prefix='policytest',
+            policy_manager=test_policy_manager,
+            default_policy="",
+            service_name="TestService",
+            policy_file_name="c-test",
+            verb_description=SimpleVerbDescription({}),
+            rule_class=RuleSimple)
+
+    # exceptions are in the virtual list, sorted, without any row widgets
+    assert handler.virtual_list
+    assert not handler.exception_list_box.get_children()
+    assert [str(entry.rule.source) for entry in
+            handler.virtual_list.entries] == \
+           ['test-blue', 'test-red', 'test-vm']
+    assert len(handler.current_rules) == 4
+    # pylint: disable=protected-access
+    handler._get_rule_index()
+
+    # activating a rule creates an edit row for it
+    handler.virtual_list.row_activated(Gtk.TreePath.new_from_indices([0]),
+                                       handler.virtual_list.get_column(0))
+    edited_rows = handler.exception_list_box.get_children()
+    assert len(edited_rows) == 1
+    assert edited_rows[0].editing
+    assert len(handler.virtual_list.entries) == 2
+
+    edited_rows[0].source_widget.model.select_value('test-vm')
+    edited_rows[0].target_widget.model.select_value('test-blue')
+    assert edited_rows[0].validate_and_save()
+
+    # after editing, the rule goes back to the virtual list
+    while Gtk.events_pending():
+        Gtk.main_iteration()
+    assert not handler.exception_list_box.get_children()
+    assert [(str(entry.rule.source), str(entry.rule.target))
+            for entry in handler.virtual_list.entries] == \
+           [('test-red', '@anyvm'), ('test-vm', 'test-blue'),
+            ('test-vm', 'test-red')]
+
+    # and raw rules were updated
+    assert any(str(rule.source) == 'test-vm' and
+               str(rule.target) == 'test-blue'
+               for rule in get_raw_rules(handler))
+
+    # conflict index follows rows going back to the virtual list
+    assert handler._rule_index_valid
+    indexed_rows = [row for row, _pair, _source in
+                    handler._rule_index._keys.values()]
+    assert len(indexed_rows) == len(handler.current_rows)
+    for row in indexed_rows:
+        assert any(row is current_row for current_row in handler.current_rows)
+
+
+def test_policy_handler_virtual_list_unsaved(
+        test_builder, test_qapp, test_policy_manager: PolicyManager):
+    current_policy = """TestService * test-vm test-red allow
+TestService * test-red @anyvm ask
+TestService * test-blue test-vm allow
+TestService * @anyvm @anyvm deny"""
+    test_policy_manager.policy_client.policy_replace('c-test',
+                                                     current_policy, 'any')
+
+    with patch.object(PolicyHandler, 'VIRTUAL_LIST_THRESHOLD', 2):
+        handler = PolicyHandler(
+            qapp=test_qapp,
+            gtk_builder=test_builder,
+            prefix='policytest',
+            policy_manager=test_policy_manager,
+            default_policy="",
+            service_name="TestService",
+            policy_file_name="c-test",
+            verb_description=SimpleVerbDescription({}),
+            rule_class=RuleSimple)
+    assert handler.virtual_list
+    assert not handler.get_unsaved()
+
+    # moving a rule to the edit list does not change the rules
+    handler.virtual_list.row_activated(Gtk.TreePath.new_from_indices([1]),
+                                       handler.virtual_list.get_column(0))
+    assert handler.exception_list_box.get_children()
+    assert not handler.get_unsaved()
+    while Gtk.events_pending():
+        Gtk.main_iteration()
+    assert not handler.exception_list_box.get_children()
+    assert not handler.get_unsaved()
+
+    handler.virtual_list.row_activated(Gtk.TreePath.new_from_indices([0]),
+                                       handler.virtual_list.get_column(0))
+    edited_row = handler.exception_list_box.get_children()[0]
+    edited_row.target_widget.model.select_value('test-red')
+    assert edited_row.validate_and_save()
+    while Gtk.events_pending():
+        Gtk.main_iteration()
+    assert handler.get_unsaved()
@@ -20,8 +20,11 @@
 # pylint: disable=missing-module-docstring,missing-function-docstring
 # pylint: disable=missing-class-docstring
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import patch
 
+import pytest
+
 from ..global_config.policy_manager import PolicyManager
 from qrexec.policy.parser import Rule
 
@@ -109,6 +112,39 @@ def test_get_policy_from_file_existing():
         assert len(got_rules) == 0
 
 
+def test_prefetch_policy():
+    manager = PolicyManager()
+    rules = 'Test\t*\t@anyvm\t@anyvm\tdeny'
+
+    with patch("qubes_config.global_config.policy_manager."
+               "PolicyClient.policy_get") as mock_get, \
+            patch("qubes_config.global_config.policy_manager."
+                  "PolicyClient.policy_get_files") as mock_get_files, \
+            ThreadPoolExecutor() as executor:
+        mock_get.return_value = (rules, 'test')
+        mock_get_files.return_value = ['a-test', 'b-test']
+
+        manager.prefetch_rules(executor, 'test').result()
+        manager.prefetch_policy_files(executor, 'Test').result()
+        assert mock_get.call_count == 1
+        assert mock_get_files.call_count == 1
+
+        # prefetched rules are used only once, policy files are kept
+        # in the policy file index
+        got_rules, token = manager.get_rules_from_filename('test', '')
+        assert token == 'test'
+        assert str(got_rules[0]) == rules
+        assert manager.get_conflicting_policy_files(
+            'Test', 'b-test') == ['a-test']
+        assert mock_get.call_count == 1
+        assert mock_get_files.call_count == 1
+
+        manager.get_rules_from_filename('test', '')
+        manager.get_conflicting_policy_files('Test', 'b-test')
+        assert mock_get.call_count == 2
+        assert mock_get_files.call_count == 1
+
+
 def test_compare_rules_to_text():
     manager = PolicyManager()
 
@@ -142,6 +178,57 @@ Test * work @anyvm allow"""
     assert not manager.compare_rules_to_text(rules_3, rule_text_2)
 
 
+def test_parse_policy_text():
+    manager = PolicyManager()
+    text = """Test * @anyvm @anyvm deny
+Test * work @anyvm allow"""
+
+    with patch.object(PolicyManager, 'text_to_rules',
+                      wraps=manager.text_to_rules) as mock_parse:
+        rules, fingerprints = manager.parse_policy_text(text)
+        assert fingerprints == ('Test\t*\t@anyvm\t@anyvm\tdeny',
+                                'Test\t*\twork\t@anyvm\tallow')
+        assert [manager.rule_fingerprint(rule) for rule in rules] == \
+               list(fingerprints)
+
+        assert manager.parse_policy_text(text) == (rules, fingerprints)
+        assert manager.compare_rules_to_text(
+            manager.text_to_rules(text), text)
+        # one parse of the text itself, one for the explicit call above
+        assert mock_parse.call_count == 2
+
+    # fingerprints do not depend on where the rule comes from
+    rule = Rule.from_line(None, "Test * work @anyvm allow",
+                          filepath='some-file', lineno=12)
+    assert manager.rule_fingerprint(rule) == fingerprints[1]
+
+    # only a limited number of texts is remembered
+    for i in range(manager.PARSED_TEXTS_CACHE_SIZE):
+        manager.parse_policy_text(f'Test * vm-{i} @anyvm deny')
+    with patch.object(PolicyManager, 'text_to_rules',
+                      wraps=manager.text_to_rules) as mock_parse:
+        manager.parse_policy_text(text)
+        assert mock_parse.call_count == 1
+
+
+def test_rule_fingerprint_cached():
+    manager = PolicyManager()
+    rule = manager.new_rule('Test', 'work', '@anyvm', 'allow')
+    fingerprint = manager.rule_fingerprint(rule)
+    assert fingerprint == 'Test\t*\twork\t@anyvm\tallow'
+
+    with patch.object(Rule, '__str__', autospec=True,
+                      side_effect=lambda r: 'other') as mock_str:
+        assert manager.rule_fingerprint(rule) == fingerprint
+        assert mock_str.call_count == 0
+
+    # changed rules get new fingerprints
+    rule.target = manager.new_rule('Test', 'work', 'personal', 'allow').target
+    assert manager.rule_fingerprint(rule) == 'Test\t*\twork\tpersonal\tallow'
+    rule.action.target = rule.target
+    assert manager.rule_fingerprint(rule) == str(rule)
+
+
 def test_new_rule():
     manager = PolicyManager()
 
@@ -177,3 +264,107 @@ def test_save_policy():
                "PolicyClient.policy_replace") as mock_replace:
         mock_replace.side_effect = replace_file
         manager.save_rules('test', [rule], 'any')
+
+
+def test_policy_cache():
+    manager = PolicyManager()
+    files = {'test': ('Test\t*\t@anyvm\t@anyvm\tdeny', 'token-1')}
+
+    def get_file(filename):
+        return files[filename]
+
+    def replace_file(filename, new_text, _token):
+        files[filename] = (new_text, 'token-2')
+
+    with patch("qubes_config.global_config.policy_manager."
+               "PolicyClient.policy_get") as mock_get, \
+            patch("qubes_config.global_config.policy_manager."
+                  "PolicyClient.policy_replace") as mock_replace, \
+            patch.object(PolicyManager, 'text_to_rules',
+                         wraps=manager.text_to_rules) as mock_parse:
+        mock_get.side_effect = get_file
+        mock_replace.side_effect = replace_file
+
+        got_rules, token = manager.get_rules_from_filename('test', '')
+        assert token == 'token-1'
+        assert mock_parse.call_count == 1
+
+        # unchanged file is not parsed again, rules are shared
+        previous_rules = got_rules
+        got_rules, token = manager.get_rules_from_filename('test', '')
+        assert token == 'token-1'
+        assert got_rules is previous_rules
+        assert str(got_rules[0]) == 'Test\t*\t@anyvm\t@anyvm\tdeny'
+        assert mock_parse.call_count == 1
+
+        # saved rules are reused
+        new_rule = manager.new_rule('Test', 'test-vm', '@anyvm', 'allow')
+        manager.save_rules('test', [new_rule] + got_rules, token)
+        got_rules, token = manager.get_rules_from_filename('test', '')
+        assert token == 'token-2'
+        assert [str(rule) for rule in got_rules] == \
+               [str(new_rule), 'Test\t*\t@anyvm\t@anyvm\tdeny']
+        assert mock_parse.call_count == 1
+
+        # external changes are noticed
+        files['test'] = ('Test\t*\t@anyvm\t@anyvm\task', 'token-3')
+        got_rules, token = manager.get_rules_from_filename('test', '')
+        assert token == 'token-3'
+        assert str(got_rules[0]) == 'Test\t*\t@anyvm\t@anyvm\task'
+        assert mock_parse.call_count == 2
+
+
+def test_save_policy_token(test_policy_manager):
+    manager = test_policy_manager
+    rules = manager.text_to_rules('Test * @anyvm @anyvm deny')
+    _, token = manager.get_rules_from_filename('a-test', '')
+
+    with patch.object(manager.policy_client, 'policy_get',
+                      wraps=manager.policy_client.policy_get) as mock_get:
+        token = manager.save_rules('a-test', rules, token)
+        assert token == manager.compute_token(manager.rules_to_text(rules))
+        assert not mock_get.mock_calls
+
+        # the test policy client uses different tokens, so the locally
+        # computed one is rejected, but the file was not changed since
+        token = manager.save_rules('a-test', rules, token)
+        assert len(mock_get.mock_calls) == 1
+
+        # the file was changed by someone else
+        manager.policy_client.files['a-test'] = 'Test * @anyvm @anyvm allow'
+        manager.policy_client.file_tokens['a-test'] = 'other'
+        with pytest.raises(subprocess.CalledProcessError):
+            manager.save_rules('a-test', rules, token)
+
+
+def test_policy_file_index(test_policy_manager):
+    manager = test_policy_manager
+    client = manager.policy_client
+
+    with patch.object(client, 'policy_get_files',
+                      wraps=client.policy_get_files) as mock_get_files:
+        assert manager.get_conflicting_policy_files('Test', 'b-test') == \
+               ['a-test']
+        assert manager.get_conflicting_policy_files('Test', 'c-test') == \
+               ['a-test', 'b-test']
+        assert mock_get_files.call_count == 1
+
+        # saving a known file does not change the index
+        _, token = manager.get_rules_from_filename('a-test', '')
+        manager.save_rules('a-test', [], token)
+        manager.get_conflicting_policy_files('Test', 'b-test')
+        assert mock_get_files.call_count == 1
+
+        # new file can change which files apply to a service
+        manager.save_rules('0-test', [], None)
+        client.service_to_files['Test'].insert(0, '0-test')
+        assert manager.get_conflicting_policy_files('Test', 'b-test') == \
+               ['0-test', 'a-test']
+        assert mock_get_files.call_count == 2
+
+        # so can external changes to a file
+        client.files['a-test'] = 'Test * @anyvm @anyvm allow'
+        client.file_tokens['a-test'] = 'external'
+        manager.get_rules_from_filename('a-test', '')
+        manager.get_conflicting_policy_files('Test', 'b-test')
+        assert mock_get_files.call_count == 3
@@ -21,6 +21,9 @@
 # pylint: disable=missing-function-docstring
 # pylint: disable=missing-class-docstring
 from unittest.mock import Mock, patch
+
+import pytest
+
 from qrexec.policy.parser import Rule
 from ..global_config.policy_handler import PolicyHandler
 from ..global_config.policy_rules import RuleSimple, SimpleVerbDescription
@@ -352,3 +355,66 @@ def test_rule_row_init_edit_vm(test_qapp):
     rule_row.set_edit_mode(False)
     assert not rule_row.source_widget.combobox.get_visible()
     assert not rule_row.target_widget.combobox.get_visible()
+
+
+def test_rule_row_lazy_combobox(test_qapp):
+    mock_handler = Mock(spec=PolicyHandler)
+    mock_handler.verify_new_rule.return_value = None
+    rule = make_rule('test-blue', 'test-red', 'ask')
+
+    rule_row = RuleListBoxRow(
+        parent_handler=mock_handler,
+        rule=rule,
+        qapp=test_qapp)
+
+    # only display widgets are created until the row is edited
+    # pylint: disable=protected-access
+    for widget in (rule_row.source_widget, rule_row.target_widget,
+                   rule_row.action_widget):
+        assert widget._combobox is None
+        assert widget._model is None
+    assert not rule_row.is_changed()
+    assert str(rule_row) == "From: test-blue to: test-red Action: ask"
+
+    rule_row.set_edit_mode(True)
+    for widget in (rule_row.source_widget, rule_row.target_widget,
+                   rule_row.action_widget):
+        assert widget._combobox is not None
+        assert widget._combobox.get_visible()
+    assert rule_row.source_widget.get_selected() == 'test-blue'
+    assert not rule_row.is_changed()
+
+    # comboboxes are kept after leaving edit mode
+    combobox = rule_row.source_widget._combobox
+    rule_row.set_edit_mode(False)
+    assert rule_row.source_widget._combobox is combobox
+    assert not combobox.get_visible()
+
+
+@pytest.mark.parametrize('initial_value', [
+    'test-vm',       # available
+    'dom0',          # filtered out by default filter
+    'test-blue',     # filtered out by the custom filter below
+    '@anyvm',        # category
+    'no-such-vm',    # unknown token
+    'None',
+])
+def test_vm_widget_lazy_selection(test_qapp, initial_value):
+    def _make_widget():
+        return VMWidget(
+            qapp=test_qapp, categories={'@anyvm': 'ALL QUBES',
+                                        'None': '(none)'},
+            initial_value=initial_value,
+            filter_function=lambda vm: str(vm) not in ('dom0', 'test-blue'))
+
+    lazy_widget = _make_widget()
+    built_widget = _make_widget()
+    built_widget.set_editable(True)
+
+    # pylint: disable=protected-access
+    assert lazy_widget._model is None
+    lazy_selected = lazy_widget.get_selected()
+    built_selected = built_widget.get_selected()
+    assert lazy_widget._model is None
+    assert type(lazy_selected) is type(built_selected)
+    assert lazy_selected == built_selected
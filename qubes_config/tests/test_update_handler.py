@@ -347,6 +347,28 @@ def test_updates_checker_get_unsaved(real_builder, test_qapp):
     assert 'Default' in handler.get_unsaved()
 
 
+def test_updates_checker_get_unsaved_cached(real_builder, test_qapp):
+    handler = UpdateCheckerHandler(real_builder, test_qapp)
+
+    assert handler.get_unsaved() == ""
+
+    # nothing changed, widgets should not be checked again
+    with patch.object(handler.flowbox_handler, 'is_changed') as mock_changed:
+        assert handler.get_unsaved() == ""
+        mock_changed.assert_not_called()
+
+    handler.dom0_update_check.set_active(False)
+    with patch.object(handler.flowbox_handler, 'is_changed',
+                      return_value=False) as mock_changed:
+        assert 'dom0' in handler.get_unsaved()
+        assert 'dom0' in handler.get_unsaved()
+        mock_changed.assert_called_once_with()
+
+    handler.flowbox_handler.add_selected_vm(test_qapp.domains['test-red'])
+    handler.exceptions_check.set_active(True)
+    assert 'Qubes' in handler.get_unsaved()
+
+
 def test_updates_checker_get_unsaved_choice(real_builder, test_qapp):
     test_qapp.expected_calls[('test-red', 'admin.vm.feature.Get',
                               'service.qubes-update-check', None)] = \
@@ -386,21 +408,24 @@ def test_updates_checker_get_unsaved_choice(real_builder, test_qapp):
     assert handler.get_unsaved() == ""
 
 
-@patch('qubes_config.global_config.updates_handler.apply_feature_change')
-def test_updates_checker_save_dom0(mock_feature, real_builder, test_qapp):
+@patch('qubes_config.widgets.utils.apply_feature_change')
+def test_updates_checker_save_dom0(mock_feature, real_builder, test_qapp,
+                                   wait_for_saves):
     handler = UpdateCheckerHandler(real_builder, test_qapp)
 
     handler.dom0_update_check.set_active(False)
     handler.save()
+    wait_for_saves()
 
     # only this feature was changed
     mock_feature.assert_called_with('dom0', handler.FEATURE_NAME, False)
     assert len(mock_feature.mock_calls) == 1
 
 
-@patch('qubes_config.global_config.updates_handler.apply_feature_change')
+@patch('qubes_config.widgets.utils.apply_feature_change')
 def test_updates_checker_save_dom0_initial_none(mock_feature,
-                                                real_builder, test_qapp):
+                                                real_builder, test_qapp,
+                                                wait_for_saves):
     test_qapp.expected_calls[('dom0', 'admin.vm.feature.Get',
                               UpdateCheckerHandler.FEATURE_NAME, None)] = \
         b'2\x00QubesFeatureNotFoundError\x00\x00service.' \
@@ -410,13 +435,15 @@ def test_updates_checker_save_dom0_initial_none(mock_feature,
 
     handler.dom0_update_check.set_active(True)
     handler.save()
+    wait_for_saves()
 
     # nothing should have been changed
     assert not mock_feature.mock_calls
 
-@patch('qubes_config.global_config.updates_handler.apply_feature_change')
+@patch('qubes_config.widgets.utils.apply_feature_change')
 def test_updates_checker_save_add_exception(mock_feature,
-                                                real_builder, test_qapp):
+                                                real_builder, test_qapp,
+                                                wait_for_saves):
     test_qapp.expected_calls[('dom0', 'admin.vm.feature.Get',
                               'config.default.qubes-update-check', None)] = \
         b'0\x001'
@@ -427,17 +454,52 @@ def test_updates_checker_save_add_exception(mock_feature,
     handler = UpdateCheckerHandler(real_builder, test_qapp)
     handler.flowbox_handler.add_selected_vm(test_qapp.domains['test-blue'])
     handler.save()
+    wait_for_saves()
 
     assert len(mock_feature.mock_calls) == 1
     mock_feature.assert_called_with(test_qapp.domains['test-blue'],
                                     handler.FEATURE_NAME, False)
 
 
+@patch('qubes_config.widgets.utils.apply_feature_change')
+def test_updates_checker_save_partial_failure(mock_feature,
+                                              real_builder, test_qapp,
+                                              wait_for_saves):
+    test_qapp.expected_calls[('dom0', 'admin.vm.feature.Get',
+                              'config.default.qubes-update-check', None)] = \
+        b'0\x001'
+    test_qapp.expected_calls[('test-red', 'admin.vm.feature.Get',
+                              'service.qubes-update-check', None)] = \
+        b'0\x00'
+
+    def _apply_change(vm, *_args):
+        if str(vm) == 'test-blue':
+            raise qubesadmin.exc.QubesException('Access denied')
+    mock_feature.side_effect = _apply_change
+
+    handler = UpdateCheckerHandler(real_builder, test_qapp)
+    handler.dom0_update_check.set_active(False)
+    handler.flowbox_handler.add_selected_vm(test_qapp.domains['test-blue'])
+
+    with patch('qubes_config.global_config.updates_handler.show_error') \
+            as mock_error:
+        handler.save()
+        wait_for_saves()
+    assert 'test-blue: Access denied' in mock_error.mock_calls[0].args[2]
+    assert len(mock_feature.mock_calls) == 2
+
+    # the dom0 change was saved, the failed one is still unsaved
+    unsaved = handler.get_unsaved()
+    assert 'dom0' not in unsaved
+    assert 'Qubes' in unsaved
+
+
 @patch('qubes_config.global_config.vm_flowbox.ask_question')
-@patch('qubes_config.global_config.updates_handler.apply_feature_change')
+@patch('qubes_config.widgets.utils.apply_feature_change')
 def test_updates_checker_save_del_exception(mock_feature,
                                             mock_question,
-                                            real_builder, test_qapp):
+                                            real_builder, test_qapp,
+                                            wait_for_saves):
     test_qapp.expected_calls[('dom0', 'admin.vm.feature.Get',
                               'config.default.qubes-update-check', None)] = \
         b'0\x001'
@@ -456,15 +518,17 @@ def test_updates_checker_save_del_exception(mock_feature,
             child._remove_self()
     assert mock_question.mock_calls
     handler.save()
+    wait_for_saves()
 
     assert len(mock_feature.mock_calls) == 1
     mock_feature.assert_called_with(test_qapp.domains['test-blue'],
                                     handler.FEATURE_NAME, None)
 
 
-@patch('qubes_config.global_config.updates_handler.apply_feature_change')
+@patch('qubes_config.widgets.utils.apply_feature_change')
 def test_updates_checker_save_change_default(mock_feature,
-                                            real_builder, test_qapp):
+                                            real_builder, test_qapp,
+                                            wait_for_saves):
     test_qapp.expected_calls[('dom0', 'admin.vm.feature.Get',
                               'config.default.qubes-update-check', None)] = \
         b'0\x001'
@@ -480,6 +544,7 @@ def test_updates_checker_save_change_default(mock_feature,
     handler.flowbox_handler.add_selected_vm(test_qapp.domains['test-blue'])
 
     handler.save()
+    wait_for_saves()
     assert call(test_qapp.domains['dom0'],
                 'config.default.qubes-update-check', False) \
            in mock_feature.mock_calls
@@ -689,9 +754,10 @@ def test_update_proxy_add_exception_err(real_builder, test_qapp_whonix,
             child.validate_and_save()
             assert mock_error.mock_calls
 
-@patch('qubes_config.global_config.updates_handler.apply_feature_change')
+@patch('qubes_config.widgets.utils.apply_feature_change')
 def test_update_proxy_save_updatevm(mock_feature, real_builder,
-                                    test_qapp_whonix, test_policy_manager):
+                                    test_qapp_whonix, test_policy_manager,
+                                    wait_for_saves):
     handler = UpdateProxy(real_builder, test_qapp_whonix, test_policy_manager,
                           'proxy-file', 'Proxy')
 
@@ -707,6 +773,7 @@ def test_update_proxy_save_updatevm(mock_feature, real_builder,
 
     with patch.object(handler.policy_manager, 'save_rules') as mock_save:
         handler.save()
+        wait_for_saves()
 
         expected_rules = handler.policy_manager.text_to_rules(
 """Proxy * @tag:whonix-updatevm @default allow target=anon-whonix
@@ -734,9 +801,10 @@ Proxy * @type:TemplateVM @default allow target=sys-firewall
                mock_feature.mock_calls
 
 
-@patch('qubes_config.global_config.updates_handler.apply_feature_change')
+@patch('qubes_config.widgets.utils.apply_feature_change')
 def test_update_proxy_save_justwhonix(mock_feature, real_builder,
-                                      test_qapp_whonix, test_policy_manager):
+                                      test_qapp_whonix, test_policy_manager,
+                                      wait_for_saves):
     handler = UpdateProxy(real_builder, test_qapp_whonix, test_policy_manager,
                           'proxy-file', 'Proxy')
 
@@ -749,6 +817,7 @@ def test_update_proxy_save_justwhonix(mock_feature, real_builder,
 
     with patch.object(handler.policy_manager, 'save_rules') as mock_save:
         handler.save()
+        wait_for_saves()
 
         expected_rules = handler.policy_manager.text_to_rules(
 """Proxy * @tag:whonix-updatevm @default allow target=anon-whonix
@@ -761,21 +830,20 @@ Proxy * @type:TemplateVM @default allow target=sys-net
         assert [str(rule) for rule in expected_rules] == \
                [str(rule) for rule in rules]
 
-        assert len(mock_feature.mock_calls) == 3
+        # sys-net already has the feature, so it does not need to be changed
+        assert len(mock_feature.mock_calls) == 2
         assert call(test_qapp_whonix.domains['anon-whonix'],
                     'service.qubes-updates-proxy', True) in \
                mock_feature.mock_calls
-        assert call(test_qapp_whonix.domains['sys-net'],
-                    'service.qubes-updates-proxy', True) in \
-               mock_feature.mock_calls
         assert call(test_qapp_whonix.domains['sys-whonix'],
                     'service.qubes-updates-proxy', None) in \
                mock_feature.mock_calls
 
 
-@patch('qubes_config.global_config.updates_handler.apply_feature_change')
+@patch('qubes_config.widgets.utils.apply_feature_change')
 def test_update_proxy_save_add_rule(mock_feature, real_builder,
-                                    test_qapp_whonix, test_policy_manager):
+                                    test_qapp_whonix, test_policy_manager,
+                                    wait_for_saves):
     handler = UpdateProxy(real_builder, test_qapp_whonix, test_policy_manager,
                           'proxy-file', 'Proxy')
 
@@ -791,6 +859,7 @@ def test_update_proxy_save_add_rule(mock_feature, real_builder,
 
     with patch.object(handler.policy_manager, 'save_rules') as mock_save:
         handler.save()
+        wait_for_saves()
 
         expected_rules = handler.policy_manager.text_to_rules(
             """Proxy * fedora-36 @default allow target=sys-firewall
@@ -804,16 +873,11 @@ Proxy * @type:TemplateVM @default allow target=sys-net
         assert [str(rule) for rule in expected_rules] == \
                [str(rule) for rule in rules]
 
-        assert len(mock_feature.mock_calls) == 3
-        assert call(test_qapp_whonix.domains['sys-whonix'],
-                    'service.qubes-updates-proxy', True) in \
-               mock_feature.mock_calls
+        # sys-net and sys-whonix already have the feature
+        assert len(mock_feature.mock_calls) == 1
         assert call(test_qapp_whonix.domains['sys-firewall'],
                     'service.qubes-updates-proxy', True) in \
                mock_feature.mock_calls
-        assert call(test_qapp_whonix.domains['sys-net'],
-                    'service.qubes-updates-proxy', True) in \
-            mock_feature.mock_calls
 
 
 def test_update_proxy_reset(real_builder, test_qapp_whonix,
@@ -903,7 +967,8 @@ def test_complete_handler(real_builder, test_qapp, test_policy_manager):
 
 
 def test_complete_handle_dom0updatevm(real_builder,
-                                      test_qapp, test_policy_manager):
+                                      test_qapp, test_policy_manager,
+                                      wait_for_saves):
     handler = UpdatesHandler(test_qapp, test_policy_manager, real_builder)
 
     # check if dom0 updatevm worked
@@ -918,6 +983,7 @@ def test_complete_handle_dom0updatevm(real_builder,
     with pytest.raises(AssertionError):
         # should fail, no qapp call provided
         handler.save()
+    wait_for_saves()
 
     # and now we provide the call
 
@@ -925,3 +991,4 @@ def test_complete_handle_dom0updatevm(real_builder,
         ('dom0', 'admin.property.Set', 'updatevm', b'sys-firewall')] = b'0\x00'
 
     handler.save()
+    wait_for_saves()
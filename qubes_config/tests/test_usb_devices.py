@@ -341,7 +341,8 @@ def test_u2f_unsaved_reset(test_qapp, test_policy_manager, real_builder):
     assert handler.blanket_handler.selected_vms == []
     assert handler.register_some_handler.selected_vms == []
 
-def test_u2f_save_disable(test_qapp, test_policy_manager, real_builder):
+def test_u2f_save_disable(test_qapp, test_policy_manager, real_builder,
+                          wait_for_saves):
     sys_usb = test_qapp.domains['sys-usb']
     handler = U2FPolicyHandler(test_qapp, test_policy_manager, real_builder,
                                sys_usb)
@@ -349,9 +350,10 @@ def test_u2f_save_disable(test_qapp, test_policy_manager, real_builder):
     handler.enable_check.set_active(False)
 
     with patch.object(handler.policy_manager, 'save_rules') as mock_save, \
-            patch('qubes_config.global_config.usb_devices.'
+            patch('qubes_config.widgets.utils.'
                'apply_feature_change') as mock_apply:
         handler.save()
+        wait_for_saves()
 
         mock_apply.assert_called_with(
             test_qapp.domains['test-vm'], handler.SERVICE_FEATURE, None)
@@ -369,7 +371,8 @@ policy.RegisterArgument +u2f.Register @anyvm @anyvm deny
                [str(rule) for rule in rules]
 
 
-def test_u2f_save_service(test_qapp, test_policy_manager, real_builder):
+def test_u2f_save_service(test_qapp, test_policy_manager, real_builder,
+                          wait_for_saves):
     sys_usb = test_qapp.domains['sys-usb']
     handler = U2FPolicyHandler(test_qapp, test_policy_manager, real_builder,
                                sys_usb)
@@ -385,6 +388,7 @@ def test_u2f_save_service(test_qapp, test_policy_manager, real_builder):
 
     with patch.object(handler.policy_manager, 'save_rules') as mock_save:
         handler.save()
+        wait_for_saves()
 
         expected_rules = handler.policy_manager.text_to_rules(
             """
@@ -396,7 +400,39 @@ policy.RegisterArgument +u2f.Register @anyvm @anyvm deny
         assert [str(rule) for rule in expected_rules] == \
                [str(rule) for rule in rules]
 
-def test_u2f_handler_save_complex(test_qapp, test_policy_manager, real_builder):
+def test_u2f_save_service_failure(test_qapp, test_policy_manager,
+                                  real_builder, wait_for_saves):
+    sys_usb = test_qapp.domains['sys-usb']
+    handler = U2FPolicyHandler(test_qapp, test_policy_manager, real_builder,
+                               sys_usb)
+    fedora35 = test_qapp.domains['fedora-35']
+    handler.enable_some_handler.add_selected_vm(fedora35)
+
+    test_qapp.expected_calls[('fedora-35', 'admin.vm.feature.Set',
+                              'service.qubes-u2f-proxy', b'1')] = \
+        b'2\x00QubesDaemonAccessError\x00\x00Access denied\x00'
+    test_qapp.expected_calls[('test-vm', 'admin.vm.feature.Set',
+                              'service.qubes-u2f-proxy', b'1')] = b'0\x00'
+
+    with patch.object(handler.policy_manager, 'save_rules') as mock_save, \
+            patch('qubes_config.global_config.usb_devices.show_error') \
+            as mock_error:
+        handler.save()
+        wait_for_saves()
+        # policy is saved regardless
+        assert len(mock_save.mock_calls) == 1
+
+    error = mock_error.mock_calls[0].args[2]
+    assert 'fedora-35' in error
+    assert 'test-vm' not in error
+    # the failed change is still shown as unsaved
+    assert fedora35 in handler.enable_some_handler.selected_vms
+    assert fedora35 not in handler.initially_enabled_vms
+    assert handler.get_unsaved()
+
+
+def test_u2f_handler_save_complex(test_qapp, test_policy_manager, real_builder,
+                                  wait_for_saves):
     sys_usb = test_qapp.domains['sys-usb']
     testvm = test_qapp.domains['test-vm']
     fedora35 = test_qapp.domains['fedora-35']
@@ -421,9 +457,10 @@ def test_u2f_handler_save_complex(test_qapp, test_policy_manager, real_builder):
     handler.blanket_handler.add_selected_vm(testvm)
 
     with patch.object(handler.policy_manager, 'save_rules') as mock_save, \
-            patch('qubes_config.global_config.usb_devices.'
+            patch('qubes_config.widgets.utils.'
                'apply_feature_change') as mock_apply:
         handler.save()
+        wait_for_saves()
 
         assert call(test_qapp.domains['test-vm'],
                     handler.SERVICE_FEATURE, True) in mock_apply.mock_calls
@@ -444,7 +481,8 @@ u2f.Authenticate * test-vm sys-usb allow
 
 
 def test_u2f_handler_save_complex_2(test_qapp,
-                                    test_policy_manager, real_builder):
+                                    test_policy_manager, real_builder,
+                                    wait_for_saves):
     sys_usb = test_qapp.domains['sys-usb']
     testvm = test_qapp.domains['test-vm']
     fedora35 = test_qapp.domains['fedora-35']
@@ -470,9 +508,10 @@ def test_u2f_handler_save_complex_2(test_qapp,
     handler.blanket_check.set_active(False)
 
     with patch.object(handler.policy_manager, 'save_rules') as mock_save, \
-            patch('qubes_config.global_config.usb_devices.'
+            patch('qubes_config.widgets.utils.'
                'apply_feature_change') as mock_apply:
         handler.save()
+        wait_for_saves()
 
         assert call(test_qapp.domains['test-vm'],
                     handler.SERVICE_FEATURE, True) in mock_apply.mock_calls
@@ -20,11 +20,15 @@
 # pylint: disable=missing-class-docstring
 # pylint: disable=missing-function-docstring
 # pylint: disable=missing-module-docstring
+from unittest.mock import patch
+
 import pytest
 
 import qubesadmin.exc
 from ..widgets.utils import apply_feature_change, get_boolean_feature, \
-    get_feature, apply_feature_change_from_widget, BiDictionary
+    get_feature, apply_feature_change_from_widget, BiDictionary, \
+    get_feature_snapshot, apply_feature_changes, FeatureChangeError
+from ..widgets.domain_snapshot import get_domain_snapshot
 
 def test_get_feature(test_qapp):
     """Test if get feature methods behave correctly, in
@@ -136,6 +140,92 @@ def test_apply_change_from_widget(test_qapp):
     apply_feature_change_from_widget(MockWidget(True, None), vm, feature_name)
 
 
+def test_feature_snapshot(test_qapp):
+    feature_name = 'service.qubes-update-check'
+    snapshot = get_feature_snapshot(test_qapp)
+    assert snapshot is get_feature_snapshot(test_qapp)
+
+    snapshot.fetch([feature_name], ['supported-service.qubes-u2f-proxy'])
+
+    def _count_calls():
+        return len([call for call in test_qapp.actual_calls
+                    if call[1].startswith('admin.vm.feature')])
+
+    calls = _count_calls()
+
+    assert snapshot.get_boolean_feature('dom0', feature_name) is True
+    assert snapshot.get_feature('test-vm', feature_name, 'x') == 'x'
+    assert snapshot.get_boolean_feature('test-vm', feature_name, True) is True
+    assert snapshot.has_feature('sys-net', 'service.qubes-updates-proxy')
+    assert not snapshot.has_feature('test-vm', 'service.qubes-updates-proxy')
+    assert snapshot.check_with_template(
+        'sys-usb', 'supported-service.qubes-u2f-proxy')
+    assert not snapshot.check_with_template(
+        'sys-net', 'supported-service.qubes-u2f-proxy')
+
+    # all answered from memory
+    assert _count_calls() == calls
+
+    # changing a feature makes it fetched again
+    vm = test_qapp.domains['test-vm']
+    test_qapp.expected_calls[('test-vm', 'admin.vm.feature.Set',
+                              feature_name, b'')] = b'0\0'
+    apply_feature_change(vm, feature_name, False)
+    test_qapp.expected_calls[
+        ('test-vm', 'admin.vm.feature.Get', feature_name, None)] = b'0\x00'
+    assert snapshot.get_boolean_feature('test-vm', feature_name, True) is False
+    assert _count_calls() == calls + 2
+
+    # so do features changed by events
+    test_qapp.expected_calls[
+        ('test-vm', 'admin.vm.feature.Get', feature_name, None)] = b'0\x001'
+    # pylint: disable=protected-access
+    snapshot._feature_changed(vm, 'domain-feature-set:' + feature_name,
+                              feature=feature_name, value='1')
+    assert snapshot.get_boolean_feature('test-vm', feature_name) is True
+
+
+def test_apply_feature_changes(test_qapp):
+    feature_name = 'service.qubes-updates-proxy'
+    # sys-net already has the feature, sys-firewall does not
+    test_qapp.expected_calls[
+        ('sys-net', 'admin.vm.feature.Get', feature_name, None)] = b'0\x001'
+    test_qapp.expected_calls[
+        ('sys-firewall', 'admin.vm.feature.Set', feature_name, b'1')] = b'0\0'
+    test_qapp.expected_calls[
+        ('test-vm', 'admin.vm.feature.Set', feature_name, b'1')] = \
+        b'2\x00QubesDaemonAccessError\x00\x00Access denied\x00'
+
+    progress = []
+
+    changed = apply_feature_changes(
+        test_qapp,
+        {test_qapp.domains['sys-net']: {feature_name: True},
+         test_qapp.domains['sys-firewall']: {feature_name: True},
+         test_qapp.domains['vault']: {feature_name: None}},
+        progress_callback=lambda done, total: progress.append((done, total)))
+
+    assert changed == ['sys-firewall']
+    assert progress == [(0, 1), (1, 1)]
+    assert not [call for call in test_qapp.actual_calls
+                if call[0] != 'sys-firewall' and
+                call[1] in ('admin.vm.feature.Set',
+                            'admin.vm.feature.Remove')]
+
+    # failures are reported together, other changes are still applied
+    test_qapp.expected_calls[
+        ('vault', 'admin.vm.feature.Set', feature_name, b'1')] = b'0\0'
+    with pytest.raises(FeatureChangeError) as exc_info:
+        apply_feature_changes(
+            test_qapp,
+            {test_qapp.domains['test-vm']: {feature_name: True},
+             test_qapp.domains['vault']: {feature_name: True}})
+    assert list(exc_info.value.failures) == [('test-vm', feature_name)]
+    assert 'test-vm' in str(exc_info.value)
+    assert ('vault', 'admin.vm.feature.Set', feature_name, b'1') in \
+           test_qapp.actual_calls
+
+
 def test_bidict():
     d = {'a': 1, 'b': 2}
 
@@ -151,3 +241,51 @@ def test_bidict():
     with pytest.raises(ValueError):
         d = {'a': 1, 'b': 1}
         BiDictionary(d)
+
+
+def test_feature_snapshot_fetched_once(test_qapp):
+    feature_name = 'supported-service.qubes-u2f-proxy'
+    snapshot = get_feature_snapshot(test_qapp)
+    snapshot.fetch([], [feature_name])
+
+    def _count_calls():
+        return len([call for call in test_qapp.actual_calls
+                    if call[1].startswith('admin.vm.feature')])
+
+    calls = _count_calls()
+    # already fetched features are not fetched again
+    snapshot.fetch([], [feature_name])
+    assert _count_calls() == calls
+
+    # change in a template invalidates only domains based on it
+    # pylint: disable=protected-access
+    snapshot.invalidate('fedora-36', feature_name)
+    based_on_template = {vm.name for vm in get_domain_snapshot(test_qapp)
+                         if str(getattr(vm, 'template', None)) == 'fedora-36'}
+    assert based_on_template
+    for vm_name, values in snapshot._template_values.items():
+        if vm_name == 'fedora-36' or vm_name in based_on_template:
+            assert feature_name not in values
+        else:
+            assert feature_name in values
+
+
+def test_feature_snapshot_invalidated_while_fetching(test_qapp):
+    feature_name = 'service.qubes-update-check'
+    snapshot = get_feature_snapshot(test_qapp)
+    get_value = snapshot._get_value  # pylint: disable=protected-access
+
+    def _get_value(vm, name):
+        value = get_value(vm, name)
+        if str(vm) == 'test-vm':
+            # feature changes after it was read, but before the results
+            # of the whole fetch are stored
+            snapshot.invalidate(vm, name)
+        return value
+
+    with patch.object(snapshot, '_get_value', side_effect=_get_value):
+        snapshot.fetch([feature_name])
+
+    # pylint: disable=protected-access
+    assert feature_name not in snapshot._values.get('test-vm', {})
+    assert feature_name in snapshot._values['dom0']
@@ -0,0 +1,341 @@
+# -*- encoding: utf8 -*-
+#
+# The Qubes OS Project, http://www.qubes-os.org
+#
+# Copyright (C) 2022 Marta Marczykowska-Górecka
+#                               <marmarta@invisiblethingslab.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation; either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program; if not, see <http://www.gnu.org/licenses/>.
+"""
+Process-wide snapshot of domains and their properties, shared by all widgets.
+"""
+import asyncio
+import logging
+import threading
+import weakref
+from types import MappingProxyType
+from typing import Optional, Dict, Any, Iterator, Set, List, Tuple, \
+    Callable, Mapping
+
+import qubesadmin
+import qubesadmin.events
+import qubesadmin.exc
+import qubesadmin.vm
+
+logger = logging.getLogger('qubes-config-manager')
+
+
+def _parse_property_value(qapp: qubesadmin.Qubes, prop_type: str,
+                          value: str) -> Any:
+    """Convert property value, as returned by Admin API, to Python value.
+    VM-type properties are returned as VM names."""
+    if prop_type == 'bool':
+        return value == 'True'
+    if prop_type == 'int':
+        return int(value) if value else None
+    if prop_type == 'label':
+        return qapp.labels.get_blind(value) if value else None
+    if prop_type == 'vm':
+        return value or None
+    return value
+
+
+def _unescape(value: str) -> str:
+    """Reverse escaping of newlines and backslashes used by GetAll."""
+    result = ''
+    escaped = False
+    for char in value:
+        if escaped:
+            result += '\n' if char == 'n' else char
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        else:
+            result += char
+    return result
+
+
+class DomainRecord:
+    """
+    Cached information about a single domain. Properties loaded with
+    admin.vm.property.GetAll are served from memory; anything else is passed
+    to the underlying QubesVM object, available as .vm.
+
+    Compares equal to the QubesVM object it represents and to its name.
+    """
+    def __init__(self, snapshot: 'DomainSnapshot', vm: qubesadmin.vm.QubesVM,
+                 properties: Optional[Dict[str, Any]]):
+        """
+        :param snapshot: DomainSnapshot the record belongs to
+        :param vm: QubesVM object
+        :param properties: dict of property name to value, or None
+         if properties could not be loaded in bulk
+        """
+        self.snapshot = snapshot
+        self.vm = vm
+        self.name: str = vm.name
+        self.klass: str = vm.klass
+        self._properties = properties
+        self._tags: Optional[Set[str]] = None
+
+    @property
+    def app(self) -> qubesadmin.Qubes:
+        """Qubes object the domain belongs to."""
+        return self.vm.app
+
+    @property
+    def tags(self) -> Set[str]:
+        """Set of domain tags; loaded on first use."""
+        if self._tags is None:
+            self._tags = set(self.vm.tags)
+        return self._tags
+
+    def is_networked(self) -> bool:
+        """Check whether this domain can reach network."""
+        if self.klass == 'AdminVM':
+            return False
+        if self._properties is None:
+            return self.vm.is_networked()
+        if self._properties.get('provides_network', False):
+            return True
+        return self._properties.get('netvm', None) is not None
+
+    def __getattr__(self, item: str):
+        # __getattr__ is only called if the attribute was not found normally
+        if item.startswith('_'):
+            raise AttributeError(item)
+        properties = self.__dict__.get('_properties')
+        if properties is not None and item in properties:
+            value = properties[item]
+            if isinstance(value, str) and \
+                    self.snapshot.property_types.get(item) == 'vm':
+                return self.snapshot.get(value) or \
+                       self.app.domains.get_blind(value)
+            return value
+        if properties is not None and item not in self.vm.__dict__ and \
+                not hasattr(type(self.vm), item):
+            # not a property this domain has
+            raise AttributeError(item)
+        return getattr(self.vm, item)
+
+    def __str__(self):
+        return self.name
+
+    def __repr__(self):
+        return f'<DomainRecord {self.name}>'
+
+    def __eq__(self, other):
+        if isinstance(other, (DomainRecord, qubesadmin.vm.QubesVM)):
+            return self.name == other.name
+        if isinstance(other, str):
+            return self.name == other
+        return NotImplemented
+
+    def __lt__(self, other):
+        if isinstance(other, (DomainRecord, qubesadmin.vm.QubesVM)):
+            return self.name < other.name
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.name)
+
+
+class DomainSnapshot:
+    """
+    Information on all domains in the system, loaded with a single
+    admin.vm.List call plus one admin.vm.property.GetAll call per domain.
+    After watch_events is called, it is kept up to date with
+    qubesadmin events in a background thread.
+
+    qubesadmin is not thread-safe, so domains are loaded by a single thread
+    at a time, and changes are only loaded in the main thread; other threads
+    get the records loaded so far, as an immutable mapping.
+
+    Should not be created directly; use get_domain_snapshot.
+    """
+    def __init__(self, qapp: qubesadmin.Qubes):
+        self.qapp = qapp
+        self.property_types: Dict[str, str] = {}
+
+        # replaced as a whole (never modified) whenever records change
+        self._records: Optional[Mapping[str, DomainRecord]] = None
+        # names of domains that need to be loaded again
+        self._stale: Set[str] = set()
+        # whether domains were added or removed since the list of domains
+        # in qapp was last refreshed
+        self._domain_list_changed = False
+        # protects records and the above; never held while talking to qubesd
+        self._lock = threading.RLock()
+        # serializes full reloads
+        self._refresh_lock = threading.Lock()
+        self._events_thread: Optional[threading.Thread] = None
+        self._dispatcher: Optional[qubesadmin.events.EventsDispatcher] = None
+        # handlers registered by other caches that follow the same events
+        self._event_handlers: List[Tuple[str, Callable]] = []
+
+    def refresh(self) -> Mapping[str, DomainRecord]:
+        """(Re)load information about all domains, in the calling thread.
+        Return the loaded records (domain name -> DomainRecord), which can be
+        safely passed to other threads."""
+        with self._refresh_lock:
+            return self._load_all()
+
+    def _load_all(self) -> Mapping[str, DomainRecord]:
+        # records are built without holding the lock, so that event handlers
+        # are not blocked; domains changed in the meantime stay marked
+        # as stale and are loaded again on next access
+        records = MappingProxyType({vm.name: self._load_record(vm)
+                                    for vm in self.qapp.domains})
+        with self._lock:
+            self._records = records
+        return records
+
+    def _load_record(self, vm: qubesadmin.vm.QubesVM) -> DomainRecord:
+        return DomainRecord(self, vm, self._load_properties(vm))
+
+    def _load_properties(self, vm: qubesadmin.vm.QubesVM) -> \
+            Optional[Dict[str, Any]]:
+        try:
+            data = self.qapp.qubesd_call(vm.name, 'admin.vm.property.GetAll')
+        except qubesadmin.exc.QubesException:
+            # fall back to asking about each property separately
+            return None
+        properties: Dict[str, Any] = {}
+        for line in data.decode().splitlines():
+            # lines look like: "name default=True type=str value"
+            name, _default, prop_type, *value = line.split(' ', 3)
+            prop_type = prop_type[len('type='):]
+            self.property_types[name] = prop_type
+            properties[name] = _parse_property_value(
+                self.qapp, prop_type, _unescape(value[0] if value else ''))
+        return properties
+
+    def _ensure_loaded(self) -> Mapping[str, DomainRecord]:
+        records = self._records
+        if records is None:
+            with self._refresh_lock:
+                records = self._records
+                if records is None:
+                    records = self._load_all()
+        if threading.current_thread() is not threading.main_thread():
+            # pending changes are left for the main thread
+            return records
+        with self._lock:
+            stale = self._stale
+            self._stale = set()
+            domain_list_changed = self._domain_list_changed
+            self._domain_list_changed = False
+        if domain_list_changed:
+            # domain collection is not thread-safe, so it is refreshed here
+            # (when the snapshot is read) and not in the events thread
+            self.qapp.domains.clear_cache()
+        updated: Dict[str, Optional[DomainRecord]] = {}
+        for name in stale:
+            if name in self.qapp.domains:
+                updated[name] = self._load_record(self.qapp.domains[name])
+            else:
+                updated[name] = None
+        if not updated:
+            return self._records or records
+        with self._lock:
+            assert self._records is not None
+            new_records = dict(self._records)
+            for name, record in updated.items():
+                if record is None:
+                    new_records.pop(name, None)
+                else:
+                    new_records[name] = record
+            self._records = MappingProxyType(new_records)
+            return self._records
+
+    def __iter__(self) -> Iterator[DomainRecord]:
+        records = self._ensure_loaded()
+        return iter(sorted(records.values()))
+
+    def __contains__(self, item) -> bool:
+        return str(item) in self._ensure_loaded()
+
+    def __getitem__(self, item) -> DomainRecord:
+        return self._ensure_loaded()[str(item)]
+
+    def get(self, item, default=None) -> Optional[DomainRecord]:
+        """Get record for a given domain (or domain name), or default
+        if there is no such domain."""
+        return self._ensure_loaded().get(str(item), default)
+
+    def watch_events(self):
+        """Start keeping the snapshot up to date with qubesd events, in
+        a background thread."""
+        if self._events_thread:
+            return
+        self._events_thread = threading.Thread(
+            target=self._listen_for_events, daemon=True,
+            name='qubes-config-events')
+        self._events_thread.start()
+
+    def add_event_handler(self, event: str, handler: Callable):
+        """Register an additional handler to be called (in the background
+        thread) for matching qubesd events, once watch_events was called."""
+        with self._lock:
+            self._event_handlers.append((event, handler))
+            if self._dispatcher:
+                self._dispatcher.add_handler(event, handler)
+
+    def _listen_for_events(self):
+        loop = asyncio.new_event_loop()
+        dispatcher = qubesadmin.events.EventsDispatcher(self.qapp)
+        dispatcher.add_handler('domain-add', self._domain_changed)
+        dispatcher.add_handler('domain-delete', self._domain_changed)
+        dispatcher.add_handler('property-set:*', self._domain_changed)
+        dispatcher.add_handler('property-del:*', self._domain_changed)
+        dispatcher.add_handler('property-reset:*', self._domain_changed)
+        dispatcher.add_handler('domain-tag-add:*', self._tags_changed)
+        dispatcher.add_handler('domain-tag-delete:*', self._tags_changed)
+        with self._lock:
+            for event, handler in self._event_handlers:
+                dispatcher.add_handler(event, handler)
+            self._dispatcher = dispatcher
+        try:
+            loop.run_until_complete(dispatcher.listen_for_events())
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Lost connection to qubesd events, domain "
+                             "information may be outdated")
+
+    def _domain_changed(self, subject, event, **kwargs):
+        # domain-add/delete have the domain name in 'vm', property
+        # events are about the subject
+        name = kwargs.get('vm', subject)
+        if name is None:
+            return
+        with self._lock:
+            if event in ('domain-add', 'domain-delete'):
+                self._domain_list_changed = True
+            self._stale.add(str(name))
+
+    def _tags_changed(self, subject, _event, **_kwargs):
+        with self._lock:
+            if self._records and str(subject) in self._records:
+                # pylint: disable=protected-access
+                self._records[str(subject)]._tags = None
+
+
+_snapshots: 'weakref.WeakKeyDictionary[qubesadmin.Qubes, DomainSnapshot]' = \
+    weakref.WeakKeyDictionary()
+
+
+def get_domain_snapshot(qapp: qubesadmin.Qubes) -> DomainSnapshot:
+    """Get the shared DomainSnapshot for a given Qubes object."""
+    if qapp not in _snapshots:
+        _snapshots[qapp] = DomainSnapshot(qapp)
+    return _snapshots[qapp]
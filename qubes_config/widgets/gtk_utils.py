@@ -18,12 +18,16 @@
 # You should have received a copy of the GNU Lesser General Public License along
 # with this program; if not, see <http://www.gnu.org/licenses/>.
 """Utility functions using Gtk"""
-from typing import Dict, Union
+import threading
+from collections import OrderedDict
+from typing import Dict, Union, Optional, Tuple, Callable, Iterable, Any
 
 import gi
 gi.require_version('Gtk', '3.0')
 from gi.repository import Gtk, GdkPixbuf, GLib, Gdk
 
+from .resources import load_css
+
 RESPONSES_OK = {
     '_OK': Gtk.ResponseType.OK
 }
@@ -45,13 +49,85 @@ def load_icon_at_gtk_size(icon_name,
     return load_icon(icon_name, width, height)
 
 
+class PixbufCache:
+    """
+    Size-bounded LRU cache of loaded icons, keyed by icon name, size and
+    current icon theme. It is cleared when the icon theme changes. Hit and
+    miss counters are available in the hits and misses attributes.
+    Pixbufs returned from the cache are shared and must not be modified.
+    """
+    def __init__(self, max_size: int = 512):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._pixbufs: \
+            'OrderedDict[Tuple[str, int, int, Optional[str]], ' \
+            'GdkPixbuf.Pixbuf]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._theme_connected = False
+
+    @staticmethod
+    def _theme_name() -> Optional[str]:
+        settings = Gtk.Settings.get_default()
+        if settings is None:
+            return None
+        return settings.props.gtk_icon_theme_name
+
+    def _connect_theme(self):
+        if self._theme_connected:
+            return
+        Gtk.IconTheme.get_default().connect('changed',
+                                            lambda *_args: self.clear())
+        self._theme_connected = True
+
+    def get(self, icon_name: str, width: int, height: int,
+            loader: Callable[[str, int, int], GdkPixbuf.Pixbuf]) -> \
+            GdkPixbuf.Pixbuf:
+        """Get icon from cache, loading it with loader(icon_name, width,
+        height) if it's not there yet."""
+        key = (icon_name, width, height, self._theme_name())
+        with self._lock:
+            self._connect_theme()
+            pixbuf = self._pixbufs.get(key, None)
+            if pixbuf is not None:
+                self._pixbufs.move_to_end(key)
+                self.hits += 1
+                return pixbuf
+            self.misses += 1
+
+        pixbuf = loader(icon_name, width, height)
+
+        with self._lock:
+            self._pixbufs[key] = pixbuf
+            while len(self._pixbufs) > self.max_size:
+                self._pixbufs.popitem(last=False)
+        return pixbuf
+
+    def clear(self):
+        """Remove all icons from cache."""
+        with self._lock:
+            self._pixbufs.clear()
+
+    def __len__(self):
+        return len(self._pixbufs)
+
+
+# shared by all load_icon calls in the process
+icon_cache = PixbufCache()
+
+
 def load_icon(icon_name: str, width: int = 24, height: int = 24):
     """Load icon from provided name, if available. If not, attempt to treat
     provided name as a path. If icon not found in any of the above ways,
     load a blank icon of specified size.
-    Returns GdkPixbuf.Pixbuf.
+    Returns GdkPixbuf.Pixbuf; it comes from a shared cache (see icon_cache)
+    and must not be modified.
     width and height must be in pixels.
     """
+    return icon_cache.get(icon_name, width, height, _load_icon_uncached)
+
+
+def _load_icon_uncached(icon_name: str, width: int, height: int):
     try:
         # icon_name is a path
         return GdkPixbuf.Pixbuf.new_from_file_at_size(icon_name, width, height)
@@ -69,6 +145,56 @@ def load_icon(icon_name: str, width: int = 24, height: int = 24):
             return pixbuf
 
 
+class BulkUpdate:
+    """
+    Context manager for adding (or removing) many children of a Gtk.ListBox
+    or Gtk.FlowBox at once. Sort and filter functions are detached and
+    property notifications are frozen for the duration of the update;
+    on exit, they are restored, which sorts and filters the container once,
+    instead of after every insertion. As Gtk does not allow to read
+    the functions back, they must be provided here.
+
+    Usage:
+        with BulkUpdate(list_box, sort_func=self.sort) as update:
+            update.add_sorted(rows, key=lambda row: row.sort_key)
+    """
+    def __init__(self, container: Union[Gtk.ListBox, Gtk.FlowBox],
+                 sort_func: Optional[Callable] = None,
+                 filter_func: Optional[Callable] = None):
+        """
+        :param container: Gtk.ListBox or Gtk.FlowBox to be updated
+        :param sort_func: sort function to be restored after the update
+        :param filter_func: filter function to be restored after the update
+        """
+        self.container = container
+        self.sort_func = sort_func
+        self.filter_func = filter_func
+
+    def __enter__(self) -> 'BulkUpdate':
+        self.container.freeze_notify()
+        if self.sort_func:
+            self.container.set_sort_func(None)
+        if self.filter_func:
+            self.container.set_filter_func(None)
+        return self
+
+    def add_sorted(self, widgets: Iterable[Gtk.Widget],
+                   key: Callable[[Gtk.Widget], Any]):
+        """Add widgets to the container in the order given by key, so that
+        the final sort has little work to do; key should order widgets
+        the same way sort_func does."""
+        for widget in sorted(widgets, key=key):
+            self.container.add(widget)
+
+    def __exit__(self, *_args):
+        # setting the functions invalidates sorting/filtering once
+        if self.filter_func:
+            self.container.set_filter_func(self.filter_func)
+        if self.sort_func:
+            self.container.set_sort_func(self.sort_func)
+        self.container.thaw_notify()
+
+
 def show_error(parent, title, text):
     """
     Helper function to display error messages.
@@ -150,19 +276,19 @@ def show_dialog(parent: Gtk.Widget, title: str, text: Union[str, Gtk.Widget],
     return response
 
 
-def load_theme(widget: Gtk.Widget, light_theme_path: str, dark_theme_path: str):
+def load_theme(widget: Gtk.Widget, light_theme: str, dark_theme: str):
     """
     Load a dark or light theme to current screen, based on widget's
     current (system) defaults.
     :param widget: Gtk.Widget, preferably main window
-    :param light_theme_path: path to file with light theme css
-    :param dark_theme_path: path to file with dark theme css
+    :param light_theme: name of light theme css file, as in load_css
+    :param dark_theme: name of dark theme css file, as in load_css
     """
-    path = light_theme_path if is_theme_light(widget) else dark_theme_path
+    name = light_theme if is_theme_light(widget) else dark_theme
 
     screen = Gdk.Screen.get_default()
     provider = Gtk.CssProvider()
-    provider.load_from_path(path)
+    load_css(provider, name)
     Gtk.StyleContext.add_provider_for_screen(
         screen, provider, Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION)
 
@@ -25,13 +25,15 @@ import gi
 import abc
 import qubesadmin.vm
 import itertools
+from concurrent.futures import Future, ThreadPoolExecutor
 
 gi.require_version('Gtk', '3.0')
 from gi.repository import Gtk, GdkPixbuf, GLib
 
-from typing import Optional, Callable, Dict, Any, Union, List
+from typing import Optional, Callable, Dict, Any, Union, List, Tuple
 
 from .gtk_utils import load_icon, is_theme_light
+from .domain_snapshot import get_domain_snapshot
 
 NONE_CATEGORY = {
     "None": "(none)"
@@ -61,11 +63,11 @@ class TokenName(Gtk.Box):
         self.token_name = token_name
         for child in self.get_children():
             self.remove(child)
-        try:
-            vm = self.qapp.domains[token_name]
+        vm = get_domain_snapshot(self.qapp).get(token_name)
+        if vm is not None:
             qube_name = QubeName(vm)
             self.add(qube_name)
-        except KeyError:
+        else:
             nice_name = self.categories.get(token_name, token_name)
             label = Gtk.Label()
             label.set_text(nice_name)
@@ -85,6 +87,9 @@ class QubeName(Gtk.Box):
         """
         super().__init__(orientation=Gtk.Orientation.HORIZONTAL)
         self.vm = vm
+        if vm is not None:
+            # use cached properties, if available
+            vm = get_domain_snapshot(vm.app).get(vm.name, vm)
         self.label = Gtk.Label()
         self.label.set_label(vm.name if vm else 'None')
 
@@ -220,7 +225,8 @@ class VMListModeler(TraitSelector):
         :param combobox: target ComboBox object
         :param qapp: Qubes object, necessary to retrieve VM info
         :param filter_function: function used to filter VMs, must take as input
-        QubesVM object and return bool; caution: remember not all properties
+        QubesVM-like object (a DomainRecord from the shared domain snapshot)
+        and return bool; caution: remember not all properties
         are always available for all VMs, in particular dom0 can cause problems
         :param event_callback: function to be called whenever combobox value
         changes
@@ -244,7 +250,6 @@ class VMListModeler(TraitSelector):
 
         self._entries: Dict[str, Dict[str, Any]] = {}
 
-        self._icons: Dict[str, Gtk.Image] = {}
         self._icon_size = 20
 
         self._create_entries(filter_function, default_value, additional_options,
@@ -287,57 +292,83 @@ class VMListModeler(TraitSelector):
         self.combo.set_active_id(self._initial_id)
 
     def _get_icon(self, name):
-        if name not in self._icons:
-            icon = load_icon(name, self._icon_size,  self._icon_size)
-            self._icons[name] = icon
-        return self._icons[name]
+        return load_icon(name, self._icon_size, self._icon_size)
 
-    def _create_entries(
-            self,
+    @staticmethod
+    def _list_entries(
+            qapp: qubesadmin.Qubes,
             filter_function: Optional[Callable[[qubesadmin.vm.QubesVM], bool]],
             default_value: Optional[Union[qubesadmin.vm.QubesVM, str]],
             additional_options: Optional[Dict[str, str]] = None,
-            current_value: Optional[str] = None):
-
+            current_value: Optional[str] = None) -> \
+            Dict[str, Tuple[str, Any]]:
+        """Get entries of the model, as dict of display name:
+        (api name, domain record or None)."""
+        entries: Dict[str, Tuple[str, Any]] = {}
         if additional_options:
             for api_name, display_name in additional_options.items():
                 if api_name == default_value:
                     display_name = display_name + ' (default)'
-                self._entries[display_name] = {
-                    "api_name": api_name,
-                    "icon": None,
-                    "vm": None
-                }
+                entries[display_name] = (api_name, None)
 
-        for domain in self.qapp.domains:
+        for domain in get_domain_snapshot(qapp):
             if filter_function and not filter_function(domain):
                 continue
-            vm_name = domain.name
-            icon = self._get_icon(domain.icon)
-            display_name = vm_name
-
+            display_name = domain.name
             if domain == default_value:
                 display_name = display_name + ' (default)'
+            entries[display_name] = (domain.name, domain)
+
+        if current_value and not any(
+                api_name == current_value for api_name, _ in entries.values()):
+            entries[str(current_value)] = (str(current_value), None)
+        return entries
+
+    @classmethod
+    def get_initial_selection(
+            cls, qapp: qubesadmin.Qubes,
+            filter_function: Optional[Callable[[qubesadmin.vm.QubesVM], bool]],
+            default_value: Optional[Union[qubesadmin.vm.QubesVM, str]] = None,
+            current_value: Optional[str] = None,
+            additional_options: Optional[Dict[str, str]] = None) -> \
+            Optional[Union[qubesadmin.vm.QubesVM, str]]:
+        """Get the value get_selected would return right after creating
+        a VMListModeler with the same arguments, without creating it."""
+        entries = cls._list_entries(qapp, filter_function, default_value,
+                                    additional_options, current_value)
+        if not entries:
+            return None
+        selected = None
+        value = current_value or default_value
+        if value:
+            # same as select_value: last matching entry is selected
+            for display_name, (api_name, _domain) in entries.items():
+                if api_name == value:
+                    selected = display_name
+        else:
+            selected = sorted(entries)[0]
+        if selected is None:
+            return None
+        api_name, domain = entries[selected]
+        if api_name == "None":
+            return None
+        return domain.vm if domain is not None else api_name
 
+    def _create_entries(
+            self,
+            filter_function: Optional[Callable[[qubesadmin.vm.QubesVM], bool]],
+            default_value: Optional[Union[qubesadmin.vm.QubesVM, str]],
+            additional_options: Optional[Dict[str, str]] = None,
+            current_value: Optional[str] = None):
+        for display_name, (api_name, domain) in self._list_entries(
+                self.qapp, filter_function, default_value,
+                additional_options, current_value).items():
             self._entries[display_name] = {
-                "api_name": vm_name,
-                "icon": icon,
-                "vm": domain,
+                "api_name": api_name,
+                "icon": self._get_icon(domain.icon) if domain else None,
+                "vm": domain.vm if domain else None,
             }
 
-        if current_value:
-            found_current = False
-            for _, value in self._entries.items():
-                if value["api_name"] == current_value:
-                    found_current = True
-                    break
-            if not found_current:
-                self._entries[str(current_value)] = {
-                    "api_name": str(current_value),
-                    "icon": None,
-                    "vm": None
-                }
-
     def _get_valid_qube_name(self):
         selected = self.combo.get_active_id()
         if selected in self._entries:
@@ -659,10 +690,86 @@ class ProgressBarDialog(Gtk.Window):
         while Gtk.events_pending():
             Gtk.main_iteration_do(True)
 
+    def set_progress(self, value: float):
+        """Set current progressbar progress to a given fraction; unlike
+        update_progress, does not process pending events, so it's safe
+        to call from within callbacks."""
+        self.current_progress = max(self.current_progress, min(value, 1))
+        self.progress_bar.set_fraction(self.current_progress)
+
     def _quit(self, *_args):
         self.parent_application.quit()
 
 
+class SaveProgressDialog(Gtk.Window):
+    """Modal window showing progress of saving changes to multiple qubes.
+    Changes are applied in a worker thread by run; until they are, the
+    parent window does not accept any input. The window itself is only shown
+    if there is more than one change to save."""
+    # a single worker, so that changes are saved in the order they were made
+    executor = ThreadPoolExecutor(max_workers=1,
+                                  thread_name_prefix='qubes-config-save')
+
+    def __init__(self, parent: Gtk.Window, saving_text: str):
+        """
+        :param parent: top level window the dialog belongs to
+        :param saving_text: text shown above the progress bar
+        """
+        super().__init__()
+        self.parent_window = parent
+        self.set_transient_for(parent)
+        self.set_modal(True)
+        self.set_deletable(False)
+        self.set_position(Gtk.WindowPosition.CENTER_ON_PARENT)
+
+        self.box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+        self.add(self.box)
+        self.box.get_style_context().add_class('modal_dialog')
+
+        self.label = Gtk.Label()
+        self.label.set_text(saving_text)
+        self.box.pack_start(self.label, False, False, 10)
+
+        self.progress_bar = Gtk.ProgressBar()
+        self.progress_bar.get_style_context().add_class('loading')
+        self.progress_bar.set_show_text(True)
+        self.box.pack_start(self.progress_bar, False, False, 10)
+
+    def run(self, function: Callable[..., Any],
+            done_callback: Callable[[Future], None]) -> Future:
+        """Call function in a worker thread, with progress_callback keyword
+        argument reporting progress to this window (as used by
+        apply_feature_changes). Once function is finished, the window is
+        destroyed and done_callback is called in the main thread, with
+        the Future of function's result as parameter."""
+        self.parent_window.set_sensitive(False)
+        future = self.executor.submit(function,
+                                      progress_callback=self._post_update)
+        future.add_done_callback(
+            lambda f: GLib.idle_add(self._finished, f, done_callback))
+        return future
+
+    def _post_update(self, done: int, total: int):
+        # called from the worker thread
+        GLib.idle_add(self.update, done, total)
+
+    def update(self, done: int, total: int) -> bool:
+        """Show progress of done out of total changes."""
+        if total > 1:
+            if not self.get_visible():
+                self.show_all()
+            self.progress_bar.set_fraction(done / total)
+            self.progress_bar.set_text(f"{done}/{total}")
+        return False
+
+    def _finished(self, future: Future,
+                  done_callback: Callable[[Future], None]) -> bool:
+        self.parent_window.set_sensitive(True)
+        self.destroy()
+        done_callback(future)
+        return False
+
+
 class ExpanderHandler:
     """A class to handle showing/hiding something on click."""
     def __init__(self,
@@ -734,13 +841,17 @@ class ViewportHandler:
     """A class that enables auto-scrolling to the focused widget."""
     def __init__(self, main_window: Gtk.Window,
                  scrolled_windows: List[Gtk.ScrolledWindow]):
-        self.scrolled_windows = scrolled_windows
+        self.scrolled_windows: List[Gtk.ScrolledWindow] = []
         self.main_window = main_window
 
-        for viewport in [scrolled_window.get_child()
-                         for scrolled_window in self.scrolled_windows]:
-            viewport.connect('set-focus-child',
-                              self._viewport_set_focus_child)
+        for scrolled_window in scrolled_windows:
+            self.add_scrolled_window(scrolled_window)
+
+    def add_scrolled_window(self, scrolled_window: Gtk.ScrolledWindow):
+        """Enable auto-scrolling in another scrolled window."""
+        self.scrolled_windows.append(scrolled_window)
+        scrolled_window.get_child().connect('set-focus-child',
+                                            self._viewport_set_focus_child)
 
     def is_child(self, widget, container):
         """
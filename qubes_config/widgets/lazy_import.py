@@ -0,0 +1,65 @@
+# -*- encoding: utf8 -*-
+#
+# The Qubes OS Project, http://www.qubes-os.org
+#
+# Copyright (C) 2022 Marta Marczykowska-Górecka
+#                               <marmarta@invisiblethingslab.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation; either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program; if not, see <http://www.gnu.org/licenses/>.
+"""Importing modules only when they are first used."""
+import importlib
+import importlib.util
+from types import ModuleType
+from typing import Optional, Any
+
+
+class LazyModule:
+    """
+    Stand-in for a module that is imported when one of its attributes is
+    first accessed. Importing goes through importlib, so it is safe to
+    trigger it from worker threads. Setting and deleting attributes
+    (e.g. by mock.patch.object) is passed to the real module.
+    """
+    def __init__(self, name: str, package: Optional[str] = None):
+        """
+        :param name: module name, as for importlib.import_module
+        :param package: package to resolve relative name against
+        """
+        self.__dict__['_name'] = importlib.util.resolve_name(name, package)
+        self.__dict__['_module'] = None
+
+    def _load(self) -> ModuleType:
+        module = self.__dict__['_module']
+        if module is None:
+            module = importlib.import_module(self.__dict__['_name'])
+            self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name: str, value: Any):
+        setattr(self._load(), name, value)
+
+    def __delattr__(self, name: str):
+        delattr(self._load(), name)
+
+    def __repr__(self):
+        state = 'loaded' if self.__dict__['_module'] else 'not loaded'
+        return f"<lazy module '{self.__dict__['_name']}' ({state})>"
+
+
+def lazy_import(name: str, package: Optional[str] = None) -> Any:
+    """Get a LazyModule for a given (possibly relative) module name."""
+    return LazyModule(name, package)
@@ -0,0 +1,77 @@
+# -*- encoding: utf8 -*-
+#
+# The Qubes OS Project, http://www.qubes-os.org
+#
+# Copyright (C) 2022 Marta Marczykowska-Górecka
+#                               <marmarta@invisiblethingslab.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation; either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program; if not, see <http://www.gnu.org/licenses/>.
+"""
+Access to UI files, stylesheets and icons, compiled into a GResource bundle
+(see qubes-config.gresource.xml). If the bundle was not built (e.g. when
+running from source tree), files are read from the package directory.
+"""
+import logging
+import os
+from typing import Optional
+
+import gi
+
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gtk, Gio, GLib
+
+logger = logging.getLogger('qubes-config-manager')
+
+RESOURCE_PREFIX = '/org/qubesos/config'
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUNDLE_PATH = os.path.join(PACKAGE_DIR, 'qubes-config.gresource')
+
+# None if not loaded yet
+_bundle_available: Optional[bool] = None
+
+
+def register_resources() -> bool:
+    """Load (memory-map) and register the resource bundle, if it was not
+    done yet. Return True if the bundle is available."""
+    global _bundle_available  # pylint: disable=global-statement
+    if _bundle_available is None:
+        try:
+            Gio.resources_register(Gio.Resource.load(BUNDLE_PATH))
+            Gtk.IconTheme.get_default().add_resource_path(
+                f'{RESOURCE_PREFIX}/icons')
+            _bundle_available = True
+        except GLib.Error as ex:
+            logger.debug("Resource bundle %s not available, using "
+                         "files: %s", BUNDLE_PATH, str(ex))
+            _bundle_available = False
+    return _bundle_available
+
+
+def add_ui(builder: Gtk.Builder, name: str):
+    """Add objects from a UI file (given by path relative to the package
+    directory, e.g. 'new_qube.glade') to builder."""
+    if register_resources():
+        builder.add_from_resource(f'{RESOURCE_PREFIX}/{name}')
+    else:
+        builder.add_from_file(os.path.join(PACKAGE_DIR, name))
+
+
+def load_css(provider: Gtk.CssProvider, name: str):
+    """Load a stylesheet (given by path relative to the package directory)
+    into provider."""
+    if register_resources():
+        provider.load_from_resource(f'{RESOURCE_PREFIX}/{name}')
+    else:
+        provider.load_from_path(os.path.join(PACKAGE_DIR, name))
@@ -18,11 +18,18 @@
 # You should have received a copy of the GNU Lesser General Public License along
 # with this program; if not, see <http://www.gnu.org/licenses/>.
 """Qubes helper functions"""
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import qubesadmin
 import qubesadmin.exc
 import qubesadmin.vm
 
-from typing import Optional, Any, Dict
+from typing import Optional, Any, Dict, Iterable, Set, Callable, List, \
+    Tuple
+
+from .domain_snapshot import get_domain_snapshot
 
 
 def get_feature(vm, feature_name, default_value=None):
@@ -65,6 +72,293 @@ def apply_feature_change(vm: qubesadmin.vm.QubesVM,
         raise qubesadmin.exc.QubesException(
             "Failed to set {} due to insufficient "
             "permissions".format(feature_name))
+    finally:
+        snapshot = _feature_snapshots.get(vm.app)
+        if snapshot:
+            snapshot.invalidate(vm, feature_name)
+
+
+# marks features that were fetched and found not to exist
+_ABSENT = object()
+
+
+class FeatureSnapshot:
+    """
+    In-memory copy of selected features of all domains, fetched for all
+    domains concurrently in one pass; each feature is fetched in bulk only
+    once. Entries are invalidated when features are changed with
+    apply_feature_change or (if domain events are watched,
+    see DomainSnapshot.watch_events) by domain-feature-set and
+    domain-feature-delete events; invalidated entries are fetched again
+    (for the affected domains only) on first use.
+
+    Should not be created directly; use get_feature_snapshot.
+    """
+    # number of concurrent Admin API calls
+    MAX_WORKERS = 8
+
+    def __init__(self, qapp: qubesadmin.Qubes):
+        self.qapp = qapp
+        # vm name -> feature name -> value
+        self._values: Dict[str, Dict[str, Any]] = {}
+        self._template_values: Dict[str, Dict[str, Any]] = {}
+        # vm name -> names of all features set on the vm
+        self._lists: Dict[str, Set[str]] = {}
+        # vm name -> name of its template, if it has one
+        self._templates: Dict[str, str] = {}
+        # features already fetched in bulk
+        self._fetched: Set[str] = set()
+        self._template_fetched: Set[str] = set()
+        self._lists_fetched = False
+        # vm name -> number of times its entries were invalidated; values
+        # fetched before an invalidation are outdated and are not stored
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+        domains = get_domain_snapshot(qapp)
+        domains.add_event_handler('domain-feature-set:*',
+                                  self._feature_changed)
+        domains.add_event_handler('domain-feature-delete:*',
+                                  self._feature_changed)
+
+    def fetch(self, feature_names: Iterable[str] = (),
+              template_feature_names: Iterable[str] = (),
+              domains: Optional[Iterable] = None):
+        """Fetch current values of given features for all domains:
+        feature_names are fetched as set on the domain itself,
+        template_feature_names as with check_with_template. Feature
+        lists of all domains are fetched as well. Features that were already
+        fetched are skipped; this is safe to call from a worker thread.
+        Domains can be provided (e.g. as records returned by
+        DomainSnapshot.refresh), otherwise the domain snapshot is used."""
+        with self._lock:
+            feature_names = [name for name in feature_names
+                             if name not in self._fetched]
+            template_feature_names = [
+                name for name in template_feature_names
+                if name not in self._template_fetched]
+            if not feature_names and not template_feature_names and \
+                    self._lists_fetched:
+                return
+            generations = dict(self._generations)
+
+        def _fetch_vm(vm):
+            features = set(vm.features)
+            values = {name: self._get_value(vm, name)
+                      for name in feature_names}
+            template_values = {name: self._get_template_value(vm, name)
+                               for name in template_feature_names}
+            template = getattr(vm, 'template', None)
+            return str(vm), features, values, template_values, \
+                str(template) if template else None
+
+        with ThreadPoolExecutor(max_workers=self.MAX_WORKERS,
+                                thread_name_prefix='qubes-config-features') \
+                as executor:
+            results = list(executor.map(
+                _fetch_vm, domains if domains is not None
+                else get_domain_snapshot(self.qapp)))
+
+        with self._lock:
+            for vm_name, features, values, template_values, template \
+                    in results:
+                if template:
+                    self._templates[vm_name] = template
+                if self._generations.get(vm_name, 0) != \
+                        generations.get(vm_name, 0):
+                    # invalidated while fetching; fetched again on first use
+                    continue
+                self._lists[vm_name] = features
+                self._values.setdefault(vm_name, {}).update(values)
+                self._template_values.setdefault(vm_name, {}).update(
+                    template_values)
+            self._fetched.update(feature_names)
+            self._template_fetched.update(template_feature_names)
+            self._lists_fetched = True
+
+    @staticmethod
+    def _get_value(vm, feature_name: str) -> Any:
+        return get_feature(vm, feature_name, _ABSENT)
+
+    @staticmethod
+    def _get_template_value(vm, feature_name: str) -> Any:
+        try:
+            return vm.features.check_with_template(feature_name, _ABSENT)
+        except qubesadmin.exc.QubesDaemonAccessError:
+            return _ABSENT
+
+    def get_feature(self, vm, feature_name: str, default_value=None) -> Any:
+        """Get feature value, or default_value if it's not set; works
+        like get_feature function."""
+        with self._lock:
+            value = self._values.get(str(vm), {}).get(feature_name, None)
+        if value is None:
+            value = self._get_value(vm, feature_name)
+            with self._lock:
+                self._values.setdefault(str(vm), {})[feature_name] = value
+        return default_value if value is _ABSENT else value
+
+    def get_boolean_feature(self, vm, feature_name: str,
+                            default: bool = False) -> bool:
+        """Get feature converted to bool, if it exists; works like
+        get_boolean_feature function."""
+        result = self.get_feature(vm, feature_name, None)
+        if result is None:
+            return default
+        return bool(result)
+
+    def check_with_template(self, vm, feature_name: str,
+                            default_value=None) -> Any:
+        """Get feature value, taking into account the vm's template, or
+        default_value if it's not set; works like
+        vm.features.check_with_template."""
+        with self._lock:
+            value = self._template_values.get(str(vm), {}).get(
+                feature_name, None)
+        if value is None:
+            value = self._get_template_value(vm, feature_name)
+            with self._lock:
+                self._template_values.setdefault(
+                    str(vm), {})[feature_name] = value
+        return default_value if value is _ABSENT else value
+
+    def has_feature(self, vm, feature_name: str) -> bool:
+        """Check if a feature is set on the vm, like feature_name in
+        vm.features."""
+        with self._lock:
+            features = self._lists.get(str(vm), None)
+        if features is None:
+            features = set(vm.features)
+            with self._lock:
+                self._lists[str(vm)] = features
+        return feature_name in features
+
+    def get_current_value(self, vm, feature_name: str) -> Optional[str]:
+        """Get raw value of a feature (or None if it's not set), using
+        already fetched value if available and checking the feature list
+        otherwise, to avoid asking for features the vm does not have."""
+        with self._lock:
+            value = self._values.get(str(vm), {}).get(feature_name, None)
+        if value is None:
+            if not self.has_feature(vm, feature_name):
+                return None
+            return self.get_feature(vm, feature_name, None)
+        return None if value is _ABSENT else value
+
+    def invalidate(self, vm, feature_name: str):
+        """Forget cached information about a given feature of a given vm."""
+        with self._lock:
+            self._values.get(str(vm), {}).pop(feature_name, None)
+            self._lists.pop(str(vm), None)
+            # features are inherited from templates, so domains based
+            # on this one (directly or not) are affected as well
+            affected = {str(vm)}
+            while True:
+                based_on_affected = {
+                    name for name, template in self._templates.items()
+                    if template in affected} - affected
+                if not based_on_affected:
+                    break
+                affected |= based_on_affected
+            for name in affected:
+                self._template_values.get(name, {}).pop(feature_name, None)
+                self._generations[name] = self._generations.get(name, 0) + 1
+
+    def _feature_changed(self, subject, _event, feature, **_kwargs):
+        if subject is not None:
+            self.invalidate(subject, feature)
+
+
+_feature_snapshots: \
+    'weakref.WeakKeyDictionary[qubesadmin.Qubes, FeatureSnapshot]' = \
+    weakref.WeakKeyDictionary()
+
+
+def get_feature_snapshot(qapp: qubesadmin.Qubes) -> FeatureSnapshot:
+    """Get the shared FeatureSnapshot for a given Qubes object."""
+    if qapp not in _feature_snapshots:
+        _feature_snapshots[qapp] = FeatureSnapshot(qapp)
+    return _feature_snapshots[qapp]
+
+
+class FeatureChangeError(qubesadmin.exc.QubesException):
+    """Some of the requested feature changes failed; failures maps
+    (vm name, feature name) to error message. Changes not listed there
+    were applied."""
+    def __init__(self, failures: Dict[Tuple[str, str], str]):
+        self.failures = failures
+        super().__init__(
+            "Failed to change settings for the following qubes:\n" +
+            "\n".join(f"{vm} ({feature}): {error}"
+                      for (vm, feature), error in failures.items()))
+
+
+def _feature_value_to_str(value: Any) -> str:
+    # mirrors how qubesadmin stores feature values
+    if value is True:
+        return '1'
+    if value is False:
+        return ''
+    return str(value)
+
+
+def apply_feature_changes(
+        qapp: qubesadmin.Qubes,
+        desired_state: Dict[Any, Dict[str, Optional[Any]]],
+        progress_callback: Optional[Callable[[int, int], None]] = None,
+        max_workers: int = 8) -> List[Any]:
+    """
+    Bring features of multiple vms to the desired state. Only actual changes
+    (compared with current state, see FeatureSnapshot) are sent, in parallel.
+    :param qapp: Qubes object
+    :param desired_state: dict of vm: {feature name: desired value};
+    None as desired value means that the feature should not be set
+    :param progress_callback: function called before the first and after
+    every finished change, with number of finished changes and number of all
+    changes as arguments
+    :param max_workers: maximum number of concurrent Admin API calls
+    :return: list of vms that were changed
+    :raises FeatureChangeError: if any of the changes failed; all other
+    changes are still applied
+    """
+    features = get_feature_snapshot(qapp)
+    changes = []
+    for vm, vm_features in desired_state.items():
+        for feature_name, value in vm_features.items():
+            current_value = features.get_current_value(vm, feature_name)
+            if value is None:
+                if current_value is None:
+                    continue
+            elif current_value == _feature_value_to_str(value):
+                continue
+            changes.append((vm, feature_name, value))
+
+    if not changes:
+        return []
+
+    failures: Dict[Tuple[str, str], str] = {}
+    changed_vms = []
+    if progress_callback:
+        progress_callback(0, len(changes))
+    with ThreadPoolExecutor(max_workers=max_workers,
+                            thread_name_prefix='qubes-config-features') \
+            as executor:
+        futures = {executor.submit(apply_feature_change, *change): change
+                   for change in changes}
+        for done, future in enumerate(as_completed(futures), start=1):
+            vm, feature_name, _value = futures[future]
+            try:
+                future.result()
+                if vm not in changed_vms:
+                    changed_vms.append(vm)
+            except qubesadmin.exc.QubesException as ex:
+                failures[(str(vm), feature_name)] = str(ex)
+            if progress_callback:
+                progress_callback(done, len(changes))
+
+    if failures:
+        raise FeatureChangeError(failures)
+    return changed_vms
 
 
 class BiDictionary(dict):
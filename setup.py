@@ -1,6 +1,21 @@
 #!/usr/bin/env python3
 ''' Setup.py file '''
+import subprocess
 import setuptools.command.install
+import setuptools.command.build_py
+
+
+class BuildPyCommand(setuptools.command.build_py.build_py):
+    '''Compile UI files, stylesheets and icons into a GResource bundle
+    before building the package.'''
+    def run(self):
+        subprocess.check_call(['glib-compile-resources',
+                               '--sourcedir=qubes_config',
+                               '--sourcedir=icons',
+                               '--target=qubes_config/qubes-config.gresource',
+                               'qubes_config/qubes-config.gresource.xml'])
+        super().run()
+
 
 setuptools.setup(name='qubes_config',
                  version='0.1',
@@ -16,9 +31,12 @@ setuptools.setup(name='qubes_config',
                          'qubes-global-config = qubes_config.global_config.global_config:main'
                      ]
                  },
+                 cmdclass={'build_py': BuildPyCommand},
                  package_data={
-                     'qubes_config': ["new_qube.glade",
+                     'qubes_config': ["qubes-config.gresource",
+                                      "new_qube.glade",
                                       "global_config.glade",
+                                      "global_config_pages/*.glade",
                                       "qubes-new-qube-base.css",
                                       "qubes-new-qube-light.css",
                                       "qubes-new-qube-dark.css",